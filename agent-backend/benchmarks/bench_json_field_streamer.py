@@ -0,0 +1,65 @@
+"""Throughput of the streaming JSON field extractor used by `/chat/stream`.
+
+Feeds a synthetic LLM reply (long text fields with escapes, CJK and emoji,
+plus nested params) in chunks of several sizes and reports MB/s.
+
+Run from repo root: `python agent-backend/benchmarks/bench_json_field_streamer.py [path/to/main.py]`
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+
+def _load_module(path: Path):
+    os.environ["AGENT_BACKEND_DISABLE_STARTUP"] = "1"
+
+    spec = importlib.util.spec_from_file_location("agent_backend_main", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _payload(target_bytes: int) -> str:
+    para = 'BTC 区间震荡，建议网格 "tight" 5%-8% \\ 止损 😀\n'
+    reps = max(1, target_bytes // (3 * len(para.encode())))
+    plan = {
+        "intent": "grid",
+        "params": {"symbol": "BTCUSDT", "levels": list(range(50)), "meta": {"k": "v {[]}"}},
+        "assistant_text": para * reps,
+        "rationale": para * reps,
+        "risk_notes": [para] * reps,
+    }
+    return json.dumps(plan, ensure_ascii=False)
+
+
+def _make_feeder(mod):
+    if hasattr(mod, "_JsonStringFieldStreamer"):
+        streamer = mod._JsonStringFieldStreamer(("assistant_text", "rationale", "risk_notes"))
+        return streamer.feed
+    extractor = mod._AssistantTextJsonExtractor()
+    return extractor.feed
+
+
+def main() -> None:
+    default = Path(__file__).resolve().parents[1] / "main.py"
+    mod = _load_module(Path(sys.argv[1]) if len(sys.argv) > 1 else default)
+
+    raw = _payload(8 * 1024 * 1024)
+    size_mb = len(raw.encode()) / 1e6
+    print(f"payload: {size_mb:.1f} MB")
+    for chunk in (16, 256, 4096, 65536):
+        chunks = [raw[i : i + chunk] for i in range(0, len(raw), chunk)]
+        feed = _make_feeder(mod)
+        t0 = time.perf_counter()
+        for c in chunks:
+            feed(c)
+        elapsed = time.perf_counter() - t0
+        print(f"chunk={chunk:>6} chars  {size_mb / elapsed:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Per-request session store cost as the number of idle sessions grows.
+
+Run from repo root: `python agent-backend/benchmarks/bench_session_store.py`
+"""
+
+import asyncio
+import importlib.util
+import os
+import time
+from pathlib import Path
+
+
+def _load_module():
+    os.environ["AGENT_BACKEND_DISABLE_STARTUP"] = "1"
+
+    path = Path(__file__).resolve().parents[1] / "main.py"
+    spec = importlib.util.spec_from_file_location("agent_backend_main", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+async def _bench(mod, idle_sessions: int, requests: int) -> float:
+    store = mod._InMemorySessionStore(ttl_seconds=3600, max_sessions=idle_sessions + requests)
+    now = time.time()
+    for i in range(idle_sessions):
+        store._entries[f"idle-{i}"] = mod._SessionEntry(memory=mod.InMemoryMemory(), last_access_unix_s=now)
+
+    t0 = time.perf_counter()
+    for i in range(requests):
+        sid = f"active-{i % 64}"
+        memory = await store.load_memory(sid)
+        await store.save_memory(sid, memory)
+    return (time.perf_counter() - t0) / requests
+
+
+def main() -> None:
+    mod = _load_module()
+    requests = 2000
+    print(f"{'idle_sessions':>14} {'us/request':>12}")
+    for n in (1_000, 10_000, 100_000):
+        per_req = asyncio.run(_bench(mod, n, requests))
+        print(f"{n:>14} {per_req * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Time-to-first-token and per-delta latency of `/chat/stream`.
+
+A fake streaming model emits deltas on a fixed schedule; the benchmark
+reads the SSE body iterator directly and reports how long each delta took
+to reach the client after the model produced it.
+
+Run from repo root: `python agent-backend/benchmarks/bench_sse_ttft.py [path/to/main.py]`
+"""
+
+import asyncio
+import importlib.util
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+
+def _load_module(path: Path):
+    os.environ["AGENT_BACKEND_DISABLE_STARTUP"] = "1"
+    os.environ["AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS"] = "0"
+    os.environ["AGENT_BACKEND_UPSTREAM_STREAMING"] = "1"
+
+    spec = importlib.util.spec_from_file_location("agent_backend_main", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class _FakeFormatter:
+    async def format(self, msgs, **kwargs):
+        return [{"role": m.role, "content": m.content} for m in msgs]
+
+
+def _streaming_model(mod, produced_at: list[float], deltas: int, gap_s: float):
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=True)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            async def _gen():
+                acc = '{"assistant_text": "'
+                for i in range(deltas):
+                    await asyncio.sleep(gap_s)
+                    acc += f"tok{i} "
+                    produced_at.append(time.perf_counter())
+                    yield SimpleNamespace(content=[{"type": "text", "text": acc}])
+                acc += '", "intent": "chat", "params": {}, "actions": []}'
+                yield SimpleNamespace(content=[{"type": "text", "text": acc}])
+
+            return _gen()
+
+    return FakeModel()
+
+
+async def _run_once(mod, deltas: int, gap_s: float) -> tuple[float, list[float]]:
+    produced_at: list[float] = []
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=_streaming_model(mod, produced_at, deltas, gap_s), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    t0 = time.perf_counter()
+    resp = await mod.chat_stream(None, mod.ChatRequest(user_input="hello", session_id="bench"))
+    received_at: list[float] = []
+    ttft = None
+    async for part in resp.body_iterator:
+        if part.startswith("event: chunk"):
+            now = time.perf_counter()
+            received_at.append(now)
+            if ttft is None:
+                ttft = now - t0
+        if part.startswith("event: done"):
+            break
+    lags = [r - p for p, r in zip(produced_at, received_at)]
+    return ttft or 0.0, lags
+
+
+def main() -> None:
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parents[1] / "main.py"
+    mod = _load_module(path)
+    runs, deltas, gap_s = 10, 20, 0.03
+
+    ttfts: list[float] = []
+    lags: list[float] = []
+    for _ in range(runs):
+        ttft, run_lags = asyncio.run(_run_once(mod, deltas, gap_s))
+        ttfts.append(ttft)
+        lags.extend(run_lags)
+
+    print(f"model first delta after {gap_s * 1000:.0f} ms, {deltas} deltas/run, {runs} runs")
+    print(f"ttft        mean={statistics.mean(ttfts) * 1000:7.1f} ms  max={max(ttfts) * 1000:7.1f} ms")
+    print(f"delta lag   mean={statistics.mean(lags) * 1000:7.1f} ms  max={max(lags) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
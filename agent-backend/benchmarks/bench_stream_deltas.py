@@ -0,0 +1,90 @@
+"""Cost of turning a streamed model reply into text deltas in `_call_model`.
+
+A fake streaming model yields 10k cumulative chunks (agentscope style: each
+chunk carries the full text so far); the benchmark times `_call_model` with a
+no-op delta callback, so the number is the per-chunk overhead of the delta path.
+
+Run from repo root: `python agent-backend/benchmarks/bench_stream_deltas.py [path/to/main.py]`
+"""
+
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+
+def _load_module(path: Path):
+    os.environ["AGENT_BACKEND_DISABLE_STARTUP"] = "1"
+
+    spec = importlib.util.spec_from_file_location("agent_backend_main", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class _FakeFormatter:
+    async def format(self, msgs, **kwargs):
+        return [{"role": m.role, "content": m.content} for m in msgs]
+
+
+def _streaming_model(mod, chunks: list[SimpleNamespace]):
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=True)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            async def _gen():
+                for c in chunks:
+                    yield c
+
+            return _gen()
+
+    return FakeModel()
+
+
+def _cumulative_chunks(n: int, piece: str, blocks: int) -> list[SimpleNamespace]:
+    # Prebuilt so the model itself costs nothing during the timed run. With
+    # several blocks, the earlier ones are complete and the last one grows.
+    head = [{"type": "text", "text": f"block {b} " * 8} for b in range(blocks - 1)]
+    out = []
+    acc = ""
+    for _ in range(n):
+        acc += piece
+        out.append(SimpleNamespace(content=[*head, {"type": "text", "text": acc}]))
+    return out
+
+
+async def _run(mod, chunks: list[SimpleNamespace]) -> tuple[float, int]:
+    bundle = mod._ModelBundle(model=_streaming_model(mod, chunks), formatter=_FakeFormatter())
+    received = 0
+
+    async def on_delta(d: str) -> None:
+        nonlocal received
+        received += len(d)
+
+    msgs = [mod.Msg(name="user", role="user", content="hi")]
+    t0 = time.perf_counter()
+    await mod._call_model(bundle=bundle, msgs=msgs, toolkit=None, on_text_delta=on_delta)
+    return time.perf_counter() - t0, received
+
+
+def main() -> None:
+    default = Path(__file__).resolve().parents[1] / "main.py"
+    mod = _load_module(Path(sys.argv[1]) if len(sys.argv) > 1 else default)
+    mod.logger.disabled = True
+
+    for blocks in (1, 2):
+        for n in (1_000, 10_000):
+            chunks = _cumulative_chunks(n, "token_" * 4, blocks)
+            elapsed, received = asyncio.run(_run(mod, chunks))
+            print(
+                f"blocks={blocks} chunks={n:>6}  total={elapsed * 1000:8.1f} ms  "
+                f"per_chunk={elapsed / n * 1e6:7.2f} us  chars={received}"
+            )
+
+
+if __name__ == "__main__":
+    main()
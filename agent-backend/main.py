@@ -1,6 +1,9 @@
+import abc
 import asyncio
 import collections.abc
 import decimal
+import hashlib
+import heapq
 import inspect
 import contextlib
 import json
@@ -8,11 +11,14 @@ import logging
 import math
 import os
 import re
+import sqlite3
 import statistics
+import threading
 import time
+import urllib.parse
 import uuid
 from enum import Enum
-from typing import Any
+from typing import Any, Iterable
 
 import numpy as np
 import talib
@@ -27,25 +33,87 @@ from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, StreamingResponse
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from web3 import Web3
 
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # optional: without it every span below is a no-op
+    otel_trace = None
+
 app = FastAPI()
 logger = logging.getLogger("agent-backend")
 
+_LOCAL_OTLP_TRACES_URL = "http://localhost:4318/v1/traces"
+
+
 # Placeholder for AgentScope Initialization
 def init_agents():
     load_dotenv()
+    tracing_url = os.getenv("AGENT_BACKEND_TRACING_URL")
+    if not tracing_url and os.getenv("AGENT_BACKEND_TRACING_LOCAL", "0").strip().lower() in {"1", "true", "yes"}:
+        tracing_url = _LOCAL_OTLP_TRACES_URL
+    # AgentScope installs the OTLP exporter for `tracing_url`; the spans opened
+    # through `_span` below go to the same global tracer provider.
     agentscope.init(
         project=os.getenv("AGENT_BACKEND_PROJECT", "paix"),
         name=os.getenv("AGENT_BACKEND_RUN_NAME", "agent-backend"),
         logging_path=os.getenv("AGENT_BACKEND_LOG_PATH"),
         logging_level=os.getenv("AGENT_BACKEND_LOG_LEVEL", "INFO"),
         studio_url=os.getenv("AGENT_BACKEND_STUDIO_URL"),
-        tracing_url=os.getenv("AGENT_BACKEND_TRACING_URL"),
+        tracing_url=tracing_url,
     )
 
 
+class _NoSpan:
+    """Stand-in span when opentelemetry is not installed."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict[str, Any]) -> None:
+        pass
+
+    def end(self, end_time: int | None = None) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _tracer() -> Any | None:
+    if otel_trace is None:
+        return None
+    return otel_trace.get_tracer("agent-backend")
+
+
+def _span_attributes(attributes: dict[str, Any] | None) -> dict[str, Any]:
+    return {k: v for k, v in (attributes or {}).items() if v is not None}
+
+
+@contextlib.contextmanager
+def _span(
+    name: str,
+    attributes: dict[str, Any] | None = None,
+    start_time: int | None = None,
+) -> collections.abc.Iterator[Any]:
+    """Open a span as the current one; nested spans (also in tasks created inside) become its children."""
+    tracer = _tracer()
+    if tracer is None:
+        yield _NO_SPAN
+        return
+    with tracer.start_as_current_span(name, attributes=_span_attributes(attributes), start_time=start_time) as span:
+        yield span
+
+
+def _start_span(name: str, attributes: dict[str, Any] | None = None, start_time: int | None = None) -> Any:
+    """Start a span under the current one without making it current; the caller must `end()` it."""
+    tracer = _tracer()
+    if tracer is None:
+        return _NO_SPAN
+    return tracer.start_span(name, attributes=_span_attributes(attributes), start_time=start_time)
+
+
 class Action(BaseModel):
     type: str
     params: dict[str, Any] = Field(default_factory=dict)
@@ -104,6 +172,22 @@ def _demo_strategy_label(action_type: str | None) -> str:
 class ChatRequest(BaseModel):
     user_input: str
     session_id: str | None = None
+    # Set to false to always ask the LLM instead of reusing a cached strategy reply.
+    use_cache: bool = True
+
+
+class StrategyPlan(BaseModel):
+    """JSON reply schema the strategy prompts ask the LLM for."""
+
+    assistant_text: str = ""
+    intent: str = "chat"
+    params: dict[str, Any] = Field(default_factory=dict)
+    rationale: str = ""
+    risk_notes: list[str] = Field(default_factory=list)
+    actions: list[Action] = Field(default_factory=list)
+
+    class Config:
+        extra = "allow"
 
 
 class ChatResponse(BaseModel):
@@ -479,162 +563,874 @@ class _CrossChainService:
         return await self.store.apply_inbound(inbound)
 
 
-class _AssistantTextJsonExtractor:
-    def __init__(self) -> None:
-        self._key = '"assistant_text"'
-        self._buf = ""
-        self._found_key = False
-        self._saw_colon = False
-        self._in_string = False
-        self._escape = False
-        self._unicode_buf: str | None = None
-        self._done = False
-
-    def feed(self, raw: str) -> str:
-        if self._done or not raw:
-            return ""
-
-        self._buf += raw
-        out_chars: list[str] = []
+# Longest prefix of string content made of plain chars and well-formed escapes.
+_JSON_STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\]*)*')
+_JSON_STRING_ITEMS_RE = re.compile(r'(?:[\s,]*"[^"\\]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\]*)*")+')
+_JSON_HIGH_SURROGATE_TAIL_RE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+_JSON_HEX_PREFIX_RE = re.compile(r"[0-9a-fA-F]{0,4}")
+_JSON_LONE_SURROGATE_RE = re.compile("[\ud800-\udfff]")
+_JSON_NESTED_SPECIAL_RE = re.compile(r'["{}\[\]]')
+_JSON_SCALAR_END_RE = re.compile(r"[,}]")
 
-        i = 0
-        while i < len(self._buf):
-            ch = self._buf[i]
-
-            if not self._found_key:
-                idx = self._buf.find(self._key, i)
-                if idx == -1:
-                    keep = max(0, len(self._buf) - (len(self._key) - 1))
-                    self._buf = self._buf[keep:]
-                    return "".join(out_chars)
-                i = idx + len(self._key)
-                self._found_key = True
-                continue
 
-            if not self._saw_colon:
-                if ch == ":":
-                    self._saw_colon = True
-                i += 1
-                continue
+def _decode_json_string_run(run: str) -> str:
+    text = json.decoder.scanstring(run + '"', 0, False)[0]
+    # scanstring joins valid surrogate pairs; anything left over is unpaired.
+    if _JSON_LONE_SURROGATE_RE.search(text):
+        text = _JSON_LONE_SURROGATE_RE.sub("\ufffd", text)
+    return text
 
-            if not self._in_string:
-                if ch == '"':
-                    self._in_string = True
-                i += 1
-                continue
 
-            if self._unicode_buf is not None:
-                self._unicode_buf += ch
-                i += 1
-                if len(self._unicode_buf) >= 4:
-                    try:
-                        out_chars.append(chr(int(self._unicode_buf[:4], 16)))
-                    except Exception:
-                        pass
-                    self._unicode_buf = None
-                continue
+def _is_escape_start(s: str, lo: int, j: int) -> bool:
+    """Whether the backslash at `s[j]` begins an escape (even run of backslashes before it)."""
+    k = j
+    while k > lo and s[k - 1] == "\\":
+        k -= 1
+    return (j - k) % 2 == 0
+
+
+class _JsonStringFieldStreamer:
+    """Incremental tokenizer for the top-level JSON object of a streamed LLM reply.
+
+    `feed` returns the newly decoded text of the selected top-level fields. String
+    values stream as they arrive; for an array of strings (e.g. `risk_notes`) the
+    items are streamed one per line. Fields in `value_fields` are instead parsed
+    whole and queued for `pop_values` the moment their value completes; for an
+    array, each object/array item is queued as soon as it closes. Anything before
+    the first `{` (prose, code fences) is skipped, and parsing stops once the
+    top-level object closes.
 
-            if self._escape:
-                self._escape = False
-                if ch == "n":
-                    out_chars.append("\n")
-                elif ch == "t":
-                    out_chars.append("\t")
-                elif ch == "r":
-                    out_chars.append("\r")
-                elif ch == '"':
-                    out_chars.append('"')
-                elif ch == "\\":
-                    out_chars.append("\\")
-                elif ch == "u":
-                    self._unicode_buf = ""
+    Plain runs are sliced in bulk with regex scans, so the cost is linear in the
+    input; only a split escape sequence (at most 12 chars) is carried between feeds.
+    """
+
+    _PRE, _KEY_WAIT, _KEY, _COLON, _VALUE_WAIT, _STRING, _SCALAR, _NESTED, _DONE = range(9)
+
+    def __init__(self, fields: Iterable[str], value_fields: Iterable[str] = ()) -> None:
+        self._fields = frozenset(fields)
+        self._value_fields = frozenset(value_fields)
+        self._state = self._PRE
+        self._carry = ""
+        self._key_parts: list[str] = []
+        # Selected field whose value is being decoded, or None when skipping.
+        self._field: str | None = None
+        # Depth inside a nested top-level value; strings inside it are tracked so
+        # brackets in string content are not counted.
+        self._depth = 0
+        self._nested_in_string = False
+        self._items_emitted = 0
+        # Value field whose array items are being captured.
+        self._items_field: str | None = None
+        # Raw text of the value being captured: earlier feeds plus `s[_capture_start:]`.
+        self._capture_field: str | None = None
+        self._capture_start: int | None = None
+        self._capture_parts: list[str] = []
+        self._values: list[tuple[str, Any]] = []
+
+    @property
+    def done(self) -> bool:
+        return self._state == self._DONE
+
+    def pop_values(self) -> list[tuple[str, Any]]:
+        """Completed `(field, value)` pairs from `value_fields`, in stream order."""
+        values, self._values = self._values, []
+        return values
+
+    def feed(self, raw: str) -> dict[str, str]:
+        if self._state == self._DONE or not raw:
+            return {}
+        s = self._carry + raw if self._carry else raw
+        self._carry = ""
+        out: dict[str, list[str]] = {}
+        n = len(s)
+        i = 0
+        while i < n:
+            state = self._state
+            if state == self._STRING:
+                parts = None if self._field is None else out.setdefault(self._field, [])
+                i, closed = self._scan_string(s, i, parts)
+                if closed:
+                    self._state = self._KEY_WAIT
+                    if self._capture_start is not None:
+                        self._end_capture(s, i)
+            elif state == self._NESTED:
+                if self._nested_in_string:
+                    parts = None if self._field is None or self._depth != 1 else out.setdefault(self._field, [])
+                    i, closed = self._scan_string(s, i, parts)
+                    if closed:
+                        self._nested_in_string = False
+                    continue
+                if self._field is not None and self._depth == 1:
+                    i = self._take_string_items(s, i, out.setdefault(self._field, []))
+                m = _JSON_NESTED_SPECIAL_RE.search(s, i)
+                if m is None:
+                    break
+                ch = m.group()
+                i = m.end()
+                if ch == '"':
+                    self._nested_in_string = True
+                    if self._field is not None and self._depth == 1:
+                        if self._items_emitted:
+                            out.setdefault(self._field, []).append("\n")
+                        self._items_emitted += 1
+                elif ch in "{[":
+                    if self._items_field is not None and self._depth == 1:
+                        self._start_capture(self._items_field, i - 1)
+                    self._depth += 1
                 else:
-                    out_chars.append(ch)
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._state = self._KEY_WAIT
+                        self._items_field = None
+                    if self._capture_start is not None and self._depth == (1 if self._items_field else 0):
+                        self._end_capture(s, i)
+            elif state == self._PRE:
+                j = s.find("{", i)
+                if j == -1:
+                    break
+                i = j + 1
+                self._state = self._KEY_WAIT
+            elif state == self._KEY_WAIT:
+                ch = s[i]
                 i += 1
-                continue
-
-            if ch == "\\":
-                self._escape = True
+                if ch == '"':
+                    self._key_parts = []
+                    self._state = self._KEY
+                elif ch == "}":
+                    self._state = self._DONE
+                    break
+            elif state == self._KEY:
+                i, closed = self._scan_string(s, i, self._key_parts)
+                if closed:
+                    self._state = self._COLON
+            elif state == self._COLON:
+                if s[i] == ":":
+                    self._state = self._VALUE_WAIT
+                i += 1
+            elif state == self._VALUE_WAIT:
+                ch = s[i]
                 i += 1
+                if ch in " \t\r\n":
+                    continue
+                key = "".join(self._key_parts)
+                self._field = key if key in self._fields else None
+                if key in self._value_fields:
+                    if ch == "[":
+                        self._items_field = key
+                    else:
+                        self._start_capture(key, i - 1)
+                if ch == '"':
+                    self._state = self._STRING
+                elif ch == "[" and self._field is not None:
+                    self._state = self._NESTED
+                    self._depth = 1
+                    self._items_emitted = 0
+                elif ch in "{[":
+                    self._field = None
+                    self._state = self._NESTED
+                    self._depth = 1
+                else:
+                    self._state = self._SCALAR
+            else:  # _SCALAR
+                m = _JSON_SCALAR_END_RE.search(s, i)
+                if m is None:
+                    break
+                if self._capture_start is not None:
+                    self._end_capture(s, m.start())
+                i = m.end()
+                self._state = self._DONE if m.group() == "}" else self._KEY_WAIT
+                if self._state == self._DONE:
+                    break
+        if self._capture_start is not None:
+            # Keep the captured prefix; a carried escape is re-read next feed.
+            self._capture_parts.append(s[self._capture_start : n - len(self._carry)])
+            self._capture_start = 0
+        return {k: "".join(v) for k, v in out.items() if v}
+
+    def _start_capture(self, field: str, start: int) -> None:
+        self._capture_field = field
+        self._capture_start = start
+        self._capture_parts = []
+
+    def _end_capture(self, s: str, end: int) -> None:
+        raw = "".join(self._capture_parts) + s[self._capture_start : end]
+        try:
+            self._values.append((self._capture_field, json.loads(raw, strict=False)))
+        except ValueError:
+            pass
+        self._capture_field = None
+        self._capture_start = None
+        self._capture_parts = []
+
+    def _take_string_items(self, s: str, i: int, parts: list[str]) -> int:
+        """Decode a run of complete array items in one `json.loads` call."""
+        m = _JSON_STRING_ITEMS_RE.match(s, i)
+        if m is None:
+            return i
+        try:
+            items = json.loads("[" + m.group().lstrip(" \t\r\n,") + "]", strict=False)
+        except ValueError:
+            return i
+        text = "\n".join(items)
+        if self._items_emitted:
+            text = "\n" + text
+        self._items_emitted += len(items)
+        if _JSON_LONE_SURROGATE_RE.search(text):
+            text = _JSON_LONE_SURROGATE_RE.sub("\ufffd", text)
+        parts.append(text)
+        return m.end()
+
+    def _scan_string(self, s: str, i: int, parts: list[str] | None) -> tuple[int, bool]:
+        """Consume string content from `s[i:]`; returns (next index, closed).
+
+        The longest run of well-formed content is matched by one regex and
+        decoded by the C `scanstring`; only malformed escapes take the slow path.
+        """
+        n = len(s)
+        while True:
+            e = _JSON_STRING_BODY_RE.match(s, i).end()
+            if e < n and s[e] == '"':
+                if parts is not None and e > i:
+                    parts.append(_decode_json_string_run(s[i:e]))
+                return e + 1, True
+            # Past `e` is either the end of the chunk or a backslash starting an
+            # escape that is cut off or malformed.
+            tail = s[e + 1 : e + 6]
+            if e == n or not tail or (tail[0] == "u" and n - e < 6 and _JSON_HEX_PREFIX_RE.fullmatch(tail[1:])):
+                cut = e
+                # Hold back a high surrogate until its low half has arrived.
+                if _JSON_HIGH_SURROGATE_TAIL_RE.search(s, max(i, e - 6), e) and _is_escape_start(s, i, e - 6):
+                    cut = e - 6
+                if parts is not None and cut > i:
+                    parts.append(_decode_json_string_run(s[i:cut]))
+                self._carry = s[cut:]
+                return n, False
+            if parts is not None and e > i:
+                parts.append(_decode_json_string_run(s[i:e]))
+            if tail[0] == "u":
+                if parts is not None:
+                    parts.append("\ufffd")
+                i = e + 2 + len(_JSON_HEX_PREFIX_RE.match(tail, 1).group())
+            else:
+                if parts is not None:
+                    parts.append(tail[0])
+                i = e + 2
+
+
+def _sse_event(event: str, payload: dict[str, Any], event_id: int | None = None) -> str:
+    data = json.dumps(payload, ensure_ascii=False)
+    if event_id is not None:
+        return f"event: {event}\nid: {event_id}\ndata: {data}\n\n"
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class _StreamRun:
+    """Event log of one `/chat/stream` computation, shared by every client attached to it.
+
+    The producer appends SSE frames whose `id` is their position in the log
+    (the same number as the payload's `sequence`). A follower replays the log
+    from a given id and then waits for new frames, so a retried request that
+    attaches mid-way, or a reconnect with `Last-Event-ID`, gets every event it
+    missed. The computation does not depend on any connection: it runs to the
+    end even if all followers leave. Only the last `max_frames` frames are
+    kept; a follower asking for older ones first gets a `replay_gap` event
+    (the final `done` still carries the full text).
+    """
+
+    def __init__(self, max_frames: int = 2048) -> None:
+        self.frames: collections.deque[str] = collections.deque(maxlen=max(1, max_frames))
+        self.next_id = 0
+        self.closed = False
+        self.task: asyncio.Task[None] | None = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, payload: dict[str, Any]) -> None:
+        self.frames.append(_sse_event(event, payload, self.next_id))
+        self.next_id += 1
+        self._notify()
+
+    def close(self) -> None:
+        self.closed = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, keepalive_s: float, start_id: int = 0) -> collections.abc.AsyncIterator[str]:
+        yield ": connected\n\n"
+        next_id = start_id
+        while True:
+            # Re-read the bounds every time: frames may be appended (and old
+            # ones evicted) while this generator is suspended at a yield.
+            oldest = self.next_id - len(self.frames)
+            if next_id < oldest:
+                yield _sse_event("replay_gap", {"from_id": next_id, "to_id": oldest})
+                next_id = oldest
+                continue
+            if next_id < self.next_id:
+                frame = self.frames[next_id - oldest]
+                next_id += 1
+                yield frame
                 continue
+            if self.closed:
+                return
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=keepalive_s if keepalive_s > 0 else None)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
 
-            if ch == '"':
-                self._done = True
-                i += 1
-                self._buf = self._buf[i:]
-                return "".join(out_chars)
 
-            out_chars.append(ch)
-            i += 1
+# `/chat/stream` runs by (session_id, user_input): in flight, and for
+# AGENT_BACKEND_STREAM_RESUME_TTL_SECONDS after finishing so reconnects can resume.
+STREAM_RUNS: dict[tuple[str, str], _StreamRun] = {}
 
-        self._buf = ""
-        return "".join(out_chars)
 
+def _forget_stream_run(key: tuple[str, str], run: _StreamRun) -> None:
+    if STREAM_RUNS.get(key) is run:
+        del STREAM_RUNS[key]
 
-def _sse_event(event: str, payload: dict[str, Any]) -> str:
-    data = json.dumps(payload, ensure_ascii=False)
-    return f"event: {event}\ndata: {data}\n\n"
+
+def _parse_last_event_id(http_request: Request | None) -> int | None:
+    raw = http_request.headers.get("last-event-id") if http_request is not None else None
+    try:
+        return int(raw) if raw is not None else None
+    except ValueError:
+        return None
 
 
-def _chunk_text(text: str, chunk_size: int) -> list[str]:
-    if chunk_size <= 0:
-        return [text]
-    if not text:
-        return [""]
-    return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+_STREAMED_REPLY_FIELDS = ("assistant_text", "rationale", "risk_notes")
+_STREAMED_REPLY_VALUES = ("intent", "actions")
+
+
+def _streamed_action(item: Any) -> dict[str, Any] | None:
+    """Normalize one streamed `actions` item the same way `_execution_preview` does."""
+    if not isinstance(item, dict):
+        return None
+    norm_type = _normalize_demo_action_type(item.get("type"))
+    if norm_type is None:
+        return None
+    params = item.get("params")
+    action = Action(type=norm_type, params=params if isinstance(params, dict) else {})
+    return {
+        "action": action.model_dump(),
+        "strategy_type": norm_type,
+        "strategy_label": _demo_strategy_label(norm_type),
+    }
+
+
+def _market_ack_text(symbol: str, interval: str) -> str:
+    """Opening line streamed while the market snapshot is still loading."""
+    return f"收到，正在获取 {symbol} 最新 {interval} K 线与指标，结合行情给出策略建议…\n\n"
 
 
 class _SessionEntry(BaseModel):
-    memory_state: dict[str, Any]
+    memory: InMemoryMemory
+    # Number of leading messages of `memory` already handed to the backend.
+    persisted_count: int = 0
     last_access_unix_s: float
+    # Rolling summary of messages[:summary_upto], maintained by `_ConversationContext`.
+    summary: str = ""
+    summary_upto: int = 0
+
+    class Config:
+        arbitrary_types_allowed = True
 
 
-class _InMemorySessionStore:
-    def __init__(self, ttl_seconds: int) -> None:
+class _SessionBackend(abc.ABC):
+    """Durable, append-only message log behind `_InMemorySessionStore`.
+
+    Each write is a delta `{"start": int, "messages": [msg dicts], "replace": bool,
+    "last_access_unix_s": float}` where `start` is the index of the first message
+    in the session log. Writes are idempotent so a failed batch can be retried.
+    The store only calls `load` on a cache miss and `append_many` from its
+    write-behind flusher, never on the response path.
+    """
+
+    @abc.abstractmethod
+    async def load(self, session_id: str) -> list[dict[str, Any]] | None: ...
+
+    @abc.abstractmethod
+    async def append_many(self, deltas: dict[str, dict[str, Any]]) -> None: ...
+
+    @abc.abstractmethod
+    async def delete(self, session_id: str) -> None: ...
+
+    async def close(self) -> None:
+        return None
+
+
+class _SqliteSessionBackend(_SessionBackend):
+    def __init__(self, path: str, ttl_seconds: int) -> None:
+        self._path = path
+        self._ttl_seconds = ttl_seconds
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._db_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_meta ("
+                "session_id TEXT PRIMARY KEY, "
+                "last_access_unix_s REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS session_meta_last_access ON session_meta (last_access_unix_s)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_messages ("
+                "session_id TEXT NOT NULL, "
+                "seq INTEGER NOT NULL, "
+                "msg TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, seq))"
+            )
+
+    def _load_sync(self, session_id: str) -> list[dict[str, Any]] | None:
+        with self._db_lock:
+            meta = self._conn.execute(
+                "SELECT last_access_unix_s FROM session_meta WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if meta is None or time.time() - float(meta[0]) > self._ttl_seconds:
+                return None
+            rows = self._conn.execute(
+                "SELECT msg FROM session_messages WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def _append_many_sync(self, deltas: dict[str, dict[str, Any]]) -> None:
+        cutoff = time.time() - self._ttl_seconds
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                for sid, d in deltas.items():
+                    if d.get("replace"):
+                        self._conn.execute("DELETE FROM session_messages WHERE session_id = ?", (sid,))
+                    start = int(d["start"])
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO session_messages (session_id, seq, msg) VALUES (?, ?, ?)",
+                        [
+                            (sid, start + i, json.dumps(m, ensure_ascii=False))
+                            for i, m in enumerate(d["messages"])
+                        ],
+                    )
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO session_meta (session_id, last_access_unix_s) VALUES (?, ?)",
+                        (sid, float(d["last_access_unix_s"])),
+                    )
+                self._conn.execute(
+                    "DELETE FROM session_messages WHERE session_id IN "
+                    "(SELECT session_id FROM session_meta WHERE last_access_unix_s < ?)",
+                    (cutoff,),
+                )
+                self._conn.execute("DELETE FROM session_meta WHERE last_access_unix_s < ?", (cutoff,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _delete_sync(self, session_id: str) -> None:
+        with self._db_lock:
+            self._conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM session_meta WHERE session_id = ?", (session_id,))
+
+    async def load(self, session_id: str) -> list[dict[str, Any]] | None:
+        return await asyncio.to_thread(self._load_sync, session_id)
+
+    async def append_many(self, deltas: dict[str, dict[str, Any]]) -> None:
+        if deltas:
+            await asyncio.to_thread(self._append_many_sync, deltas)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._delete_sync, session_id)
+
+    async def close(self) -> None:
+        with self._db_lock:
+            self._conn.close()
+
+
+class _RedisSessionBackend(_SessionBackend):
+    """Minimal RESP2 client; speaks only the handful of commands it needs.
+
+    Each session is a hash of `seq -> msg json`, so re-sending a delta after a
+    failed flush overwrites instead of duplicating.
+    """
+
+    def __init__(self, url: str, ttl_seconds: int, key_prefix: str = "paix:session:") -> None:
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in {"redis", ""}:
+            raise ValueError(f"unsupported redis url scheme: {parsed.scheme}")
+        self._host = parsed.hostname or "127.0.0.1"
+        self._port = int(parsed.port or 6379)
+        self._password = urllib.parse.unquote(parsed.password) if parsed.password else None
+        db_path = (parsed.path or "").strip("/")
+        self._db = int(db_path) if db_path else 0
         self._ttl_seconds = ttl_seconds
-        self._entries: dict[str, _SessionEntry] = {}
-        self._locks: dict[str, asyncio.Lock] = {}
-        self._global_lock = asyncio.Lock()
+        self._key_prefix = key_prefix
+        self._conn_lock = asyncio.Lock()
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    def _key(self, session_id: str) -> str:
+        return f"{self._key_prefix}{session_id}"
+
+    @staticmethod
+    def _encode(*args: str | bytes | int) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            if isinstance(a, bytes):
+                b = a
+            else:
+                b = str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        return b"".join(out)
+
+    async def _read_reply(self) -> Any:
+        if self._reader is None:
+            raise ConnectionError("redis not connected")
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode("utf-8")
+        if prefix == b"-":
+            # Returned, not raised: the caller still has to drain the rest of the pipeline.
+            return RuntimeError(f"redis_error: {rest.decode('utf-8', 'replace')}")
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = await self._reader.readexactly(n + 2)
+            return data[:-2]
+        if prefix == b"*":
+            n = int(rest)
+            if n < 0:
+                return None
+            return [await self._read_reply() for _ in range(n)]
+        raise RuntimeError(f"redis_protocol_error: {line!r}")
+
+    async def _ensure_connected(self) -> None:
+        if self._writer is not None and not self._writer.is_closing():
+            return
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        if self._password:
+            await self._pipeline([("AUTH", self._password)])
+        if self._db:
+            await self._pipeline([("SELECT", self._db)])
+
+    async def _pipeline(self, commands: list[tuple[Any, ...]]) -> list[Any]:
+        assert self._writer is not None
+        self._writer.write(b"".join(self._encode(*c) for c in commands))
+        await self._writer.drain()
+        replies = [await self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RuntimeError):
+                raise reply
+        return replies
+
+    async def _execute(self, commands: list[tuple[Any, ...]]) -> list[Any]:
+        async with self._conn_lock:
+            try:
+                await self._ensure_connected()
+                return await self._pipeline(commands)
+            except BaseException:
+                # Any failure (error reply, failed AUTH/SELECT, cancellation
+                # mid-pipeline) may leave replies unread or the connection in
+                # an unknown state: drop it so the next command starts clean.
+                await self._reset()
+                raise
+
+    async def _reset(self) -> None:
+        writer = self._writer
+        self._reader = None
+        self._writer = None
+        if writer is not None:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def load(self, session_id: str) -> list[dict[str, Any]] | None:
+        (flat,) = await self._execute([("HGETALL", self._key(session_id))])
+        if not flat:
+            return None
+        pairs = sorted((int(flat[i]), flat[i + 1]) for i in range(0, len(flat), 2))
+        return [json.loads(raw) for _, raw in pairs]
+
+    async def append_many(self, deltas: dict[str, dict[str, Any]]) -> None:
+        if not deltas:
+            return
+        ttl = max(1, int(self._ttl_seconds))
+        commands: list[tuple[Any, ...]] = []
+        for sid, d in deltas.items():
+            key = self._key(sid)
+            if d.get("replace"):
+                commands.append(("DEL", key))
+            start = int(d["start"])
+            fields: list[Any] = []
+            for i, m in enumerate(d["messages"]):
+                fields.extend([start + i, json.dumps(m, ensure_ascii=False)])
+            if fields:
+                commands.append(("HSET", key, *fields))
+            commands.append(("EXPIRE", key, ttl))
+        await self._execute(commands)
+
+    async def delete(self, session_id: str) -> None:
+        await self._execute([("DEL", self._key(session_id))])
+
+    async def close(self) -> None:
+        async with self._conn_lock:
+            await self._reset()
+
+
+class _SessionLockRegistry:
+    """Per-session locks that only exist while someone holds or waits on them.
+
+    Slots are refcounted and dropped on last release, so anonymous one-shot
+    session ids never accumulate. No global lock is needed: creating and
+    releasing a slot happens without an `await`, which is atomic on the loop.
+    """
+
+    def __init__(self) -> None:
+        self._slots: dict[str, list[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, session_id: str) -> collections.abc.AsyncIterator[None]:
+        slot = self._slots.get(session_id)
+        if slot is None:
+            slot = [asyncio.Lock(), 0]
+            self._slots[session_id] = slot
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0 and self._slots.get(session_id) is slot:
+                del self._slots[session_id]
+
+
+def _merge_session_deltas(older: dict[str, Any], newer: dict[str, Any]) -> dict[str, Any]:
+    if newer.get("replace"):
+        return newer
+    older_end = int(older["start"]) + len(older["messages"])
+    overlap = older_end - int(newer["start"])
+    return {
+        "start": older["start"],
+        "messages": older["messages"] + newer["messages"][max(0, overlap):],
+        "replace": bool(older.get("replace")),
+        "last_access_unix_s": max(float(older["last_access_unix_s"]), float(newer["last_access_unix_s"])),
+    }
 
-    async def _get_lock(self, session_id: str) -> asyncio.Lock:
-        async with self._global_lock:
-            lock = self._locks.get(session_id)
-            if lock is None:
-                lock = asyncio.Lock()
-                self._locks[session_id] = lock
-            return lock
 
-    async def get_session_lock(self, session_id: str) -> asyncio.Lock:
-        return await self._get_lock(session_id)
+class _InMemorySessionStore:
+    def __init__(
+        self,
+        ttl_seconds: int,
+        backend: _SessionBackend | None = None,
+        flush_interval_s: float = 0.05,
+        max_sessions: int = 0,
+    ) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._max_sessions = max_sessions
+        # Ordered by last access (oldest first) so expiry and LRU eviction only
+        # ever look at the head instead of scanning every session.
+        self._entries: collections.OrderedDict[str, _SessionEntry] = collections.OrderedDict()
+        self._locks = _SessionLockRegistry()
+        self._backend = backend
+        self._flush_interval_s = flush_interval_s
+        # Write-behind buffer: unflushed message deltas per session.
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._inflight: dict[str, dict[str, Any]] = {}
+        self._flush_task: asyncio.Task | None = None
+
+    def session_lock(self, session_id: str) -> contextlib.AbstractAsyncContextManager[None]:
+        return self._locks.hold(session_id)
 
     async def load_memory(self, session_id: str) -> InMemoryMemory:
+        """Return the live memory object for a session.
+
+        Callers mutate it in place (under the session lock) and hand it back to
+        `save_memory`; there is no per-turn copy of the history.
+        """
         await self.cleanup_expired()
         entry = self._entries.get(session_id)
-        memory = InMemoryMemory()
         if entry is not None:
-            memory.load_state_dict(entry.memory_state)
+            entry.last_access_unix_s = time.time()
+            self._entries.move_to_end(session_id)
+            return entry.memory
+
+        memory = InMemoryMemory()
+        persisted_count = 0
+        if self._backend is not None:
+            if session_id in self._pending or session_id in self._inflight:
+                # Evicted before its write-behind batch landed.
+                with contextlib.suppress(Exception):
+                    await self.flush()
+            try:
+                records = await self._backend.load(session_id)
+            except Exception as e:
+                logger.warning("session backend load failed sid=%s err=%s", session_id, e)
+                records = None
+            if records:
+                await _maybe_await(memory.add([Msg.from_dict(r) for r in records]))
+                persisted_count = len(records)
+        self._put_entry(
+            session_id,
+            _SessionEntry(memory=memory, persisted_count=persisted_count, last_access_unix_s=time.time()),
+        )
         return memory
 
     async def save_memory(self, session_id: str, memory: InMemoryMemory) -> None:
-        self._entries[session_id] = _SessionEntry(
-            memory_state=memory.state_dict(),
-            last_access_unix_s=time.time(),
-        )
+        now = time.time()
+        entry = self._entries.get(session_id)
+        if entry is None or entry.memory is not memory:
+            # Entry was evicted (or replaced) mid-request: rewrite the full log.
+            entry = _SessionEntry(memory=memory, persisted_count=0, last_access_unix_s=now)
+            replace = True
+        else:
+            entry.last_access_unix_s = now
+            replace = False
+        self._put_entry(session_id, entry)
+        if self._backend is None:
+            return
+
+        msgs = await _get_memory_msgs(memory)
+        if len(msgs) < entry.persisted_count:
+            entry.persisted_count = 0
+            replace = True
+        new_msgs = msgs[entry.persisted_count:]
+        delta = {
+            "start": entry.persisted_count,
+            "messages": [m.to_dict() for m in new_msgs],
+            "replace": replace,
+            "last_access_unix_s": now,
+        }
+        entry.persisted_count = len(msgs)
+        existing = self._pending.get(session_id)
+        self._pending[session_id] = delta if existing is None else _merge_session_deltas(existing, delta)
+        self._schedule_flush()
+
+    def get_history_summary(self, session_id: str) -> tuple[str, int] | None:
+        entry = self._entries.get(session_id)
+        if entry is None or not entry.summary:
+            return None
+        return entry.summary, entry.summary_upto
+
+    def set_history_summary(self, session_id: str, summary: str, upto: int) -> None:
+        entry = self._entries.get(session_id)
+        if entry is not None and upto >= entry.summary_upto:
+            entry.summary = summary
+            entry.summary_upto = upto
+
+    def _put_entry(self, session_id: str, entry: _SessionEntry) -> None:
+        self._entries[session_id] = entry
+        self._entries.move_to_end(session_id)
+        if self._max_sessions > 0:
+            while len(self._entries) > self._max_sessions:
+                # Evicted sessions stay recoverable from the backend (or the
+                # pending write-behind batch) on their next request.
+                self._entries.popitem(last=False)
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        delay_s = self._flush_interval_s
+        while self._pending:
+            if delay_s > 0:
+                await asyncio.sleep(delay_s)
+            try:
+                await self._flush_pending()
+                delay_s = self._flush_interval_s
+            except Exception:
+                delay_s = min(5.0, max(delay_s * 2, 0.5))
+
+    async def _flush_pending(self) -> None:
+        if self._backend is None or not self._pending:
+            return
+        batch = self._pending
+        self._pending = {}
+        self._inflight = batch
+        try:
+            await self._backend.append_many(batch)
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                logger.warning("session backend flush failed n=%d err=%s", len(batch), e)
+            # Put the batch back in front of any newer deltas for the same session.
+            for sid, delta in batch.items():
+                newer = self._pending.get(sid)
+                self._pending[sid] = delta if newer is None else _merge_session_deltas(delta, newer)
+            raise
+        finally:
+            self._inflight = {}
+
+    async def flush(self) -> None:
+        task = self._flush_task
+        if task is not None and not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
+        await self._flush_pending()
+
+    async def close(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            if self._backend is not None:
+                await self._backend.close()
 
     async def cleanup_expired(self) -> None:
+        # Amortized O(1): every entry is popped at most once after it expires.
         now = time.time()
-        expired: list[str] = []
-        for sid, entry in self._entries.items():
-            if now - entry.last_access_unix_s > self._ttl_seconds:
-                expired.append(sid)
-        for sid in expired:
-            self._entries.pop(sid, None)
-            self._locks.pop(sid, None)
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.last_access_unix_s <= self._ttl_seconds:
+                break
+            self._entries.popitem(last=False)
+
+
+def _load_session_store() -> _InMemorySessionStore:
+    ttl_seconds = int(os.getenv("AGENT_BACKEND_SESSION_TTL_SECONDS", "1800"))
+    flush_interval_s = float(os.getenv("AGENT_BACKEND_SESSION_FLUSH_INTERVAL_MS", "50")) / 1000.0
+    max_sessions = int(os.getenv("AGENT_BACKEND_SESSION_MAX_SESSIONS", "10000"))
+    kind = os.getenv("AGENT_BACKEND_SESSION_BACKEND", "memory").strip().lower()
+
+    backend: _SessionBackend | None
+    if kind == "memory":
+        backend = None
+    elif kind == "sqlite":
+        path = os.getenv("AGENT_BACKEND_SESSION_SQLITE_PATH", "agent_backend_sessions.sqlite3").strip()
+        backend = _SqliteSessionBackend(path, ttl_seconds=ttl_seconds)
+    elif kind == "redis":
+        url = os.getenv("AGENT_BACKEND_SESSION_REDIS_URL", "redis://127.0.0.1:6379/0").strip()
+        backend = _RedisSessionBackend(url, ttl_seconds=ttl_seconds)
+    else:
+        raise RuntimeError(f"Unsupported AGENT_BACKEND_SESSION_BACKEND: {kind}")
+
+    return _InMemorySessionStore(
+        ttl_seconds=ttl_seconds,
+        backend=backend,
+        flush_interval_s=flush_interval_s,
+        max_sessions=max_sessions,
+    )
 
 
 class _ModelBundle(BaseModel):
     model: ChatModelBase
     formatter: Any
+    # `AGENT_BACKEND_MODEL_PROVIDER` the bundle was built for; enables provider-specific request tweaks.
+    provider: str = ""
+    # Backends tried in order (and hedged) when this one is slow or fails; see `_call_model`.
+    fallbacks: list["_ModelBundle"] = Field(default_factory=list)
 
     class Config:
         arbitrary_types_allowed = True
@@ -738,104 +1534,482 @@ def _load_amm_config() -> dict[str, str]:
     }
 
 
-def _load_cex_config() -> dict[str, Any]:
-    return {
-        "binance_base_url": os.getenv("AGENT_BACKEND_BINANCE_BASE_URL", _DEFAULT_BINANCE_BASE_URL).strip(),
-        "default_quote": os.getenv("AGENT_BACKEND_CEX_DEFAULT_QUOTE", _DEFAULT_CEX_DEFAULT_QUOTE).strip().upper(),
-        "timeout_s": float(os.getenv("AGENT_BACKEND_CEX_TIMEOUT_SECONDS", "10")),
-        "kline_interval": os.getenv("AGENT_BACKEND_CEX_KLINE_INTERVAL", "1h").strip(),
-        "kline_limit": int(os.getenv("AGENT_BACKEND_CEX_KLINE_LIMIT", "200")),
-    }
+class _UpstreamError(Exception):
+    """An upstream dependency (LLM provider, Binance, EVM RPC) failed; maps to an HTTP error."""
 
+    status_code = 502
+    code = "upstream_error"
+    message = "Upstream request failed."
 
-def _w3(rpc_url: str) -> Web3:
-    timeout_s = float(os.getenv("AGENT_BACKEND_EVM_RPC_TIMEOUT_SECONDS", "10"))
-    return Web3(Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": timeout_s}))
+    def __init__(self, upstream: str, message: str | None = None, code: str | None = None) -> None:
+        super().__init__(message or self.message)
+        self.upstream = upstream
+        if message:
+            self.message = message
+        if code:
+            self.code = code
 
 
-def _to_wei(amount: str, decimals: int) -> int:
-    ctx = decimal.Context(prec=60)
-    d = ctx.create_decimal(amount)
-    scale = ctx.create_decimal(10) ** ctx.create_decimal(decimals)
-    return int((d * scale).to_integral_value(rounding=decimal.ROUND_DOWN))
+class _UpstreamTimeout(_UpstreamError):
+    status_code = 504
+    code = "upstream_timeout"
+    message = "Upstream LLM request timed out. Check network/proxy and DEEPSEEK_BASE_URL."
 
 
-def _from_wei(amount_wei: int, decimals: int) -> str:
-    ctx = decimal.Context(prec=60)
-    d = ctx.create_decimal(amount_wei)
-    scale = ctx.create_decimal(10) ** ctx.create_decimal(decimals)
-    return format(d / scale, "f")
+class _UpstreamNetworkError(_UpstreamError):
+    status_code = 502
+    code = "upstream_network_error"
+    message = "Upstream connection was reset. Check network/proxy and DEEPSEEK_BASE_URL."
 
 
-async def get_amm_market_snapshot(
-    amount_in: str,
-    token_in: str | None = None,
-    token_out: str | None = None,
-    rpc_url: str = "",
-    router: str = "",
-    pair: str = "",
-    default_token_a: str = "",
-    default_token_b: str = "",
-) -> ToolResponse:
-    """Get an on-chain AMM (Uniswap V2) market snapshot and quote.
+class _UpstreamUnavailable(_UpstreamError):
+    """Raised without calling the upstream while its circuit breaker is open."""
 
-    Args:
-        amount_in (str): Amount in human-readable units (e.g. "1.5").
-        token_in (str | None): Optional ERC20 address. If omitted, uses default TokenA.
-        token_out (str | None): Optional ERC20 address. If omitted, uses default TokenB.
-    """
+    status_code = 503
+    code = "upstream_unavailable"
+    message = "Upstream is temporarily unavailable. Try again shortly."
 
-    try:
-        if not rpc_url or not router or not pair or not default_token_a or not default_token_b:
-            raise ValueError("missing preset configuration")
 
-        token_in_addr = token_in or default_token_a
-        token_out_addr = token_out or default_token_b
+class _AdmissionRejected(_UpstreamError):
+    """Raised when a provider's LLM slots and wait queue are full, or the wait for a slot times out."""
 
-        w3 = _w3(rpc_url)
-        router_c = w3.eth.contract(address=Web3.to_checksum_address(router), abi=_UNISWAP_V2_ROUTER_ABI)
-        pair_c = w3.eth.contract(address=Web3.to_checksum_address(pair), abi=_UNISWAP_V2_PAIR_ABI)
+    status_code = 429
+    code = "rate_limited"
+    message = "Too many concurrent requests. Retry later."
 
-        token0 = pair_c.functions.token0().call()
-        token1 = pair_c.functions.token1().call()
-        reserves = pair_c.functions.getReserves().call()
-        reserve0 = int(reserves[0])
-        reserve1 = int(reserves[1])
+    def __init__(self, upstream: str, retry_after_s: int) -> None:
+        super().__init__(upstream)
+        self.retry_after_s = retry_after_s
 
-        token_in_c = w3.eth.contract(address=Web3.to_checksum_address(token_in_addr), abi=_ERC20_ABI)
-        token_out_c = w3.eth.contract(address=Web3.to_checksum_address(token_out_addr), abi=_ERC20_ABI)
-        decimals_in = int(token_in_c.functions.decimals().call())
-        decimals_out = int(token_out_c.functions.decimals().call())
 
-        try:
-            symbol_in = str(token_in_c.functions.symbol().call())
-        except Exception:
-            symbol_in = ""
+def _classify_upstream_exception(e: BaseException, upstream: str) -> _UpstreamError | None:
+    """Map a client/SDK exception to an `_UpstreamError` by type; None if it is not an upstream fault.
 
-        try:
-            symbol_out = str(token_out_c.functions.symbol().call())
-        except Exception:
-            symbol_out = ""
+    SDK exception classes (openai, anthropic, requests via web3) are matched by
+    class name so their packages need not be importable here.
+    """
+    if isinstance(e, _UpstreamError):
+        return e
+    names = {cls.__name__ for cls in type(e).__mro__}
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError, httpx.TimeoutException)) or any("Timeout" in n for n in names):
+        return _UpstreamTimeout(upstream)
+    if isinstance(e, (httpx.TransportError, ConnectionError)) or names & {"APIConnectionError", "ConnectionError"}:
+        return _UpstreamNetworkError(upstream)
+    status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else getattr(e, "status_code", None)
+    if isinstance(status, int) and (status >= 500 or status == 429):
+        return _UpstreamError(upstream, f"Upstream returned HTTP {status}.")
+    return None
 
-        amount_in_wei = _to_wei(amount_in, decimals_in)
-        amounts_out = router_c.functions.getAmountsOut(amount_in_wei, [token_in_addr, token_out_addr]).call()
-        amount_out_wei = int(amounts_out[-1])
 
-        snapshot = {
-            "ok": True,
-            "source": "amm_uniswap_v2",
-            "network": {"rpc_url": rpc_url},
-            "contracts": {
-                "router": router,
-                "pair": pair,
+def _upstream_http_exception(e: BaseException) -> HTTPException | None:
+    err = _classify_upstream_exception(e, "")
+    if err is None:
+        return None
+    headers = {"Retry-After": str(err.retry_after_s)} if isinstance(err, _AdmissionRejected) else None
+    return HTTPException(status_code=err.status_code, detail={"code": err.code, "message": err.message}, headers=headers)
+
+
+class _CircuitBreaker:
+    """Per-upstream circuit breaker with a latency-derived timeout.
+
+    Outcomes of the last `window` calls are kept; once at least `min_calls` are
+    recorded and the failure share reaches `failure_rate` the breaker opens and
+    calls fail fast with `_UpstreamUnavailable` for `open_s` seconds. After that
+    a single probe call is let through: success closes the breaker, failure
+    re-opens it. Only upstream faults (timeouts, connection errors, 5xx/429)
+    count as failures.
+
+    The timeout of each call is `timeout_factor` x the p99 of recent latencies
+    of the same `kind` of call (short and long requests to one upstream do not
+    share a window), floored at `min_timeout_s` and capped by the caller's
+    static timeout, so a degraded upstream is cut off well before the static
+    limit. Timed-out calls add their elapsed time to the window, so the bound
+    grows back when slower replies become normal.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 50,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        open_s: float = 15.0,
+        timeout_factor: float = 3.0,
+        min_timeout_s: float = 2.0,
+    ) -> None:
+        self.name = name
+        self._min_calls = min_calls
+        self._failure_rate = failure_rate
+        self._open_s = open_s
+        self._timeout_factor = timeout_factor
+        self._min_timeout_s = min_timeout_s
+        self._window = window
+        self._outcomes: collections.deque[bool] = collections.deque(maxlen=window)
+        self._latencies: dict[str, collections.deque[float]] = {}
+        self._open_until: float | None = None
+        self._probing = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._open_until is None:
+            return "closed"
+        return "half_open" if time.monotonic() >= self._open_until else "open"
+
+    def timeout_s(self, ceiling_s: float, kind: str = "default") -> float:
+        """Effective timeout for the next call of `kind`; `ceiling_s` <= 0 means no timeout."""
+        if ceiling_s <= 0:
+            return 0.0
+        latencies = self._latencies.get(kind)
+        if latencies is None or len(latencies) < self._min_calls:
+            return ceiling_s
+        ordered = sorted(latencies)
+        p99 = ordered[min(len(ordered) - 1, math.ceil(0.99 * len(ordered)) - 1)]
+        return min(ceiling_s, max(self._min_timeout_s, p99 * self._timeout_factor))
+
+    def _acquire(self) -> bool:
+        """Whether a call may proceed; True when it is the half-open probe."""
+        if self._open_until is None:
+            return False
+        if time.monotonic() >= self._open_until and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        raise _UpstreamUnavailable(self.name)
+
+    def _record(self, ok: bool, latency_s: float | None, probe: bool, kind: str = "default") -> None:
+        if probe:
+            self._probing = False
+            if ok:
+                self._open_until = None
+                self._outcomes.clear()
+            else:
+                self._open_until = time.monotonic() + self._open_s
+                logger.warning("circuit %s re-opened after failed probe", self.name)
+        self._outcomes.append(ok)
+        if latency_s is not None:
+            latencies = self._latencies.get(kind)
+            if latencies is None:
+                latencies = self._latencies[kind] = collections.deque(maxlen=self._window)
+            latencies.append(latency_s)
+        if self._open_until is None and len(self._outcomes) >= self._min_calls:
+            failures = self._outcomes.count(False)
+            if failures / len(self._outcomes) >= self._failure_rate:
+                self._open_until = time.monotonic() + self._open_s
+                logger.warning("circuit %s opened: %d/%d recent calls failed", self.name, failures, len(self._outcomes))
+
+    async def call(
+        self,
+        fn: collections.abc.Callable[[], collections.abc.Awaitable[Any]],
+        ceiling_s: float = 0.0,
+        kind: str = "default",
+    ) -> Any:
+        probe = self._acquire()
+        timeout_s = self.timeout_s(ceiling_s, kind)
+        started = time.monotonic()
+        try:
+            if timeout_s > 0:
+                res = await asyncio.wait_for(fn(), timeout=timeout_s)
+            else:
+                res = await fn()
+        except asyncio.CancelledError:
+            if probe:
+                self._probing = False
+            raise
+        except Exception as e:
+            err = _classify_upstream_exception(e, self.name)
+            if err is None:
+                # Not an upstream fault (bad input, parse error): says nothing about its health.
+                if probe:
+                    self._probing = False
+                raise
+            # A timeout's elapsed time is a lower bound on the real latency.
+            latency_s = time.monotonic() - started if isinstance(err, _UpstreamTimeout) else None
+            self._record(False, latency_s, probe, kind)
+            if err is e:
+                raise
+            raise err from e
+        self._record(True, time.monotonic() - started, probe, kind)
+        return res
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "calls": len(self._outcomes),
+            "failures": self._outcomes.count(False),
+            "rejected": self.rejected,
+            "timeout_s": {
+                kind: round(self.timeout_s(float("inf"), kind), 3)
+                for kind, latencies in sorted(self._latencies.items())
+                if len(latencies) >= self._min_calls
             },
-            "pair": {
-                "token0": token0,
-                "token1": token1,
+        }
+
+
+UPSTREAM_BREAKERS: dict[str, _CircuitBreaker] = {}
+
+
+class _NoBreaker:
+    """Stand-in when AGENT_BACKEND_BREAKER=0: calls go straight through with the static timeout."""
+
+    async def call(
+        self,
+        fn: collections.abc.Callable[[], collections.abc.Awaitable[Any]],
+        ceiling_s: float = 0.0,
+        kind: str = "default",
+    ) -> Any:
+        if ceiling_s > 0:
+            return await asyncio.wait_for(fn(), timeout=ceiling_s)
+        return await fn()
+
+
+def _upstream_breaker(name: str) -> "_CircuitBreaker | _NoBreaker":
+    if os.getenv("AGENT_BACKEND_BREAKER", "1").strip().lower() in {"0", "false", "no"}:
+        return _NoBreaker()
+    breaker = UPSTREAM_BREAKERS.get(name)
+    if breaker is None:
+        breaker = UPSTREAM_BREAKERS[name] = _CircuitBreaker(
+            name,
+            window=int(os.getenv("AGENT_BACKEND_BREAKER_WINDOW", "50")),
+            min_calls=int(os.getenv("AGENT_BACKEND_BREAKER_MIN_CALLS", "10")),
+            failure_rate=float(os.getenv("AGENT_BACKEND_BREAKER_FAILURE_RATE", "0.5")),
+            open_s=float(os.getenv("AGENT_BACKEND_BREAKER_OPEN_SECONDS", "15")),
+            timeout_factor=float(os.getenv("AGENT_BACKEND_ADAPTIVE_TIMEOUT_FACTOR", "3")),
+            min_timeout_s=float(os.getenv("AGENT_BACKEND_ADAPTIVE_TIMEOUT_MIN_SECONDS", "2")),
+        )
+    return breaker
+
+
+class _AdmissionLimiter:
+    """Caps concurrent LLM calls to one provider, with a bounded priority wait queue.
+
+    Callers beyond `max_concurrent` wait in a heap ordered by (priority, arrival);
+    lower priority values go first. Once `max_queue` callers are waiting, new
+    normal-priority callers are rejected with `_AdmissionRejected` (HTTP 429)
+    instead of piling up, while priority 0 (follow-up calls of a tool loop that
+    is already running) may always queue so in-flight conversations finish.
+    Waiting longer than `max_wait_s` is also rejected. Background callers
+    (jobs, summaries) are never rejected: they wait behind everyone else as
+    long as it takes, and do not count towards `max_queue`.
+    """
+
+    PRIORITY_TOOL_LOOP = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_BACKGROUND = 2
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait_s: float = 0.0) -> None:
+        self.name = name
+        self._max_concurrent = max(1, max_concurrent)
+        self._max_queue = max(0, max_queue)
+        self._max_wait_s = max_wait_s
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._seq = 0
+        # EWMA of how long a slot is held; drives Retry-After.
+        self._avg_hold_s = 5.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def queued(self, foreground_only: bool = False) -> int:
+        return sum(
+            1
+            for priority, _, fut in self._waiters
+            if not fut.done() and not (foreground_only and priority >= self.PRIORITY_BACKGROUND)
+        )
+
+    def saturated(self) -> bool:
+        return self._active >= self._max_concurrent and self.queued(foreground_only=True) >= self._max_queue
+
+    def retry_after_s(self) -> int:
+        backlog = self.queued(foreground_only=True) + 1
+        return max(1, min(60, math.ceil(backlog * self._avg_hold_s / self._max_concurrent)))
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # hand the slot over; `_active` is unchanged
+                return
+        self._active -= 1
+
+    async def _acquire(self, priority: int) -> None:
+        if self._active < self._max_concurrent and not self.queued():
+            self._active += 1
+            return
+        background = priority >= self.PRIORITY_BACKGROUND
+        if self.PRIORITY_TOOL_LOOP < priority < self.PRIORITY_BACKGROUND and self.queued(foreground_only=True) >= self._max_queue:
+            self.rejected += 1
+            raise _AdmissionRejected(self.name, self.retry_after_s())
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, fut))
+        try:
+            if self._max_wait_s > 0 and not background:
+                await asyncio.wait_for(fut, timeout=self._max_wait_s)
+            else:
+                await fut
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise _AdmissionRejected(self.name, self.retry_after_s()) from None
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                self._release()  # the slot arrived together with our cancellation
+            else:
+                fut.cancel()
+            raise
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL) -> collections.abc.AsyncIterator[None]:
+        await self._acquire(priority)
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._avg_hold_s = 0.8 * self._avg_hold_s + 0.2 * (time.monotonic() - started)
+            self._release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "active": self._active,
+            "queued": self.queued(),
+            "max_concurrent": self._max_concurrent,
+            "max_queue": self._max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+LLM_LIMITERS: dict[str, _AdmissionLimiter] = {}
+
+
+def _llm_limiter(provider: str) -> _AdmissionLimiter | None:
+    """Per-provider LLM admission limiter; None when AGENT_BACKEND_LLM_MAX_CONCURRENCY is 0."""
+    max_concurrent = int(os.getenv("AGENT_BACKEND_LLM_MAX_CONCURRENCY", "32"))
+    if max_concurrent <= 0:
+        return None
+    limiter = LLM_LIMITERS.get(provider)
+    if limiter is None:
+        limiter = LLM_LIMITERS[provider] = _AdmissionLimiter(
+            f"llm:{provider}",
+            max_concurrent=max_concurrent,
+            max_queue=int(os.getenv("AGENT_BACKEND_LLM_MAX_QUEUE", "64")),
+            max_wait_s=float(os.getenv("AGENT_BACKEND_LLM_QUEUE_TIMEOUT_SECONDS", "10")),
+        )
+    return limiter
+
+
+def _check_llm_admission(bundle: "_ModelBundle") -> None:
+    """Reject a new request up front (429 + Retry-After) when every configured backend is saturated."""
+    limiters = [_llm_limiter(b.provider) for b in (bundle, *bundle.fallbacks)]
+    if any(limiter is None or not limiter.saturated() for limiter in limiters):
+        return
+    retry_after = min(limiter.retry_after_s() for limiter in limiters if limiter is not None)
+    for limiter in limiters:
+        if limiter is not None:
+            limiter.rejected += 1
+    raise HTTPException(
+        status_code=429,
+        detail={"code": "rate_limited", "message": "Too many concurrent requests. Retry later."},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def _binance_breaker_name(base_url: str) -> str:
+    return "binance:" + (urllib.parse.urlsplit(base_url).netloc or base_url)
+
+
+def _load_cex_config() -> dict[str, Any]:
+    return {
+        "binance_base_url": os.getenv("AGENT_BACKEND_BINANCE_BASE_URL", _DEFAULT_BINANCE_BASE_URL).strip(),
+        "default_quote": os.getenv("AGENT_BACKEND_CEX_DEFAULT_QUOTE", _DEFAULT_CEX_DEFAULT_QUOTE).strip().upper(),
+        "timeout_s": float(os.getenv("AGENT_BACKEND_CEX_TIMEOUT_SECONDS", "10")),
+        "kline_interval": os.getenv("AGENT_BACKEND_CEX_KLINE_INTERVAL", "1h").strip(),
+        "kline_limit": int(os.getenv("AGENT_BACKEND_CEX_KLINE_LIMIT", "200")),
+    }
+
+
+def _w3(rpc_url: str) -> Web3:
+    timeout_s = float(os.getenv("AGENT_BACKEND_EVM_RPC_TIMEOUT_SECONDS", "10"))
+    return Web3(Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": timeout_s}))
+
+
+def _to_wei(amount: str, decimals: int) -> int:
+    ctx = decimal.Context(prec=60)
+    d = ctx.create_decimal(amount)
+    scale = ctx.create_decimal(10) ** ctx.create_decimal(decimals)
+    return int((d * scale).to_integral_value(rounding=decimal.ROUND_DOWN))
+
+
+def _from_wei(amount_wei: int, decimals: int) -> str:
+    ctx = decimal.Context(prec=60)
+    d = ctx.create_decimal(amount_wei)
+    scale = ctx.create_decimal(10) ** ctx.create_decimal(decimals)
+    return format(d / scale, "f")
+
+
+async def get_amm_market_snapshot(
+    amount_in: str,
+    token_in: str | None = None,
+    token_out: str | None = None,
+    rpc_url: str = "",
+    router: str = "",
+    pair: str = "",
+    default_token_a: str = "",
+    default_token_b: str = "",
+) -> ToolResponse:
+    """Get an on-chain AMM (Uniswap V2) market snapshot and quote.
+
+    Args:
+        amount_in (str): Amount in human-readable units (e.g. "1.5").
+        token_in (str | None): Optional ERC20 address. If omitted, uses default TokenA.
+        token_out (str | None): Optional ERC20 address. If omitted, uses default TokenB.
+    """
+
+    try:
+        if not rpc_url or not router or not pair or not default_token_a or not default_token_b:
+            raise ValueError("missing preset configuration")
+
+        token_in_addr = token_in or default_token_a
+        token_out_addr = token_out or default_token_b
+
+        def _read_chain() -> tuple[dict[str, Any], dict[str, Any]]:
+            w3 = _w3(rpc_url)
+            router_c = w3.eth.contract(address=Web3.to_checksum_address(router), abi=_UNISWAP_V2_ROUTER_ABI)
+            pair_c = w3.eth.contract(address=Web3.to_checksum_address(pair), abi=_UNISWAP_V2_PAIR_ABI)
+
+            token0 = pair_c.functions.token0().call()
+            token1 = pair_c.functions.token1().call()
+            reserves = pair_c.functions.getReserves().call()
+            reserve0 = int(reserves[0])
+            reserve1 = int(reserves[1])
+
+            token_in_c = w3.eth.contract(address=Web3.to_checksum_address(token_in_addr), abi=_ERC20_ABI)
+            token_out_c = w3.eth.contract(address=Web3.to_checksum_address(token_out_addr), abi=_ERC20_ABI)
+            decimals_in = int(token_in_c.functions.decimals().call())
+            decimals_out = int(token_out_c.functions.decimals().call())
+
+            try:
+                symbol_in = str(token_in_c.functions.symbol().call())
+            except Exception:
+                symbol_in = ""
+
+            try:
+                symbol_out = str(token_out_c.functions.symbol().call())
+            except Exception:
+                symbol_out = ""
+
+            amount_in_wei = _to_wei(amount_in, decimals_in)
+            amounts_out = router_c.functions.getAmountsOut(amount_in_wei, [token_in_addr, token_out_addr]).call()
+            amount_out_wei = int(amounts_out[-1])
+
+            pair_info = {
+                "token0": token0,
+                "token1": token1,
                 "reserve0": str(reserve0),
                 "reserve1": str(reserve1),
-            },
-            "trade": {
+            }
+            trade = {
                 "token_in": token_in_addr,
                 "token_out": token_out_addr,
                 "symbol_in": symbol_in,
@@ -846,7 +2020,23 @@ async def get_amm_market_snapshot(
                 "amount_in_wei": str(amount_in_wei),
                 "amount_out_wei": str(amount_out_wei),
                 "amount_out": _from_wei(amount_out_wei, decimals_out),
+            }
+            return pair_info, trade
+
+        # web3 is blocking: run the reads off the event loop, behind the EVM RPC breaker.
+        timeout_s = float(os.getenv("AGENT_BACKEND_EVM_RPC_TIMEOUT_SECONDS", "10"))
+        pair_info, trade = await _upstream_breaker("evm_rpc").call(lambda: asyncio.to_thread(_read_chain), timeout_s)
+
+        snapshot = {
+            "ok": True,
+            "source": "amm_uniswap_v2",
+            "network": {"rpc_url": rpc_url},
+            "contracts": {
+                "router": router,
+                "pair": pair,
             },
+            "pair": pair_info,
+            "trade": trade,
             "timestamp_unix_s": time.time(),
         }
 
@@ -1024,10 +2214,13 @@ async def get_cex_klines(
         url = base_url.rstrip("/") + "/api/v3/klines"
         params = {"symbol": symbol_norm, "interval": interval_norm, "limit": limit_norm}
 
-        async with httpx.AsyncClient(timeout=timeout_s) as client:
-            resp = await client.get(url, params=params)
-            resp.raise_for_status()
-            data = resp.json()
+        async def _fetch() -> Any:
+            async with httpx.AsyncClient(timeout=timeout_s) as client:
+                resp = await client.get(url, params=params)
+                resp.raise_for_status()
+                return resp.json()
+
+        data = await _upstream_breaker(_binance_breaker_name(base_url)).call(_fetch, timeout_s)
 
         if not isinstance(data, list):
             raise ValueError("unexpected response")
@@ -1091,10 +2284,15 @@ async def fetch_cex_market_snapshot(
 
         async def _fetch(base: str):
             url = base.rstrip("/") + "/api/v3/klines"
-            async with httpx.AsyncClient(timeout=timeout_s) as client:
-                resp = await client.get(url, params=params)
-                resp.raise_for_status()
-                return resp.json()
+
+            async def _get() -> Any:
+                async with httpx.AsyncClient(timeout=timeout_s) as client:
+                    resp = await client.get(url, params=params)
+                    resp.raise_for_status()
+                    return resp.json()
+
+            # One breaker per host, so an open primary still lets the mirror be tried.
+            return await _upstream_breaker(_binance_breaker_name(base)).call(_get, timeout_s)
 
         data = None
         last_err: Exception | None = None
@@ -1144,6 +2342,8 @@ async def fetch_cex_market_snapshot(
             "symbol": symbol_norm,
             "interval": interval,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime()),
+            # Close time of the latest (usually still open) candle.
+            "candle_close_time_ms": int(data[-1][6]),
             "price": {
                 "current": round(current_price, 2),
                 "high_24h": round(float(np.max(highs[-24:])), 2) if len(highs) >= 24 else round(float(np.max(highs)), 2),
@@ -1295,10 +2495,27 @@ def _load_model_bundle() -> _ModelBundle:
 
     provider = str(file_cfg.get("provider") or os.getenv("AGENT_BACKEND_MODEL_PROVIDER", "deepseek")).strip().lower()
     model_name = str(file_cfg.get("model_name") or os.getenv("AGENT_BACKEND_MODEL_NAME") or "").strip()
+    if not model_name and provider != "deepseek":
+        raise RuntimeError("Missing required env: AGENT_BACKEND_MODEL_NAME")
+    bundle = _build_model_bundle(provider, model_name)
+
+    # "provider[:model_name],..." e.g. "openai:gpt-4o-mini,dashscope:qwen-plus"
+    for spec in os.getenv("AGENT_BACKEND_MODEL_FALLBACKS", "").split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        fb_provider, _, fb_model_name = spec.partition(":")
+        bundle.fallbacks.append(_build_model_bundle(fb_provider.strip().lower(), fb_model_name.strip()))
+    return bundle
+
+
+def _build_model_bundle(provider: str, model_name: str) -> _ModelBundle:
     if not model_name and provider == "deepseek":
         model_name = "deepseek-chat"
     if not model_name:
-        raise RuntimeError("Missing required env: AGENT_BACKEND_MODEL_NAME")
+        raise RuntimeError(f"Missing model name for provider: {provider}")
+
+    upstream_streaming = os.getenv("AGENT_BACKEND_UPSTREAM_STREAMING", "1").strip().lower() not in {"0", "false", "no"}
 
     if provider == "deepseek":
         if not os.getenv("DEEPSEEK_API_KEY"):
@@ -1316,8 +2533,6 @@ def _load_model_bundle() -> _ModelBundle:
                 "Install with agentscope[full] or install the OpenAI client dependencies."
             ) from e
 
-        upstream_streaming = os.getenv("AGENT_BACKEND_UPSTREAM_STREAMING", "1").strip().lower() not in {"0", "false", "no"}
-
         stream_total_timeout_s = float(os.getenv("AGENT_BACKEND_STREAM_TOTAL_TIMEOUT_SECONDS", "75"))
         upstream_streaming_timeout_s = float(
             os.getenv(
@@ -1337,6 +2552,7 @@ def _load_model_bundle() -> _ModelBundle:
                 client_args={"base_url": deepseek_base_url, "timeout": client_timeout_s},
             ),
             formatter=OpenAIChatFormatter(),
+            provider=provider,
         )
 
     if provider == "openai":
@@ -1353,8 +2569,9 @@ def _load_model_bundle() -> _ModelBundle:
             ) from e
 
         return _ModelBundle(
-            model=OpenAIChatModel(model_name=model_name, stream=False),
+            model=OpenAIChatModel(model_name=model_name, stream=upstream_streaming),
             formatter=OpenAIChatFormatter(),
+            provider=provider,
         )
 
     if provider == "dashscope":
@@ -1371,8 +2588,13 @@ def _load_model_bundle() -> _ModelBundle:
             ) from e
 
         return _ModelBundle(
-            model=DashScopeChatModel(model_name=model_name, api_key=os.getenv("DASHSCOPE_API_KEY"), stream=False),
+            model=DashScopeChatModel(
+                model_name=model_name,
+                api_key=os.getenv("DASHSCOPE_API_KEY"),
+                stream=upstream_streaming,
+            ),
             formatter=DashScopeChatFormatter(),
+            provider=provider,
         )
 
     if provider == "anthropic":
@@ -1389,8 +2611,13 @@ def _load_model_bundle() -> _ModelBundle:
             ) from e
 
         return _ModelBundle(
-            model=AnthropicChatModel(model_name=model_name, api_key=os.getenv("ANTHROPIC_API_KEY"), stream=False),
+            model=AnthropicChatModel(
+                model_name=model_name,
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                stream=upstream_streaming,
+            ),
             formatter=AnthropicChatFormatter(),
+            provider=provider,
         )
 
     raise RuntimeError(f"Unsupported AGENT_BACKEND_MODEL_PROVIDER: {provider}")
@@ -1418,7 +2645,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         }
         if "details" in detail:
             payload["details"] = detail["details"]
-        return JSONResponse(status_code=exc.status_code, content=payload)
+        return JSONResponse(status_code=exc.status_code, content=payload, headers=exc.headers)
 
     return JSONResponse(
         status_code=exc.status_code,
@@ -1426,6 +2653,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "code": "http_error",
             "message": str(detail) if detail is not None else "Request failed",
         },
+        headers=exc.headers,
     )
 
 
@@ -1447,24 +2675,61 @@ def _extract_text_from_chat_response(chat_response: Any) -> str:
     return "\n".join([t for t in texts if t])
 
 
+def _text_block_text(b: Any) -> str | None:
+    if isinstance(b, dict):
+        if b.get("type") == "text" and isinstance(b.get("text"), str):
+            return b["text"]
+        return None
+    if getattr(b, "type", None) == "text":
+        t = getattr(b, "text", None)
+        return t if isinstance(t, str) else None
+    return None
+
+
 def _text_deltas_from_chat_response(res: Any) -> list[str]:
     content = getattr(res, "content", None)
     if not isinstance(content, list):
         s = str(res)
         return [s] if s else []
-    texts: list[str] = []
-    for b in content:
-        if isinstance(b, dict):
-            if b.get("type") == "text" and isinstance(b.get("text"), str):
-                texts.append(b["text"])
-        else:
-            if getattr(b, "type", None) == "text":
-                t = getattr(b, "text", None)
-                if isinstance(t, str) and t:
-                    texts.append(t)
+    texts = [_text_block_text(b) for b in content]
     return [t for t in texts if t]
 
 
+class _StreamTextDeltas:
+    """Turns cumulative streaming chunks into text deltas.
+
+    Streaming models yield the full text-so-far of every block in each chunk.
+    Only the new suffix of each block is sliced off (blocks are joined with
+    "\n", as in `_text_from_chat_response`), so the work is linear in the
+    streamed text instead of re-joining the whole reply on every chunk.
+    """
+
+    def __init__(self) -> None:
+        self._seen: list[int] = []
+        self.total_chars = 0
+
+    def feed(self, chunk: Any) -> list[str]:
+        content = getattr(chunk, "content", None)
+        texts = [_text_block_text(b) for b in content] if isinstance(content, list) else [str(chunk)]
+        deltas: list[str] = []
+        k = 0
+        for text in texts:
+            if not text:
+                continue
+            if k == len(self._seen):
+                self._seen.append(0)
+            seen = self._seen[k]
+            if len(text) > seen:
+                delta = text[seen:]
+                if seen == 0 and k > 0:
+                    delta = "\n" + delta
+                self._seen[k] = len(text)
+                self.total_chars += len(delta)
+                deltas.append(delta)
+            k += 1
+        return deltas
+
+
 def _extract_json_object(text: str) -> dict[str, Any] | None:
     stripped = text.strip()
     if not stripped:
@@ -1491,10 +2756,58 @@ def _extract_json_object(text: str) -> dict[str, Any] | None:
         try:
             return json.loads(stripped)
         except Exception:
+            pass
+    return _scan_json_object(stripped)
+
+
+def _scan_json_object(text: str, max_attempts: int = 8) -> dict[str, Any] | None:
+    """Find the first JSON object embedded in prose (e.g. text before/after the JSON)."""
+    decoder = json.JSONDecoder(strict=False)
+    idx = text.find("{")
+    for _ in range(max_attempts):
+        if idx == -1:
             return None
+        try:
+            obj, _ = decoder.raw_decode(text, idx)
+        except ValueError:
+            idx = text.find("{", idx + 1)
+            continue
+        if isinstance(obj, dict):
+            return obj
+        idx = text.find("{", idx + 1)
     return None
 
 
+def _parse_strategy_plan(text: str) -> dict[str, Any] | None:
+    """Parse an LLM reply into a plan dict, normalized by `StrategyPlan` when it validates."""
+    obj = _extract_json_object(text)
+    if obj is None:
+        return None
+    try:
+        return StrategyPlan.model_validate(obj).model_dump()
+    except ValidationError as e:
+        # Keep the raw object; downstream code tolerates missing or odd fields.
+        logger.warning("strategy plan does not match schema: %s", e.errors()[:3])
+        return obj
+
+
+def _json_mode_kwargs(bundle: _ModelBundle) -> dict[str, Any]:
+    """Provider request kwargs that force a JSON object reply, if the provider supports it."""
+    if os.getenv("AGENT_BACKEND_LLM_JSON_MODE", "1").strip().lower() in {"0", "false", "no"}:
+        return {}
+    if bundle.provider == "openai":
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "strategy_plan", "schema": StrategyPlan.model_json_schema()},
+            }
+        }
+    if bundle.provider in {"deepseek", "dashscope"}:
+        return {"response_format": {"type": "json_object"}}
+    # Anthropic has no JSON mode that keeps streaming text; rely on the prompt and parser.
+    return {}
+
+
 async def _maybe_await(value: Any) -> Any:
     if asyncio.iscoroutine(value):
         return await value
@@ -1533,87 +2846,663 @@ def _text_from_chat_response(res: Any) -> str:
     content = getattr(res, "content", None)
     if not isinstance(content, list):
         return str(res)
-    texts: list[str] = []
-    for b in content:
-        if isinstance(b, dict):
-            if b.get("type") == "text" and isinstance(b.get("text"), str):
-                texts.append(b["text"])
-        else:
-            if getattr(b, "type", None) == "text":
-                texts.append(str(getattr(b, "text", "")))
+    texts = [_text_block_text(b) for b in content]
     return "\n".join([t for t in texts if t])
 
 
+def _add_anthropic_cache_breakpoints(formatted: Any) -> None:
+    """Mark the system prompt and the end of the history for Anthropic prompt caching.
+
+    Prompts are laid out as static system prompt, then history, then the
+    per-request message, so everything up to the second-to-last message is a
+    stable prefix across turns.
+    """
+    if not isinstance(formatted, list) or not formatted:
+        return
+    targets = []
+    if isinstance(formatted[0], dict) and formatted[0].get("role") == "system":
+        targets.append(formatted[0])
+    if len(formatted) >= 3 and isinstance(formatted[-2], dict):
+        targets.append(formatted[-2])
+    for msg in targets:
+        content = msg.get("content")
+        if isinstance(content, list) and content and isinstance(content[-1], dict):
+            content[-1]["cache_control"] = {"type": "ephemeral"}
+
+
+def _usage_field(obj: Any, name: str) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _cached_input_tokens(usage: Any) -> int | None:
+    """Prompt tokens served from the provider's prefix cache, if the response reports it."""
+    meta = _usage_field(usage, "metadata")
+    if meta is None:
+        return None
+    # Anthropic, DeepSeek, then OpenAI naming.
+    for name in ("cache_read_input_tokens", "prompt_cache_hit_tokens"):
+        value = _usage_field(meta, name)
+        if isinstance(value, int):
+            return value
+    details = _usage_field(meta, "prompt_tokens_details")
+    value = _usage_field(details, "cached_tokens") if details is not None else None
+    return value if isinstance(value, int) else None
+
+
+class _LlmUsageStats:
+    """Running totals of LLM token usage, including provider prompt-cache hits."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_input_tokens = 0
+        # Input tokens of calls whose response reported a cache figure.
+        self._reported_input_tokens = 0
+
+    def record(self, usage: Any) -> None:
+        if usage is None:
+            return
+        input_tokens = _usage_field(usage, "input_tokens")
+        output_tokens = _usage_field(usage, "output_tokens")
+        input_tokens = input_tokens if isinstance(input_tokens, int) else 0
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens if isinstance(output_tokens, int) else 0
+        cached = _cached_input_tokens(usage)
+        if cached is not None:
+            self.cached_input_tokens += cached
+            self._reported_input_tokens += input_tokens
+        logger.info("llm usage: input=%d output=%s cached=%s", input_tokens, output_tokens, cached)
+
+    def stats(self) -> dict[str, Any]:
+        reported = self._reported_input_tokens
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+            "cached_ratio": round(self.cached_input_tokens / reported, 4) if reported else 0.0,
+        }
+
+
+LLM_USAGE = _LlmUsageStats()
+
+
+def _usage_span_attributes(usage: Any) -> dict[str, int]:
+    if usage is None:
+        return {}
+    out: dict[str, int] = {}
+    for attr, name in (("gen_ai.usage.input_tokens", "input_tokens"), ("gen_ai.usage.output_tokens", "output_tokens")):
+        value = _usage_field(usage, name)
+        if isinstance(value, int):
+            out[attr] = value
+    cached = _cached_input_tokens(usage)
+    if cached is not None:
+        out["gen_ai.usage.cached_input_tokens"] = cached
+    return out
+
+
+class _LatencyTracker:
+    """Rolling latency samples per key.
+
+    Keyed by LLM provider (time to first streamed text, or to the full reply),
+    its p95 drives the hedge delay in `_call_model`: a request still silent past
+    its provider's usual p95 is raced against the next configured backend. It
+    also aggregates chat pipeline stage timings (see `_ChatTurn`).
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._window = window
+        self._min_samples = min_samples
+        self._samples: dict[str, collections.deque[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = collections.deque(maxlen=self._window)
+        samples.append(seconds)
+
+    def record_error(self, key: str) -> None:
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def p95(self, key: str) -> float | None:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self._min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def stats(self) -> dict[str, Any]:
+        out: dict[str, Any] = {}
+        for key in sorted(set(self._samples) | set(self.errors)):
+            samples = self._samples.get(key) or ()
+            p95 = self.p95(key)
+            out[key] = {
+                "samples": len(samples),
+                "p50_ms": int(statistics.median(samples) * 1000) if samples else None,
+                "p95_ms": int(p95 * 1000) if p95 is not None else None,
+                "errors": self.errors.get(key, 0),
+            }
+        return out
+
+
+LLM_LATENCY = _LatencyTracker()
+CHAT_STAGE_LATENCY = _LatencyTracker(min_samples=1)
+
+
+def _hedge_delay_s(bundle: _ModelBundle) -> float | None:
+    """How long to wait on `bundle` before also trying the next backend; None disables hedging."""
+    if os.getenv("AGENT_BACKEND_LLM_HEDGE", "1").strip().lower() in {"0", "false", "no"}:
+        return None
+    p95 = LLM_LATENCY.p95(bundle.provider)
+    if p95 is None:
+        return float(os.getenv("AGENT_BACKEND_LLM_HEDGE_DELAY_MS", "3000")) / 1000.0
+    return max(p95, float(os.getenv("AGENT_BACKEND_LLM_HEDGE_MIN_DELAY_MS", "200")) / 1000.0)
+
+
 async def _call_model(
     bundle: _ModelBundle,
     msgs: list[Msg],
     toolkit: Toolkit | None,
     tool_choice: str | None = None,
     on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
+    json_mode: bool = False,
+    timeout_s: float = 0.0,
+    priority: int = _AdmissionLimiter.PRIORITY_NORMAL,
+) -> Any:
+    """Call `bundle`, failing over to (and hedging with) `bundle.fallbacks` in order.
+
+    Attempts run as tasks. The first one to produce text (or a complete reply)
+    wins: only its deltas reach `on_text_delta` and the others are cancelled.
+    If no attempt has won by the current backend's hedge delay, the next one is
+    started alongside it; a failed attempt starts the next one immediately. Once
+    a winner has streamed text it cannot be swapped out, so its errors propagate.
+
+    `timeout_s` (<= 0: none) bounds the whole call, failover included, from
+    the moment the first attempt gets its admission slot (waiting for the slot
+    is bounded by the limiter instead). Each attempt goes through its
+    provider's circuit breaker, with the time left as the ceiling of the
+    breaker's adaptive timeout for this kind of call (tool turn, JSON plan or
+    plain text; streamed or not); an open breaker fails over to the next
+    backend without calling the provider. Before that, the attempt takes a slot
+    from the provider's admission limiter at `priority`; a full queue likewise
+    moves on to the next backend.
+    """
+    candidates = [bundle, *bundle.fallbacks]
+    loop = asyncio.get_running_loop()
+    call_kind = "tools" if toolkit is not None else "json" if json_mode else "text"
+    if on_text_delta is not None:
+        call_kind += ":stream"
+    tasks: dict[asyncio.Task[Any], _ModelBundle] = {}
+    winner: _ModelBundle | None = None
+    last_error: BaseException | None = None
+    deadline: float | None = None
+
+    def launch(b: _ModelBundle) -> None:
+        started = loop.time()
+
+        def claim() -> bool:
+            nonlocal winner
+            if winner is None:
+                winner = b
+                LLM_LATENCY.record(b.provider, loop.time() - started)
+                for other_task, other in tasks.items():
+                    if other is not b:
+                        other_task.cancel()
+            return winner is b
+
+        async def relay(delta: str) -> None:
+            if claim() and on_text_delta is not None:
+                await on_text_delta(delta)
+
+        async def attempt() -> Any:
+            nonlocal deadline
+            limiter = _llm_limiter(b.provider)
+            try:
+                async with limiter.slot(priority) if limiter is not None else contextlib.nullcontext():
+                    if timeout_s > 0 and deadline is None:
+                        deadline = loop.time() + timeout_s
+                    res = await _upstream_breaker(f"llm:{b.provider}").call(
+                        lambda: _call_model_once(b, msgs, toolkit, tool_choice, relay, json_mode),
+                        max(deadline - loop.time(), 0.001) if deadline is not None else 0.0,
+                        call_kind,
+                    )
+            except _UpstreamTimeout as e:
+                if type(e.__cause__) is TimeoutError:
+                    e.code = "llm_timeout"  # our deadline rather than the HTTP client's
+                raise
+            claim()
+            return res
+
+        tasks[asyncio.ensure_future(attempt())] = b
+
+    next_index = 1
+    launch(candidates[0])
+    try:
+        while tasks:
+            timeout = None
+            hedge = False
+            if winner is None and next_index < len(candidates):
+                newest = candidates[next_index - 1]
+                timeout = _hedge_delay_s(newest)
+                hedge = timeout is not None
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise _UpstreamTimeout(f"llm:{bundle.provider}", code="llm_timeout")
+                if timeout is None or remaining < timeout:
+                    timeout, hedge = remaining, False
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if not hedge:
+                    continue  # the deadline is checked at the top of the loop
+                logger.info("hedging llm call: %s -> %s", newest.provider, candidates[next_index].provider)
+                launch(candidates[next_index])
+                next_index += 1
+                continue
+            for t in done:
+                b = tasks.pop(t)
+                if t.cancelled():
+                    continue
+                err = t.exception()
+                if err is None:
+                    if winner is b:
+                        return t.result()
+                    continue  # finished just after another attempt won
+                LLM_LATENCY.record_error(b.provider)
+                logger.warning("llm call via %s failed: %r", b.provider, err)
+                if winner is b:
+                    raise err
+                last_error = err
+            if not tasks and winner is None and next_index < len(candidates):
+                launch(candidates[next_index])
+                next_index += 1
+        assert last_error is not None
+        raise last_error
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def _call_model_once(
+    bundle: _ModelBundle,
+    msgs: list[Msg],
+    toolkit: Toolkit | None,
+    tool_choice: str | None = None,
+    on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
+    json_mode: bool = False,
 ) -> Any:
-    formatted = await _maybe_await(bundle.formatter.format(msgs))
     tools = toolkit.get_json_schemas() if toolkit is not None else None
-    res = await bundle.model(messages=formatted, tools=tools, tool_choice=tool_choice)
-    if _is_async_iterable(res):
-        last = None
-        prev_accumulated = ""
-        chunk_count = 0
-        async for chunk in res:
-            last = chunk
-            chunk_count += 1
-            if on_text_delta is not None:
-                accumulated = _text_from_chat_response(chunk)
-                if len(accumulated) > len(prev_accumulated):
-                    delta = accumulated[len(prev_accumulated):]
-                    prev_accumulated = accumulated
-                    if delta:
-                        logger.debug("_call_model delta #%d: %r", chunk_count, delta[:30] if len(delta) > 30 else delta)
+    attributes = {
+        "gen_ai.system": bundle.provider or None,
+        "gen_ai.request.model": getattr(bundle.model, "model_name", None),
+        "llm.tools": len(tools) if tools else 0,
+        "llm.json_mode": json_mode,
+    }
+    with _span("llm.call", attributes) as span:
+        formatted = await _maybe_await(bundle.formatter.format(msgs))
+        if bundle.provider == "anthropic":
+            _add_anthropic_cache_breakpoints(formatted)
+        extra = _json_mode_kwargs(bundle) if json_mode else {}
+        res = await bundle.model(messages=formatted, tools=tools, tool_choice=tool_choice, **extra)
+        if _is_async_iterable(res):
+            last = None
+            deltas = _StreamTextDeltas()
+            chunk_count = 0
+            async for chunk in res:
+                last = chunk
+                chunk_count += 1
+                if on_text_delta is not None:
+                    for delta in deltas.feed(chunk):
                         await on_text_delta(delta)
-        logger.info("_call_model streaming done: %d chunks, accumulated_len=%d", chunk_count, len(prev_accumulated))
-        return last
-    if on_text_delta is not None:
-        for d in _text_deltas_from_chat_response(res):
-            await on_text_delta(d)
-    return res
+            logger.info("_call_model streaming done: %d chunks, accumulated_len=%d", chunk_count, deltas.total_chars)
+            span.set_attribute("llm.stream_chunks", chunk_count)
+            res = last
+        elif on_text_delta is not None:
+            for d in _text_deltas_from_chat_response(res):
+                await on_text_delta(d)
+        usage = getattr(res, "usage", None)
+        LLM_USAGE.record(usage)
+        span.set_attributes(_usage_span_attributes(usage))
+        return res
 
 
-def _ensure_demo_strategy_params(
-    plan: dict[str, Any],
-    requested_symbol: str | None,
-    market_snapshot: dict[str, Any] | None,
-) -> None:
-    if not isinstance(plan, dict):
-        return
+_CJK_CHAR_RE = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uac00-\ud7af\uff00-\uffef]")
 
-    if not isinstance(plan.get("params"), dict):
-        plan["params"] = {}
-    params: dict[str, Any] = plan["params"]
 
-    actions_raw = plan.get("actions")
-    actions_list: list[Any] = actions_raw if isinstance(actions_raw, list) else []
-    first_action: dict[str, Any] | None = actions_list[0] if actions_list and isinstance(actions_list[0], dict) else None
-    action_type_raw = first_action.get("type") if isinstance(first_action, dict) else None
-    action_type_norm = _normalize_demo_action_type(action_type_raw) if isinstance(action_type_raw, str) else None
+def _estimate_tokens(text: str) -> int:
+    """Cheap local token estimate: ~1 token per CJK char, ~4 chars per token otherwise."""
+    if not text:
+        return 0
+    cjk = len(_CJK_CHAR_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
 
-    if requested_symbol and (not isinstance(params.get("symbol"), str) or not params.get("symbol")):
-        params["symbol"] = requested_symbol
-    if first_action is not None:
-        if not isinstance(first_action.get("params"), dict):
-            first_action["params"] = {}
-        action_params: dict[str, Any] = first_action["params"]
-        if requested_symbol and (not isinstance(action_params.get("symbol"), str) or not action_params.get("symbol")):
-            action_params["symbol"] = requested_symbol
 
-    snapshot = market_snapshot if isinstance(market_snapshot, dict) else None
-    price_obj = snapshot.get("price") if isinstance(snapshot, dict) else None
-    indicators_obj = snapshot.get("indicators") if isinstance(snapshot, dict) else None
+def _msg_text(msg: Msg) -> str:
+    content = getattr(msg, "content", "")
+    if isinstance(content, str):
+        return content
+    try:
+        return msg.get_text_content() or ""
+    except Exception:
+        return str(content)
 
-    current_price: float | None = None
-    if isinstance(price_obj, dict) and isinstance(price_obj.get("current"), (int, float)):
-        current_price = float(price_obj["current"])
 
-    def _set_if_missing(key: str, value: Any) -> None:
-        if value is None:
+def _msg_tokens(msg: Msg) -> int:
+    # Small per-message overhead for role/formatting.
+    return _estimate_tokens(_msg_text(msg)) + 4
+
+
+class _ConversationContext:
+    """Caps the history sent to the LLM.
+
+    The last `max_turns` turns are kept verbatim; older turns are folded into a
+    rolling summary that is produced by a background LLM call after the
+    response has been sent, and the whole history is trimmed to `token_budget`.
+    Each summarization prompt carries at most `summary_max_tokens` of new
+    history; a longer backlog (e.g. after the in-memory summary was lost) is
+    folded in over several passes.
+    """
+
+    def __init__(
+        self,
+        max_turns: int,
+        token_budget: int,
+        summarize: bool = True,
+        summary_timeout_s: float = 30.0,
+        summary_max_tokens: int = 2000,
+    ) -> None:
+        self._max_turns = max(1, max_turns)
+        self._token_budget = token_budget
+        self._summarize = summarize
+        self._summary_timeout_s = summary_timeout_s
+        self._summary_max_tokens = summary_max_tokens
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def _recent_start(self, msgs: list[Msg]) -> int:
+        turn_starts = [i for i, m in enumerate(msgs) if getattr(m, "role", None) == "user"]
+        if len(turn_starts) <= self._max_turns:
+            return 0
+        return turn_starts[-self._max_turns]
+
+    def build(self, msgs: list[Msg], summary: tuple[str, int] | None) -> list[Msg]:
+        summary_text, summary_upto = summary if summary else ("", 0)
+        if summary_upto > len(msgs):
+            summary_text, summary_upto = "", 0
+
+        # Only the last `max_turns` turns go verbatim. Older turns reach the
+        # model through the summary alone; with summaries off, not yet written
+        # or failing, they are dropped rather than sent in full.
+        verbatim = msgs[self._recent_start(msgs):]
+
+        summary_msgs: list[Msg] = []
+        if summary_text:
+            summary_msgs = [Msg(name="user", role="user", content=f"[Earlier conversation summary]\n{summary_text}")]
+
+        if self._token_budget <= 0:
+            return [*summary_msgs, *verbatim]
+
+        budget = self._token_budget - sum(_msg_tokens(m) for m in summary_msgs)
+        costs = [_msg_tokens(m) for m in verbatim]
+        total = sum(costs)
+        drop = 0
+        while drop < len(verbatim) and total > budget:
+            total -= costs[drop]
+            drop += 1
+        # Never start the window in the middle of a turn.
+        while drop < len(verbatim) and getattr(verbatim[drop], "role", None) != "user":
+            drop += 1
+        verbatim = verbatim[drop:]
+
+        if summary_msgs and budget < 0:
+            max_chars = max(0, self._token_budget * 2)
+            summary_msgs = [
+                Msg(name="user", role="user", content=f"[Earlier conversation summary]\n{summary_text[-max_chars:]}")
+            ]
+        return [*summary_msgs, *verbatim]
+
+    def maybe_summarize(
+        self,
+        session_id: str,
+        msgs: list[Msg],
+        summary: tuple[str, int] | None,
+        bundle: "_ModelBundle | None",
+        on_summary: collections.abc.Callable[[str, int], None],
+    ) -> None:
+        """Fold turns that fell out of the verbatim window into the summary, off the request path."""
+        if not self._summarize or bundle is None:
+            return
+        summary_text, summary_upto = summary if summary else ("", 0)
+        upto = self._recent_start(msgs)
+        if upto <= summary_upto:
+            return
+        running = self._tasks.get(session_id)
+        if running is not None and not running.done():
+            return
+
+        chunks = self._summary_chunks(msgs, summary_upto, upto)
+
+        async def _run() -> None:
+            text, start = summary_text, summary_upto
+            try:
+                for end in chunks:
+                    folded = await asyncio.wait_for(
+                        self._summarize_msgs(bundle, text, list(msgs[start:end])),
+                        timeout=self._summary_timeout_s,
+                    )
+                    if not folded:
+                        return
+                    # Record every pass so progress survives a later failure.
+                    text, start = folded, end
+                    on_summary(text, end)
+            except Exception as e:
+                logger.warning("history summary failed sid=%s err=%s", session_id, e)
+            finally:
+                self._tasks.pop(session_id, None)
+
+        self._tasks[session_id] = asyncio.create_task(_run())
+
+    def _summary_chunks(self, msgs: list[Msg], start: int, end: int) -> list[int]:
+        """End indices of turn-aligned chunks of msgs[start:end], each within `summary_max_tokens`."""
+        if self._summary_max_tokens <= 0:
+            return [end]
+        turn_starts = [i for i in range(start + 1, end) if getattr(msgs[i], "role", None) == "user"]
+        ends: list[int] = []
+        used = 0
+        turn_start = start
+        for turn_end in [*turn_starts, end]:
+            cost = sum(_msg_tokens(m) for m in msgs[turn_start:turn_end])
+            # A chunk always holds at least one turn, however long.
+            if used and used + cost > self._summary_max_tokens:
+                ends.append(turn_start)
+                used = 0
+            used += cost
+            turn_start = turn_end
+        ends.append(end)
+        return ends
+
+    async def _summarize_msgs(self, bundle: "_ModelBundle", previous: str, msgs: list[Msg]) -> str:
+        transcript = "\n".join(f"{getattr(m, 'role', 'user')}: {_msg_text(m)}" for m in msgs)
+        prompt = (
+            "Summarize the conversation below for a crypto trading assistant's memory. "
+            "Keep the user's goals, symbols, amounts, risk preferences and any strategies already recommended. "
+            "Use the user's language, at most 150 words, plain text only."
+        )
+        user = f"Previous summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+        res = await _call_model(
+            bundle=bundle,
+            msgs=[Msg(name="system", role="system", content=prompt), Msg(name="user", role="user", content=user)],
+            toolkit=None,
+            priority=_AdmissionLimiter.PRIORITY_BACKGROUND,
+        )
+        return _text_from_chat_response(res).strip()
+
+
+def _load_conversation_context() -> _ConversationContext:
+    return _ConversationContext(
+        max_turns=int(os.getenv("AGENT_BACKEND_CONTEXT_MAX_TURNS", "6")),
+        token_budget=int(os.getenv("AGENT_BACKEND_CONTEXT_TOKEN_BUDGET", "3000")),
+        summarize=os.getenv("AGENT_BACKEND_CONTEXT_SUMMARY", "1").strip().lower() not in {"0", "false", "no"},
+        summary_max_tokens=int(os.getenv("AGENT_BACKEND_CONTEXT_SUMMARY_MAX_TOKENS", "2000")),
+    )
+
+
+_PROMPT_NOISE_RE = re.compile(r"[\W_]+")
+
+
+def _normalize_prompt(text: str) -> str:
+    # Case, whitespace and punctuation do not change the question.
+    return _PROMPT_NOISE_RE.sub("", (text or "").lower())
+
+
+def _indicator_bucket(snapshot: dict[str, Any]) -> tuple[int, int, int]:
+    """Coarse market regime: RSI decile, MACD histogram sign, price vs. Bollinger bands."""
+    indicators = snapshot.get("indicators") if isinstance(snapshot.get("indicators"), dict) else {}
+    price = snapshot.get("price") if isinstance(snapshot.get("price"), dict) else {}
+
+    rsi = indicators.get("rsi_14")
+    rsi_band = int(rsi // 10) if isinstance(rsi, (int, float)) else -1
+    hist = indicators.get("macd_histogram")
+    macd_sign = (hist > 0) - (hist < 0) if isinstance(hist, (int, float)) else 0
+    current = price.get("current")
+    upper = indicators.get("bollinger_upper")
+    lower = indicators.get("bollinger_lower")
+    band_pos = 0
+    if isinstance(current, (int, float)):
+        if isinstance(upper, (int, float)) and current > upper:
+            band_pos = 1
+        elif isinstance(lower, (int, float)) and current < lower:
+            band_pos = -1
+    return rsi_band, macd_sign, band_pos
+
+
+class _StrategyResponseCache:
+    """Reuses strategy replies for near-identical prompts within one candle.
+
+    Keyed on (normalized prompt, symbol, interval, candle close time, indicator
+    bucket, digest of the conversation context); an entry expires when its
+    candle closes (capped at `max_ttl_s`). The context digest keeps a reply
+    built on one session's history (or summary) from being served to another,
+    so in practice hits come from fresh conversations asking the same thing.
+    Only the raw LLM reply text is stored, so a hit goes through the same
+    parsing and parameter filling as a fresh reply.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_ttl_s: float = 3600.0) -> None:
+        self._max_entries = max_entries
+        self._max_ttl_s = max_ttl_s
+        self._entries: collections.OrderedDict[tuple[Any, ...], tuple[float, str]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(
+        user_input: str,
+        market_snapshot: dict[str, Any] | None,
+        context_msgs: list[Msg] | None = None,
+    ) -> tuple[Any, ...] | None:
+        if not isinstance(market_snapshot, dict) or not market_snapshot.get("ok"):
+            return None
+        close_ms = market_snapshot.get("candle_close_time_ms")
+        if not isinstance(close_ms, int):
+            return None
+        context = hashlib.sha256()
+        for m in context_msgs or ():
+            context.update(f"{getattr(m, 'role', '')}\x00{_msg_text(m)}\x00".encode("utf-8"))
+        return (
+            _normalize_prompt(user_input),
+            market_snapshot.get("symbol"),
+            market_snapshot.get("interval"),
+            close_ms,
+            _indicator_bucket(market_snapshot),
+            context.hexdigest(),
+        )
+
+    def get(self, key: tuple[Any, ...], now: float | None = None) -> str | None:
+        now = time.time() if now is None else now
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple[Any, ...], text: str, now: float | None = None) -> None:
+        if self._max_entries <= 0:
+            return
+        now = time.time() if now is None else now
+        candle_close_s = key[3] / 1000.0
+        expires_at = min(candle_close_s, now + self._max_ttl_s)
+        if expires_at <= now:
+            return
+        self._entries[key] = (expires_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _load_strategy_cache() -> _StrategyResponseCache:
+    enabled = os.getenv("AGENT_BACKEND_STRATEGY_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+    return _StrategyResponseCache(
+        max_entries=int(os.getenv("AGENT_BACKEND_STRATEGY_CACHE_MAX_ENTRIES", "1024")) if enabled else 0,
+        max_ttl_s=float(os.getenv("AGENT_BACKEND_STRATEGY_CACHE_MAX_TTL_SECONDS", "3600")),
+    )
+
+
+def _ensure_demo_strategy_params(
+    plan: dict[str, Any],
+    requested_symbol: str | None,
+    market_snapshot: dict[str, Any] | None,
+) -> None:
+    if not isinstance(plan, dict):
+        return
+
+    if not isinstance(plan.get("params"), dict):
+        plan["params"] = {}
+    params: dict[str, Any] = plan["params"]
+
+    actions_raw = plan.get("actions")
+    actions_list: list[Any] = actions_raw if isinstance(actions_raw, list) else []
+    first_action: dict[str, Any] | None = actions_list[0] if actions_list and isinstance(actions_list[0], dict) else None
+    action_type_raw = first_action.get("type") if isinstance(first_action, dict) else None
+    action_type_norm = _normalize_demo_action_type(action_type_raw) if isinstance(action_type_raw, str) else None
+
+    if requested_symbol and (not isinstance(params.get("symbol"), str) or not params.get("symbol")):
+        params["symbol"] = requested_symbol
+    if first_action is not None:
+        if not isinstance(first_action.get("params"), dict):
+            first_action["params"] = {}
+        action_params: dict[str, Any] = first_action["params"]
+        if requested_symbol and (not isinstance(action_params.get("symbol"), str) or not action_params.get("symbol")):
+            action_params["symbol"] = requested_symbol
+
+    snapshot = market_snapshot if isinstance(market_snapshot, dict) else None
+    price_obj = snapshot.get("price") if isinstance(snapshot, dict) else None
+    indicators_obj = snapshot.get("indicators") if isinstance(snapshot, dict) else None
+
+    current_price: float | None = None
+    if isinstance(price_obj, dict) and isinstance(price_obj.get("current"), (int, float)):
+        current_price = float(price_obj["current"])
+
+    def _set_if_missing(key: str, value: Any) -> None:
+        if value is None:
             return
         if key not in params or params.get(key) in (None, ""):
             params[key] = value
@@ -1670,38 +3559,9 @@ def _ensure_demo_strategy_params(
             _set_action_if_missing(k, params.get(k))
 
 
-async def _strategy_plan_simple(
-    bundle: _ModelBundle,
-    memory_msgs: list[Msg],
-    user_input: str,
-    market_snapshot: dict[str, Any] | None = None,
-    intent_hint: str = "strategy",
-    requested_symbol: str | None = None,
-    on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
-) -> dict[str, Any]:
-    """Simple strategy planning without tool calling - uses pre-fetched market data."""
-    
-    # Build market context for the prompt
-    market_context = ""
-    if market_snapshot and market_snapshot.get("ok"):
-        price = market_snapshot.get("price", {})
-        volume = market_snapshot.get("volume", {})
-        indicators = market_snapshot.get("indicators", {})
-        market_context = f"""
-当前市场数据 ({market_snapshot.get('symbol', 'BTCUSDT')}, {market_snapshot.get('timestamp', '')}):
-- 价格: ${price.get('current', 'N/A')} (24h变化: {price.get('change_24h_pct', 0):.2f}%)
-- 24h高/低: ${price.get('high_24h', 'N/A')} / ${price.get('low_24h', 'N/A')}
-- 成交量比率: {volume.get('ratio', 1):.2f}x (当前/24h均值)
-- RSI(14): {indicators.get('rsi_14', 'N/A')}
-- MACD: {indicators.get('macd', 'N/A')} (信号线: {indicators.get('macd_signal', 'N/A')}, 柱状图: {indicators.get('macd_histogram', 'N/A')})
-- EMA(12/26): {indicators.get('ema_12', 'N/A')} / {indicators.get('ema_26', 'N/A')}
-- 布林带: 上轨 ${indicators.get('bollinger_upper', 'N/A')} / 中轨 ${indicators.get('bollinger_middle', 'N/A')} / 下轨 ${indicators.get('bollinger_lower', 'N/A')}
-"""
-
-    if intent_hint == "strategy":
-        sys_prompt = f"""You are StrategyAgent for a crypto trading assistant.
-{market_context}
-Based on the above market data, provide trading strategy recommendations.
+_STRATEGY_SYS_PROMPT = """You are StrategyAgent for a crypto trading assistant.
+The latest market data is given at the start of the final user message.
+Based on that market data, provide trading strategy recommendations.
 When the user asks for a trading strategy for a pair, you MUST choose exactly one strategy from this DEMO set:
 - start_dca (智能DCA)
 - start_grid (网格)
@@ -1720,13 +3580,12 @@ Always output a single JSON object with fields:
   - grid_levels (number, only for start_grid)
 - rationale (string): Reasoning for your recommendation
 - risk_notes (array of strings): Risk warnings
-- actions (array of {{type, params}}): MUST contain 0 or 1 item. If intent is strategy_recommendation, include exactly 1 item. The first action params MUST also include symbol and the above key fields when applicable.
+- actions (array of {type, params}): MUST contain 0 or 1 item. If intent is strategy_recommendation, include exactly 1 item. The first action params MUST also include symbol and the above key fields when applicable.
 IMPORTANT: Start by outputting assistant_text as early as possible.
 If the user is not requesting a trading action, set intent='chat' and actions=[].
 Return JSON only."""
-    else:
-        sym = (requested_symbol or "").strip() or "N/A"
-        sys_prompt = f"""You are a crypto assistant.
+
+_ASSISTANT_SYS_PROMPT = """You are a crypto assistant.
 The user may ask either for a trading strategy or a general question.
 If the user is asking for a strategy, you MUST choose exactly one strategy from this DEMO set:
 - start_dca (智能DCA)
@@ -1735,47 +3594,98 @@ If the user is asking for a strategy, you MUST choose exactly one strategy from
 - start_martingale (马丁格尔)
 - none (暂时观望)
 If you are unsure or market data is insufficient, choose none.
-The requested symbol (if any) is: {sym}
+The requested symbol (if any) is given in the final user message.
 Always output a single JSON object with fields:
 - assistant_text (string): Your response to the user in Chinese
 - intent (string): "strategy_recommendation" or "chat"
 - params (object)
 - rationale (string)
 - risk_notes (array of strings)
-- actions (array of {{type, params}})
+- actions (array of {type, params})
 IMPORTANT: Start by outputting assistant_text as early as possible.
 Return JSON only."""
 
+
+def _market_context_text(market_snapshot: dict[str, Any] | None) -> str:
+    if not market_snapshot or not market_snapshot.get("ok"):
+        return ""
+    price = market_snapshot.get("price", {})
+    volume = market_snapshot.get("volume", {})
+    indicators = market_snapshot.get("indicators", {})
+    return f"""当前市场数据 ({market_snapshot.get('symbol', 'BTCUSDT')}, {market_snapshot.get('timestamp', '')}):
+- 价格: ${price.get('current', 'N/A')} (24h变化: {price.get('change_24h_pct', 0):.2f}%)
+- 24h高/低: ${price.get('high_24h', 'N/A')} / ${price.get('low_24h', 'N/A')}
+- 成交量比率: {volume.get('ratio', 1):.2f}x (当前/24h均值)
+- RSI(14): {indicators.get('rsi_14', 'N/A')}
+- MACD: {indicators.get('macd', 'N/A')} (信号线: {indicators.get('macd_signal', 'N/A')}, 柱状图: {indicators.get('macd_histogram', 'N/A')})
+- EMA(12/26): {indicators.get('ema_12', 'N/A')} / {indicators.get('ema_26', 'N/A')}
+- 布林带: 上轨 ${indicators.get('bollinger_upper', 'N/A')} / 中轨 ${indicators.get('bollinger_middle', 'N/A')} / 下轨 ${indicators.get('bollinger_lower', 'N/A')}"""
+
+
+async def _strategy_plan_simple(
+    bundle: _ModelBundle,
+    memory_msgs: list[Msg],
+    user_input: str,
+    market_snapshot: dict[str, Any] | None = None,
+    intent_hint: str = "strategy",
+    requested_symbol: str | None = None,
+    on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
+    cache: _StrategyResponseCache | None = None,
+    priority: int = _AdmissionLimiter.PRIORITY_NORMAL,
+) -> dict[str, Any]:
+    """Simple strategy planning without tool calling - uses pre-fetched market data."""
+
+    # Static system prompt and history first, per-request data last, so the
+    # prefix stays byte-identical across requests for provider prompt caches.
+    if intent_hint == "strategy":
+        sys_prompt = _STRATEGY_SYS_PROMPT
+        request_context = _market_context_text(market_snapshot)
+    else:
+        sys_prompt = _ASSISTANT_SYS_PROMPT
+        sym = (requested_symbol or "").strip() or "N/A"
+        request_context = f"The requested symbol (if any) is: {sym}"
+
+    user_content = f"{request_context}\n\n{user_input}" if request_context else user_input
     msgs: list[Msg] = [
         Msg(name="system", role="system", content=sys_prompt),
         *memory_msgs,
-        Msg(name="user", role="user", content=user_input),
+        Msg(name="user", role="user", content=user_content),
     ]
 
-    llm_timeout_s = float(os.getenv("AGENT_BACKEND_LLM_TIMEOUT_SECONDS", "60"))
-    llm_stream_timeout_s = float(os.getenv("AGENT_BACKEND_LLM_STREAM_TIMEOUT_SECONDS", "0"))
-    
-    effective_timeout_s = llm_stream_timeout_s if on_text_delta is not None else llm_timeout_s
+    cache_key = None
+    if cache is not None and intent_hint == "strategy":
+        cache_key = _StrategyResponseCache.key_for(user_input, market_snapshot, memory_msgs)
+    cached_text = cache.get(cache_key) if cache is not None and cache_key is not None else None
 
-    try:
-        t0 = time.monotonic()
-        if effective_timeout_s > 0:
-            res = await asyncio.wait_for(
-                _call_model(bundle=bundle, msgs=msgs, toolkit=None, tool_choice=None, on_text_delta=on_text_delta),
-                timeout=effective_timeout_s,
-            )
-        else:
-            res = await _call_model(bundle=bundle, msgs=msgs, toolkit=None, tool_choice=None, on_text_delta=on_text_delta)
-        print(f"[LLM] strategy call done ms={int((time.monotonic() - t0) * 1000)}", flush=True)
-    except asyncio.TimeoutError as e:
-        raise RuntimeError("llm_timeout") from e
+    if cached_text is not None:
+        text = cached_text
+        if on_text_delta is not None:
+            await on_text_delta(text)
+    else:
+        llm_timeout_s = float(os.getenv("AGENT_BACKEND_LLM_TIMEOUT_SECONDS", "60"))
+        effective_timeout_s = _llm_stream_timeout_s() if on_text_delta is not None else llm_timeout_s
+
+        res = await _call_model(
+            bundle=bundle,
+            msgs=msgs,
+            toolkit=None,
+            tool_choice=None,
+            on_text_delta=on_text_delta,
+            json_mode=True,
+            timeout_s=effective_timeout_s,
+            priority=priority,
+        )
 
-    text = _text_from_chat_response(res)
-    plan = _extract_json_object(text)
+        text = _text_from_chat_response(res)
+
+    plan = _parse_strategy_plan(text)
     if plan is None:
         if not text.strip():
             raise RuntimeError("model_empty_response")
+        logger.warning("strategy reply is not JSON; answering as chat")
         return {"intent": "chat", "params": {}, "assistant_text": text, "rationale": "", "risk_notes": [], "actions": []}
+    if cache is not None and cache_key is not None and cached_text is None:
+        cache.put(cache_key, text)
     
     # Embed market snapshot in params
     if market_snapshot and market_snapshot.get("ok"):
@@ -1788,6 +3698,18 @@ Return JSON only."""
     return plan
 
 
+_CACHED_TOOL_RESULT_NOTE = "[cached] Same tool and arguments as an earlier call in this request; result reused.\n"
+
+
+def _tool_memo_key(tc: ToolUseBlock) -> str:
+    tool_input = tc.get("input")
+    try:
+        canonical = json.dumps(tool_input, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    except (TypeError, ValueError):
+        canonical = repr(tool_input)
+    return f"{tc.get('name')}:{canonical}"
+
+
 async def _strategy_plan_with_tools(
     bundle: _ModelBundle,
     toolkit: Toolkit | None,
@@ -1795,6 +3717,7 @@ async def _strategy_plan_with_tools(
     user_input: str,
     on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
     on_tool_start: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
+    priority: int = _AdmissionLimiter.PRIORITY_NORMAL,
 ) -> dict[str, Any]:
     sys_prompt = (
         "You are StrategyAgent for a crypto trading assistant. "
@@ -1824,8 +3747,10 @@ async def _strategy_plan_with_tools(
             os.getenv("AGENT_BACKEND_UPSTREAM_TIMEOUT_SECONDS", "60"),
         )
     )
-    llm_stream_timeout_s = float(os.getenv("AGENT_BACKEND_LLM_STREAM_TIMEOUT_SECONDS", "0"))
+    llm_stream_timeout_s = _llm_stream_timeout_s()
     tool_timeout_s = float(os.getenv("AGENT_BACKEND_TOOL_TIMEOUT_SECONDS", "20"))
+    tool_max_parallel = max(1, int(os.getenv("AGENT_BACKEND_TOOL_MAX_PARALLEL", "4")))
+    tool_slots = asyncio.Semaphore(tool_max_parallel)
 
     async def _collect_tool(gen: Any) -> Any:
         last = None
@@ -1833,61 +3758,27 @@ async def _strategy_plan_with_tools(
             last = tr
         return last
 
-    for iter_num in range(max_iters):
-        print(f"[STRATEGY] iter={iter_num} msgs_count={len(msgs)}", flush=True)
-        logger.info("strategy_loop iter=%d msgs_count=%d", iter_num, len(msgs))
-        try:
-            t0 = time.monotonic()
-            effective_timeout_s = llm_timeout_s
-            if on_text_delta is not None:
-                effective_timeout_s = llm_stream_timeout_s
-
-            if effective_timeout_s > 0:
-                res = await asyncio.wait_for(
-                    _call_model(
-                        bundle=bundle,
-                        msgs=msgs,
-                        toolkit=toolkit,
-                        tool_choice="auto",
-                        on_text_delta=on_text_delta,
-                    ),
-                    timeout=effective_timeout_s,
-                )
-            else:
-                res = await _call_model(
-                    bundle=bundle,
-                    msgs=msgs,
-                    toolkit=toolkit,
-                    tool_choice="auto",
-                    on_text_delta=on_text_delta,
-                )
-            print(f"[LLM] call done ms={int((time.monotonic() - t0) * 1000)}", flush=True)
-        except asyncio.TimeoutError as e:
-            raise RuntimeError("llm_timeout") from e
-
-        tool_calls = _tool_calls_from_chat_response(res)
-        print(f"[LLM] tool_calls={len(tool_calls) if tool_calls else 0}", flush=True)
-        if tool_calls and toolkit is not None:
-            msgs.append(Msg(name="assistant", role="assistant", content=list(tool_calls)))
+    # Request-scoped memo: identical (tool, input) calls share one execution.
+    tool_memo: dict[str, asyncio.Future[tuple[str, bool]]] = {}
 
-            for tc in tool_calls:
-                output_text = ""
-                tool_name = str(tc.get("name") or "tool")
-                if on_tool_start is not None:
-                    await on_tool_start(tool_name)
+    async def _run_tool(tc: ToolUseBlock) -> tuple[str, bool]:
+        async with tool_slots:
+            output_text = ""
+            tool_name = str(tc.get("name") or "tool")
+            if on_tool_start is not None:
+                await on_tool_start(tool_name)
+            with _span("tool.call", {"tool.name": tool_name}) as span:
                 try:
-                    t0 = time.monotonic()
-                    print(f"[TOOL] starting {tc.get('name')}", flush=True)
                     gen = await toolkit.call_tool_function(tc)
-                    print(f"[TOOL] got generator {tc.get('name')} type={type(gen).__name__}", flush=True)
                     if tool_timeout_s > 0:
                         last_tr = await asyncio.wait_for(_collect_tool(gen), timeout=tool_timeout_s)
                     else:
                         last_tr = await _collect_tool(gen)
                     if last_tr is not None:
                         output_text = _tool_response_to_output(last_tr)
-                    print(f"[TOOL] done {tc.get('name')} ms={int((time.monotonic() - t0) * 1000)} len={len(output_text)}", flush=True)
+                    span.set_attribute("tool.output_chars", len(output_text))
                 except asyncio.TimeoutError:
+                    span.set_attribute("tool.error", "tool_timeout")
                     output_text = json.dumps(
                         {
                             "ok": False,
@@ -1896,9 +3787,66 @@ async def _strategy_plan_with_tools(
                         },
                         ensure_ascii=False,
                     )
+                    return output_text, False
                 except Exception as e:
+                    span.set_attribute("tool.error", type(e).__name__)
                     output_text = json.dumps({"ok": False, "error": {"type": type(e).__name__, "message": str(e)}}, ensure_ascii=False)
+                    return output_text, False
+                return output_text, True
+
+    async def _run_tool_memoized(tc: ToolUseBlock) -> str:
+        key = _tool_memo_key(tc)
+        shared = tool_memo.get(key)
+        if shared is not None:
+            output_text, ok = await shared
+            if not ok:
+                return output_text
+            logger.info("tool %s served from request memo", tc.get("name"))
+            return _CACHED_TOOL_RESULT_NOTE + output_text
+
+        shared = asyncio.get_running_loop().create_future()
+        tool_memo[key] = shared
+        try:
+            output_text, ok = await _run_tool(tc)
+        except BaseException:
+            tool_memo.pop(key, None)
+            shared.cancel()
+            raise
+        if not ok:
+            # Failures are not memoized; a later identical call retries.
+            tool_memo.pop(key, None)
+        shared.set_result((output_text, ok))
+        return output_text
+
+    for iter_num in range(max_iters):
+        logger.info("strategy_loop iter=%d msgs_count=%d", iter_num, len(msgs))
+        effective_timeout_s = llm_timeout_s
+        if on_text_delta is not None:
+            effective_timeout_s = llm_stream_timeout_s
+
+        res = await _call_model(
+            bundle=bundle,
+            msgs=msgs,
+            toolkit=toolkit,
+            tool_choice="auto",
+            on_text_delta=on_text_delta,
+            timeout_s=effective_timeout_s,
+            # Follow-up turns of an interactive loop already under way jump the admission queue.
+            priority=(
+                _AdmissionLimiter.PRIORITY_TOOL_LOOP
+                if iter_num > 0 and priority == _AdmissionLimiter.PRIORITY_NORMAL
+                else priority
+            ),
+        )
+
+        tool_calls = _tool_calls_from_chat_response(res)
+        if tool_calls and toolkit is not None:
+            msgs.append(Msg(name="assistant", role="assistant", content=list(tool_calls)))
 
+            # Tool calls of one turn are independent: run them concurrently (capped by
+            # AGENT_BACKEND_TOOL_MAX_PARALLEL) and append results in call order.
+            outputs = await asyncio.gather(*(_run_tool_memoized(tc) for tc in tool_calls))
+            for tc, output_text in zip(tool_calls, outputs):
                 msgs.append(
                     Msg(
                         name="tool",
@@ -1918,10 +3866,11 @@ async def _strategy_plan_with_tools(
             continue
 
         text = _text_from_chat_response(res)
-        plan = _extract_json_object(text)
+        plan = _parse_strategy_plan(text)
         if plan is None:
             if not text.strip():
                 raise RuntimeError("model_empty_response")
+            logger.warning("strategy reply is not JSON; answering as chat")
             return {
                 "intent": "chat",
                 "params": {},
@@ -1996,6 +3945,8 @@ MODEL_BUNDLE: _ModelBundle | None = None
 SESSION_STORE: _InMemorySessionStore | None = None
 TOOLKIT: Toolkit | None = None
 CROSS_CHAIN: _CrossChainService | None = None
+CONVERSATION_CONTEXT: _ConversationContext | None = None
+STRATEGY_CACHE: _StrategyResponseCache | None = None
 
 @app.on_event("startup")
 async def startup_event():
@@ -2004,14 +3955,17 @@ async def startup_event():
     global SESSION_STORE
     global TOOLKIT
     global CROSS_CHAIN
+    global CONVERSATION_CONTEXT
+    global STRATEGY_CACHE
 
     if os.getenv("AGENT_BACKEND_DISABLE_STARTUP", "").strip() == "1":
         return
 
     MODEL_BUNDLE = _load_model_bundle()
-    ttl_seconds = int(os.getenv("AGENT_BACKEND_SESSION_TTL_SECONDS", "1800"))
-    SESSION_STORE = _InMemorySessionStore(ttl_seconds=ttl_seconds)
+    SESSION_STORE = _load_session_store()
     CROSS_CHAIN = _CrossChainService()
+    CONVERSATION_CONTEXT = _load_conversation_context()
+    STRATEGY_CACHE = _load_strategy_cache()
 
     amm = _load_amm_config()
     cex = _load_cex_config()
@@ -2041,11 +3995,33 @@ async def startup_event():
     TOOLKIT = toolkit
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if JOB_QUEUE is not None:
+        await JOB_QUEUE.close()
+    if SESSION_STORE is not None:
+        with contextlib.suppress(Exception):
+            await SESSION_STORE.close()
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "strategy_cache": _strategy_cache().stats(),
+        "llm_usage": LLM_USAGE.stats(),
+        "llm_latency": LLM_LATENCY.stats(),
+        "chat_stages": CHAT_STAGE_LATENCY.stats(),
+        "upstreams": {name: breaker.stats() for name, breaker in sorted(UPSTREAM_BREAKERS.items())},
+        "llm_admission": {name: limiter.stats() for name, limiter in sorted(LLM_LIMITERS.items())},
+        "jobs": JOB_QUEUE.stats() if JOB_QUEUE is not None else None,
+    }
+
+
 def _cross_chain_service() -> _CrossChainService:
     global CROSS_CHAIN
     if CROSS_CHAIN is None:
@@ -2053,6 +4029,36 @@ def _cross_chain_service() -> _CrossChainService:
     return CROSS_CHAIN
 
 
+def _conversation_context() -> _ConversationContext:
+    global CONVERSATION_CONTEXT
+    if CONVERSATION_CONTEXT is None:
+        CONVERSATION_CONTEXT = _load_conversation_context()
+    return CONVERSATION_CONTEXT
+
+
+def _strategy_cache() -> _StrategyResponseCache:
+    global STRATEGY_CACHE
+    if STRATEGY_CACHE is None:
+        STRATEGY_CACHE = _load_strategy_cache()
+    return STRATEGY_CACHE
+
+
+async def _context_msgs(store: _InMemorySessionStore, session_id: str, memory: InMemoryMemory) -> list[Msg]:
+    history = await _get_memory_msgs(memory)
+    return _conversation_context().build(history, store.get_history_summary(session_id))
+
+
+async def _schedule_history_summary(store: _InMemorySessionStore, session_id: str, memory: InMemoryMemory) -> None:
+    history = await _get_memory_msgs(memory)
+    _conversation_context().maybe_summarize(
+        session_id,
+        history,
+        store.get_history_summary(session_id),
+        MODEL_BUNDLE,
+        on_summary=lambda text, upto: store.set_history_summary(session_id, text, upto),
+    )
+
+
 @app.post("/cross-chain/intents")
 async def cross_chain_create_intent(req: CrossChainIntentCreateRequest):
     svc = _cross_chain_service()
@@ -2120,8 +4126,7 @@ async def cross_chain_inbound(http_request: Request, inbound: CrossChainInboundR
 
     return {"applied": applied, "intent": intent}
 
-@app.post("/chat")
-async def chat(request: ChatRequest):
+def _validate_chat_request(request: ChatRequest) -> None:
     if MODEL_BUNDLE is None or SESSION_STORE is None:
         raise HTTPException(status_code=503, detail={"code": "not_ready", "message": "Service not initialized"})
 
@@ -2133,375 +4138,435 @@ async def chat(request: ChatRequest):
     if len(user_input) > max_chars:
         raise HTTPException(status_code=413, detail={"code": "input_too_large", "message": "user_input too large"})
 
-    session_id = request.session_id or uuid.uuid4().hex
-    lock = await SESSION_STORE.get_session_lock(session_id)
-
-    buy_intent = _extract_buy_pas_token_intent(user_input)
-    if buy_intent is not None:
-        amount_in_pas, token_out_symbol = buy_intent
-        execution_plan = _build_buy_execution_plan(amount_in_pas=amount_in_pas, token_out_symbol=token_out_symbol)
-        assistant_text = (
-            f"我已为你生成购买计划：用 {amount_in_pas} PAS 购买 {token_out_symbol}。\n\n"
-            "下一步：请在 App 内确认并分别签名执行跨链（XCM）与 swap 交易。"
-        )
-        actions: list[Action] = []
-        preview = {
-            "mode": "preview",
-            "intent": "buy_token",
-            "params": {
-                "amount_in_pas": amount_in_pas,
-                "token_out": token_out_symbol,
-                "slippage_bps": execution_plan["risk_controls"]["slippage_bps"],
-                "deadline_seconds": execution_plan["risk_controls"]["deadline_seconds"],
-            },
-            "requires_confirmation": True,
-        }
 
-        async with lock:
-            memory = await SESSION_STORE.load_memory(session_id)
-            await _maybe_await(memory.add(Msg(name="user", role="user", content=user_input)))
-            await _maybe_await(memory.add(Msg(name="assistant", role="assistant", content=assistant_text)))
-            await SESSION_STORE.save_memory(session_id, memory)
-
-        return ChatResponse(
-            session_id=session_id,
-            assistant_text=assistant_text,
-            actions=actions,
-            execution_preview=preview,
-            execution_plan=execution_plan,
-            strategy_type=None,
-            strategy_label=None,
-        )
+def _llm_stream_timeout_s() -> float:
+    """Ceiling for one streamed LLM call.
 
-    async with lock:
-        memory = await SESSION_STORE.load_memory(session_id)
-        memory_msgs = await _get_memory_msgs(memory)
+    AGENT_BACKEND_LLM_STREAM_TIMEOUT_SECONDS=0 (the default) falls back to the
+    whole-stream budget rather than no ceiling, so the breaker's adaptive
+    timeout still applies to `/chat/stream`.
+    """
+    timeout_s = float(os.getenv("AGENT_BACKEND_LLM_STREAM_TIMEOUT_SECONDS", "0"))
+    if timeout_s > 0:
+        return timeout_s
+    return float(os.getenv("AGENT_BACKEND_STREAM_TOTAL_TIMEOUT_SECONDS", "75"))
+
+
+def _use_simple_strategy(streaming: bool) -> bool:
+    """Whether to plan with the tool-less planner on a prefetched market snapshot.
+
+    `/chat/stream` uses it unless AGENT_BACKEND_USE_SIMPLE_STRATEGY=0; `/chat`
+    and jobs keep the tool-calling loop unless AGENT_BACKEND_CHAT_USE_SIMPLE_STRATEGY=1.
+    """
+    if streaming:
+        return os.getenv("AGENT_BACKEND_USE_SIMPLE_STRATEGY", "1").strip().lower() not in {"0", "false", "no"}
+    return os.getenv("AGENT_BACKEND_CHAT_USE_SIMPLE_STRATEGY", "0").strip().lower() in {"1", "true", "yes"}
+
+
+class _ChatTurn:
+    """One chat request moving through the pipeline shared by `/chat`, `/chat/stream` and jobs.
+
+    Stages: parse (here) → fetch (market snapshot, started before the session
+    lock so the two overlap) → session (lock + memory load) → plan → preview →
+    persist; see `_run_chat_turn`. Each stage's duration lands in `timings`,
+    in CHAT_STAGE_LATENCY (`/metrics` → `chat_stages`) and in `on_stage`, and
+    each stage after parse is a `chat.<stage>` span under the `chat.turn` span.
+    """
+
+    def __init__(
+        self,
+        request: ChatRequest,
+        session_id: str,
+        use_simple_strategy: bool = False,
+        on_stage: collections.abc.Callable[[str, float], None] | None = None,
+        priority: int = _AdmissionLimiter.PRIORITY_NORMAL,
+    ) -> None:
+        self.started_ns = time.time_ns()
+        self.request = request
+        self.session_id = session_id
+        self.user_input = request.user_input
+        self.use_simple_strategy = use_simple_strategy
+        self.on_stage = on_stage
+        # Admission priority of the turn's LLM calls.
+        self.priority = priority
+        self.timings: dict[str, float] = {}
+        with self.stage("parse"):
+            self.cex_cfg = _load_cex_config()
+            default_symbol = os.getenv("AGENT_BACKEND_DEFAULT_SYMBOL", "BTCUSDT").strip().upper() or "BTCUSDT"
+            self.buy_intent = _extract_buy_pas_token_intent(self.user_input)
+            self.intent_hint = _infer_intent_hint(self.user_input)
+            self.symbol = _extract_cex_symbol_from_text(
+                self.user_input,
+                default_quote=self.cex_cfg["default_quote"],
+                default_symbol=default_symbol,
+            )
 
+    @property
+    def needs_llm(self) -> bool:
+        return self.buy_intent is None
+
+    @property
+    def needs_market(self) -> bool:
+        return self.buy_intent is None and self.use_simple_strategy and self.intent_hint == "strategy"
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> collections.abc.Iterator[Any]:
+        started = time.perf_counter()
+        # Parse runs before `chat.turn` is opened (that span starts at `started_ns`, so it covers parse).
+        span_cm = _span(f"chat.{name}") if name != "parse" else contextlib.nullcontext(_NO_SPAN)
         try:
-            plan = await _strategy_plan_with_tools(MODEL_BUNDLE, TOOLKIT, memory_msgs, user_input)
-        except Exception as e:
-            message = str(e)
-            msg_lower = message.lower()
-            type_lower = type(e).__name__.lower()
-            if (
-                "timeout" in msg_lower
-                or "timed out" in msg_lower
-                or "connecttimeout" in msg_lower
-                or "timeout" in type_lower
-            ):
-                raise HTTPException(
-                    status_code=504,
-                    detail={
-                        "code": "llm_timeout" if msg_lower.strip() == "llm_timeout" else "upstream_timeout",
-                        "message": "Upstream LLM request timed out. Check network/proxy and DEEPSEEK_BASE_URL.",
-                    },
-                )
-            if (
-                "connection reset" in msg_lower
-                or "incomplete envelope" in msg_lower
-                or "protocol error" in msg_lower
-                or "read: connection reset" in msg_lower
-            ):
-                raise HTTPException(
-                    status_code=502,
-                    detail={
-                        "code": "upstream_network_error",
-                        "message": "Upstream connection was reset. Check network/proxy and DEEPSEEK_BASE_URL.",
-                    },
-                )
-            raise
+            with span_cm as span:
+                yield span
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = elapsed
+            CHAT_STAGE_LATENCY.record(name, elapsed)
+            if self.on_stage is not None:
+                self.on_stage(name, elapsed)
+
+    async def fetch_market(self) -> dict[str, Any]:
+        cfg = self.cex_cfg
+        with self.stage("fetch") as span:
+            span.set_attribute("market.symbol", self.symbol)
+            snapshot = await fetch_cex_market_snapshot(
+                base_url=cfg["binance_base_url"],
+                timeout_s=cfg["timeout_s"],
+                symbol=self.symbol,
+                interval=cfg["kline_interval"],
+                limit=min(cfg["kline_limit"], 200),
+                default_quote=cfg["default_quote"],
+            )
+            span.set_attribute("market.ok", bool(isinstance(snapshot, dict) and snapshot.get("ok")))
+        return snapshot
 
-        assistant_text, actions, preview = _execution_preview(plan)
 
-        if plan.get("intent") != "chat" and preview is None:
-            params = plan.get("params") if isinstance(plan.get("params"), dict) else {}
-            amount_in = str(params.get("amount_in") or params.get("amount") or "1")
-            token_in = params.get("token_in")
-            token_out = params.get("token_out")
-            tr = await preview_execution(action_type=str(plan.get("intent")), amount_in=amount_in, token_in=token_in, token_out=token_out)
-            preview_text = _tool_response_to_output(tr)
-            preview_obj = _extract_json_object(preview_text)
-            preview = preview_obj if isinstance(preview_obj, dict) else {"mode": "preview", "requires_confirmation": True}
+def _buy_intent_reply(turn: _ChatTurn) -> ChatResponse:
+    amount_in_pas, token_out_symbol = turn.buy_intent
+    execution_plan = _build_buy_execution_plan(amount_in_pas=amount_in_pas, token_out_symbol=token_out_symbol)
+    assistant_text = (
+        f"我已为你生成购买计划：用 {amount_in_pas} PAS 购买 {token_out_symbol}。\n\n"
+        "下一步：请在 App 内确认并分别签名执行跨链（XCM）与 swap 交易。"
+    )
+    preview = {
+        "mode": "preview",
+        "intent": "buy_token",
+        "params": {
+            "amount_in_pas": amount_in_pas,
+            "token_out": token_out_symbol,
+            "slippage_bps": execution_plan["risk_controls"]["slippage_bps"],
+            "deadline_seconds": execution_plan["risk_controls"]["deadline_seconds"],
+        },
+        "requires_confirmation": True,
+    }
+    return ChatResponse(
+        session_id=turn.session_id,
+        assistant_text=assistant_text,
+        actions=[],
+        execution_preview=preview,
+        execution_plan=execution_plan,
+        strategy_type=None,
+        strategy_label=None,
+    )
 
-        if isinstance(preview, dict) and "routing" not in preview:
-            snapshot_obj: dict[str, Any] | None = None
-            if isinstance(plan.get("params"), dict) and isinstance(plan["params"].get("market_snapshot"), dict):
-                snapshot_obj = plan["params"]["market_snapshot"]
-            preview["routing"] = _routing_stub(snapshot_obj)
 
-        await _maybe_await(memory.add(Msg(name="user", role="user", content=user_input)))
-        await _maybe_await(memory.add(Msg(name="assistant", role="assistant", content=assistant_text)))
-        await SESSION_STORE.save_memory(session_id, memory)
+async def _plan_chat_turn(
+    turn: _ChatTurn,
+    memory_msgs: list[Msg],
+    market_task: "asyncio.Task[dict[str, Any]] | None",
+    on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None,
+    on_tool_start: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None,
+) -> dict[str, Any]:
+    try:
+        if turn.use_simple_strategy:
+            market_snapshot = await market_task if market_task is not None else None
+            plan = await _strategy_plan_simple(
+                MODEL_BUNDLE,
+                memory_msgs,
+                turn.user_input,
+                market_snapshot=market_snapshot,
+                intent_hint=turn.intent_hint,
+                requested_symbol=turn.symbol,
+                on_text_delta=on_text_delta,
+                cache=_strategy_cache() if turn.request.use_cache else None,
+                priority=turn.priority,
+            )
+        else:
+            plan = await _strategy_plan_with_tools(
+                MODEL_BUNDLE,
+                TOOLKIT,
+                memory_msgs,
+                turn.user_input,
+                on_text_delta=on_text_delta,
+                on_tool_start=on_tool_start,
+                priority=turn.priority,
+            )
+    except Exception as e:
+        http_exc = _upstream_http_exception(e)
+        if http_exc is not None:
+            raise http_exc from e
+        raise
+
+    snapshot_for_params: dict[str, Any] | None = None
+    if isinstance(plan.get("params"), dict) and isinstance(plan["params"].get("market_snapshot"), dict):
+        snapshot_for_params = plan["params"]["market_snapshot"]
+    _ensure_demo_strategy_params(
+        plan,
+        requested_symbol=turn.symbol if turn.use_simple_strategy else None,
+        market_snapshot=snapshot_for_params,
+    )
+    return plan
+
 
+async def _preview_chat_turn(turn: _ChatTurn, plan: dict[str, Any]) -> ChatResponse:
+    assistant_text, actions, preview = _execution_preview(plan)
+
+    if plan.get("intent") != "chat" and preview is None:
+        params = plan.get("params") if isinstance(plan.get("params"), dict) else {}
+        amount_in = str(params.get("amount_in") or params.get("amount") or "1")
+        token_in = params.get("token_in")
+        token_out = params.get("token_out")
+        tr = await preview_execution(action_type=str(plan.get("intent")), amount_in=amount_in, token_in=token_in, token_out=token_out)
+        preview_text = _tool_response_to_output(tr)
+        preview_obj = _extract_json_object(preview_text)
+        preview = preview_obj if isinstance(preview_obj, dict) else {"mode": "preview", "requires_confirmation": True}
+
+    if isinstance(preview, dict) and "routing" not in preview:
+        snapshot_obj: dict[str, Any] | None = None
+        if isinstance(plan.get("params"), dict) and isinstance(plan["params"].get("market_snapshot"), dict):
+            snapshot_obj = plan["params"]["market_snapshot"]
+        preview["routing"] = _routing_stub(snapshot_obj)
+
+    strategy_type = actions[0].type if actions else None
     return ChatResponse(
-        session_id=session_id,
+        session_id=turn.session_id,
         assistant_text=assistant_text,
         actions=actions,
         execution_preview=preview,
         execution_plan=None,
-        strategy_type=actions[0].type if actions else None,
-        strategy_label=_demo_strategy_label(actions[0].type if actions else None),
+        strategy_type=strategy_type,
+        strategy_label=_demo_strategy_label(strategy_type),
     )
 
-@app.post("/chat/stream")
-async def chat_stream(http_request: Request, request: ChatRequest):
+
+async def _run_chat_turn(
+    turn: _ChatTurn,
+    on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
+    on_tool_start: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
+) -> ChatResponse:
+    """Run the fetch → session → plan → preview → persist stages of `turn`."""
     if MODEL_BUNDLE is None or SESSION_STORE is None:
         raise HTTPException(status_code=503, detail={"code": "not_ready", "message": "Service not initialized"})
 
-    user_input = request.user_input
-    if not isinstance(user_input, str) or not user_input.strip():
-        raise HTTPException(status_code=400, detail={"code": "invalid_input", "message": "user_input is required"})
-
-    max_chars = int(os.getenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000"))
-    if len(user_input) > max_chars:
-        raise HTTPException(status_code=413, detail={"code": "input_too_large", "message": "user_input too large"})
-
-    session_id = request.session_id or uuid.uuid4().hex
+    with _span("chat.turn", {"chat.session_id": turn.session_id}, start_time=turn.started_ns):
+        return await _run_chat_turn_stages(turn, on_text_delta, on_tool_start)
 
-    chunk_size = int(os.getenv("AGENT_BACKEND_STREAM_CHUNK_SIZE", "12"))
-    delay_ms = int(os.getenv("AGENT_BACKEND_STREAM_DELAY_MS", "15"))
-    keepalive_s = float(os.getenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "2"))
-    total_timeout_s = float(os.getenv("AGENT_BACKEND_STREAM_TOTAL_TIMEOUT_SECONDS", "75"))
-    upstream_streaming = os.getenv("AGENT_BACKEND_UPSTREAM_STREAMING", "1").strip().lower() not in {"0", "false", "no"}
 
-    q: asyncio.Queue[str] | None = None
-    extractor: _AssistantTextJsonExtractor | None = None
-    if upstream_streaming:
-        q = asyncio.Queue()
-        extractor = _AssistantTextJsonExtractor()
+async def _run_chat_turn_stages(
+    turn: _ChatTurn,
+    on_text_delta: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None,
+    on_tool_start: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None,
+) -> ChatResponse:
+    # Market I/O does not depend on the session: start it before waiting for
+    # the session lock and loading memory so the two overlap.
+    market_task = asyncio.create_task(turn.fetch_market()) if turn.needs_market else None
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            with turn.stage("session"):
+                with _span("session.lock_wait"):
+                    await stack.enter_async_context(SESSION_STORE.session_lock(turn.session_id))
+                with _span("memory.load"):
+                    memory = await SESSION_STORE.load_memory(turn.session_id)
+
+            if turn.needs_llm:
+                memory_msgs = await _context_msgs(SESSION_STORE, turn.session_id, memory)
+                with turn.stage("plan"):
+                    plan = await _plan_chat_turn(turn, memory_msgs, market_task, on_text_delta, on_tool_start)
+                with turn.stage("preview"):
+                    response = await _preview_chat_turn(turn, plan)
+            else:
+                response = _buy_intent_reply(turn)
+
+            with turn.stage("persist"):
+                await _maybe_await(memory.add(Msg(name="user", role="user", content=turn.user_input)))
+                await _maybe_await(memory.add(Msg(name="assistant", role="assistant", content=response.assistant_text)))
+                with _span("memory.save"):
+                    await SESSION_STORE.save_memory(turn.session_id, memory)
+                await _schedule_history_summary(SESSION_STORE, turn.session_id, memory)
+    finally:
+        if market_task is not None and not market_task.done():
+            market_task.cancel()
+
+    logger.info(
+        "chat turn sid=%s stages=%s",
+        turn.session_id,
+        {name: int(seconds * 1000) for name, seconds in turn.timings.items()},
+    )
+    return response
 
-        async def _on_delta(d: str) -> None:
-            if extractor is None or q is None:
-                return
-            new_text = extractor.feed(d)
-            if new_text:
-                logger.info("SSE delta push: %r", new_text[:50] if len(new_text) > 50 else new_text)
-                await q.put(new_text)
 
-        on_text_delta = _on_delta
-    else:
-        on_text_delta = None
-
-    # Pre-fetch market data before LLM call (non-blocking for simple prompts)
-    use_simple_strategy = os.getenv("AGENT_BACKEND_USE_SIMPLE_STRATEGY", "1").strip().lower() not in {"0", "false", "no"}
-    cex_cfg = _load_cex_config()
-    default_symbol = os.getenv("AGENT_BACKEND_DEFAULT_SYMBOL", "BTCUSDT").strip().upper() or "BTCUSDT"
-
-    buy_intent = _extract_buy_pas_token_intent(user_input)
-
-    async def compute_final():
-        if SESSION_STORE is None:
-            raise RuntimeError("not_ready")
-        lock = await SESSION_STORE.get_session_lock(session_id)
-        async with lock:
-            memory = await SESSION_STORE.load_memory(session_id)
-            memory_msgs = await _get_memory_msgs(memory)
-
-            if buy_intent is not None:
-                amount_in_pas, token_out_symbol = buy_intent
-                execution_plan = _build_buy_execution_plan(amount_in_pas=amount_in_pas, token_out_symbol=token_out_symbol)
-                assistant_text = (
-                    f"我已为你生成购买计划：用 {amount_in_pas} PAS 购买 {token_out_symbol}。\n\n"
-                    "下一步：请在 App 内确认并分别签名执行跨链（XCM）与 swap 交易。"
-                )
-                await _maybe_await(memory.add(Msg(name="user", role="user", content=user_input)))
-                await _maybe_await(memory.add(Msg(name="assistant", role="assistant", content=assistant_text)))
-                await SESSION_STORE.save_memory(session_id, memory)
-
-                preview = {
-                    "mode": "preview",
-                    "intent": "buy_token",
-                    "params": {
-                        "amount_in_pas": amount_in_pas,
-                        "token_out": token_out_symbol,
-                        "slippage_bps": execution_plan["risk_controls"]["slippage_bps"],
-                        "deadline_seconds": execution_plan["risk_controls"]["deadline_seconds"],
-                    },
-                    "requires_confirmation": True,
-                }
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    return await _chat_reply(request)
 
-                return assistant_text, [], preview, execution_plan
 
-            try:
-                if use_simple_strategy:
-                    intent_hint = _infer_intent_hint(user_input)
-                    symbol = _extract_cex_symbol_from_text(
-                        user_input,
-                        default_quote=cex_cfg["default_quote"],
-                        default_symbol=default_symbol,
-                    )
-                    market_snapshot: dict[str, Any] | None = None
-                    if intent_hint == "strategy":
-                        print(f"[MARKET] Fetching market snapshot symbol={symbol}...", flush=True)
-                        market_snapshot = await fetch_cex_market_snapshot(
-                            base_url=cex_cfg["binance_base_url"],
-                            timeout_s=cex_cfg["timeout_s"],
-                            symbol=symbol,
-                            interval=cex_cfg["kline_interval"],
-                            limit=min(cex_cfg["kline_limit"], 200),
-                            default_quote=cex_cfg["default_quote"],
-                        )
-                        print(f"[MARKET] Snapshot ok={market_snapshot.get('ok') if isinstance(market_snapshot, dict) else None}", flush=True)
-
-                    plan = await _strategy_plan_simple(
-                        MODEL_BUNDLE,
-                        memory_msgs,
-                        user_input,
-                        market_snapshot=market_snapshot,
-                        intent_hint=intent_hint,
-                        requested_symbol=symbol,
-                        on_text_delta=on_text_delta,
-                    )
-                else:
-                    symbol = None
-                    plan = await _strategy_plan_with_tools(
-                        MODEL_BUNDLE,
-                        TOOLKIT,
-                        memory_msgs,
-                        user_input,
-                        on_text_delta=on_text_delta,
-                        on_tool_start=None,
-                    )
-
-                snapshot_for_params: dict[str, Any] | None = None
-                if isinstance(plan, dict) and isinstance(plan.get("params"), dict) and isinstance(plan["params"].get("market_snapshot"), dict):
-                    snapshot_for_params = plan["params"]["market_snapshot"]
-                _ensure_demo_strategy_params(plan, requested_symbol=symbol, market_snapshot=snapshot_for_params)
+async def _chat_reply(
+    request: ChatRequest,
+    on_tool_start: collections.abc.Callable[[str], collections.abc.Awaitable[None]] | None = None,
+    background: bool = False,
+) -> ChatResponse:
+    """Answer `request` in one piece.
 
-                assistant_text, actions, preview = _execution_preview(plan)
-            except Exception as e:
-                message = str(e)
-                msg_lower = message.lower()
-                type_lower = type(e).__name__.lower()
-                if (
-                    "timeout" in msg_lower
-                    or "timed out" in msg_lower
-                    or "connecttimeout" in msg_lower
-                    or "timeout" in type_lower
-                ):
-                    raise HTTPException(
-                        status_code=504,
-                        detail={
-                            "code": "llm_timeout" if msg_lower.strip() == "llm_timeout" else "upstream_timeout",
-                            "message": "Upstream LLM request timed out. Check network/proxy and DEEPSEEK_BASE_URL.",
-                        },
-                    )
-                if (
-                    "connection reset" in msg_lower
-                    or "incomplete envelope" in msg_lower
-                    or "protocol error" in msg_lower
-                    or "read: connection reset" in msg_lower
-                ):
-                    raise HTTPException(
-                        status_code=502,
-                        detail={
-                            "code": "upstream_network_error",
-                            "message": "Upstream connection was reset. Check network/proxy and DEEPSEEK_BASE_URL.",
-                        },
-                    )
-                raise
+    Background callers (jobs) skip the up-front 429 and run their LLM calls at
+    background priority, so they wait for capacity instead of failing.
+    """
+    _validate_chat_request(request)
+    turn = _ChatTurn(
+        request,
+        request.session_id or uuid.uuid4().hex,
+        _use_simple_strategy(streaming=False),
+        priority=_AdmissionLimiter.PRIORITY_BACKGROUND if background else _AdmissionLimiter.PRIORITY_NORMAL,
+    )
+    if turn.needs_llm and not background:
+        _check_llm_admission(MODEL_BUNDLE)
+    return await _run_chat_turn(turn, on_tool_start=on_tool_start)
 
-            if plan.get("intent") != "chat" and preview is None:
-                params = plan.get("params") if isinstance(plan.get("params"), dict) else {}
-                amount_in = str(params.get("amount_in") or params.get("amount") or "1")
-                token_in = params.get("token_in")
-                token_out = params.get("token_out")
-                tr = await preview_execution(
-                    action_type=str(plan.get("intent")),
-                    amount_in=amount_in,
-                    token_in=token_in,
-                    token_out=token_out,
-                )
-                preview_text = _tool_response_to_output(tr)
-                preview_obj = _extract_json_object(preview_text)
-                preview = (
-                    preview_obj
-                    if isinstance(preview_obj, dict)
-                    else {"mode": "preview", "requires_confirmation": True}
-                )
 
-            if isinstance(preview, dict) and "routing" not in preview:
-                snapshot_obj: dict[str, Any] | None = None
-                if isinstance(plan.get("params"), dict) and isinstance(plan["params"].get("market_snapshot"), dict):
-                    snapshot_obj = plan["params"]["market_snapshot"]
-                preview["routing"] = _routing_stub(snapshot_obj)
+@app.post("/chat/stream")
+async def chat_stream(http_request: Request, request: ChatRequest):
+    _validate_chat_request(request)
+    user_input = request.user_input
+    session_id = request.session_id or uuid.uuid4().hex
 
-            await _maybe_await(memory.add(Msg(name="user", role="user", content=user_input)))
-            await _maybe_await(memory.add(Msg(name="assistant", role="assistant", content=assistant_text)))
-            await SESSION_STORE.save_memory(session_id, memory)
+    keepalive_s = float(os.getenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "2"))
+    total_timeout_s = float(os.getenv("AGENT_BACKEND_STREAM_TOTAL_TIMEOUT_SECONDS", "75"))
+    stream_headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no",
+    }
 
-            return assistant_text, actions, preview, None
+    # A client retry of a request that is still running (same session and
+    # input) attaches to it and replays what was already sent, instead of
+    # queueing on the session lock and calling the LLM a second time. A
+    # reconnect carrying `Last-Event-ID` resumes after that event, also from a
+    # run that finished within AGENT_BACKEND_STREAM_RESUME_TTL_SECONDS. Runs
+    # without a client session_id are keyed by the generated one, which every
+    # event carries, so their reconnects resume too.
+    run_key = (session_id, user_input)
+    last_event_id = _parse_last_event_id(http_request)
+    run = STREAM_RUNS.get(run_key)
+    if run is not None and (last_event_id is not None or not run.closed):
+        start_id = last_event_id + 1 if last_event_id is not None else 0
+        logger.info("chat_stream: attaching to existing run sid=%s from id=%d", session_id, start_id)
+        return StreamingResponse(run.follow(keepalive_s, start_id), media_type="text/event-stream", headers=stream_headers)
+
+    # Deltas come straight from the upstream stream (or, for non-streaming
+    # models, the whole reply at once); nothing is re-chunked or delayed here.
+    # `assistant_text` goes out as `chunk` events, the other text fields as
+    # `field_delta`; `intent` and each action are sent once their JSON value
+    # completes so clients can render the strategy card before `done`. With
+    # AGENT_BACKEND_STREAM_EARLY_ACK a `stage: "ack"` chunk goes out first.
+    # Events are rendered once into `run`'s log and fanned out to its followers.
+    run = _StreamRun(max_frames=int(os.getenv("AGENT_BACKEND_STREAM_REPLAY_MAX_EVENTS", "2048")))
+    streamer = _JsonStringFieldStreamer(_STREAMED_REPLY_FIELDS, _STREAMED_REPLY_VALUES)
+    streamed_actions = 0
+    emitted_any = False
+    acked_chars = 0
+    first_byte_span: Any = None
+
+    def end_first_byte_span() -> None:
+        nonlocal first_byte_span
+        if first_byte_span is not None:
+            first_byte_span.end()
+            first_byte_span = None
+
+    def publish(event: str, payload: dict[str, Any]) -> None:
+        nonlocal emitted_any, acked_chars
+        end_first_byte_span()
+        if event == "chunk" and payload.get("stage") == "ack":
+            acked_chars += len(payload["delta_text"])
+        elif event == "chunk":
+            emitted_any = True
+        run.publish(event, {"session_id": session_id, "sequence": run.next_id, **payload})
+
+    async def on_text_delta(d: str) -> None:
+        nonlocal streamed_actions
+        for field, new_text in streamer.feed(d).items():
+            logger.debug("SSE delta push %s: %r", field, new_text[:50])
+            if field == "assistant_text":
+                publish("chunk", {"delta_text": new_text})
+            else:
+                publish("field_delta", {"field": field, "delta_text": new_text})
+        for field, value in streamer.pop_values():
+            if field == "intent" and isinstance(value, str):
+                publish("intent", {"intent": value})
+            elif field == "actions":
+                action = _streamed_action(value)
+                if action is not None:
+                    publish("action", {"index": streamed_actions, **action})
+                    streamed_actions += 1
+
+    early_ack = os.getenv("AGENT_BACKEND_STREAM_EARLY_ACK", "0").strip().lower() in {"1", "true", "yes"}
+    turn = _ChatTurn(request, session_id, _use_simple_strategy(streaming=True))
+    if turn.needs_llm:
+        # Refuse before the stream starts so the client gets a real 429 + Retry-After.
+        _check_llm_admission(MODEL_BUNDLE)
+
+    async def compute_final() -> ChatResponse:
+        ack_text = ""
+        if early_ack and turn.needs_market:
+            # Two-stage answer: acknowledge right away, then splice the
+            # market-aware reply in behind it once the snapshot arrives. The ack
+            # is part of the streamed/`done` text but not of the session history.
+            ack_text = _market_ack_text(turn.symbol, turn.cex_cfg["kline_interval"])
+            publish("chunk", {"delta_text": ack_text, "stage": "ack"})
+        response = await _run_chat_turn(turn, on_text_delta=on_text_delta)
+        if ack_text:
+            response.assistant_text = ack_text + response.assistant_text
+        return response
+
+    async def produce() -> None:
+        nonlocal first_byte_span
+        with _span("chat.stream", {"chat.session_id": session_id}, start_time=turn.started_ns):
+            # Time from the request to the first event frame (ack, delta, or the final error).
+            first_byte_span = _start_span("chat.sse_first_byte", start_time=turn.started_ns)
+            try:
+                await produce_events()
+            finally:
+                end_first_byte_span()
 
-    async def gen():
-        task = asyncio.create_task(compute_final())
-        last_keepalive = time.time()
-        start_time = last_keepalive
-        emitted_any = False
-        seq = 0
-        yield ": connected\n\n"
+    async def produce_events() -> None:
         try:
-            while True:
-                now = time.time()
-                if total_timeout_s > 0 and now - start_time >= total_timeout_s:
-                    task.cancel()
-                    yield _sse_event(
-                        "error",
-                        {
-                            "session_id": session_id,
-                            "code": "upstream_timeout",
-                            "message": "Timed out while generating strategy. Check upstream LLM/network and try again.",
-                        },
-                    )
-                    return
-                if keepalive_s > 0 and now - last_keepalive >= keepalive_s:
-                    last_keepalive = now
-                    yield ": keep-alive\n\n"
-
-                if q is not None:
-                    while True:
-                        try:
-                            delta = q.get_nowait()
-                        except asyncio.QueueEmpty:
-                            break
-                        emitted_any = True
-                        yield _sse_event("chunk", {"session_id": session_id, "sequence": seq, "delta_text": delta})
-                        seq += 1
-
-                try:
-                    assistant_text, actions, preview, execution_plan = await asyncio.wait_for(asyncio.shield(task), timeout=0.25)
-                    break
-                except asyncio.TimeoutError:
-                    continue
+            if total_timeout_s > 0:
+                response = await asyncio.wait_for(compute_final(), timeout=total_timeout_s)
+            else:
+                response = await compute_final()
 
-            if q is not None:
-                while True:
-                    try:
-                        delta = q.get_nowait()
-                    except asyncio.QueueEmpty:
-                        break
-                    emitted_any = True
-                    yield _sse_event("chunk", {"session_id": session_id, "sequence": seq, "delta_text": delta})
-                    seq += 1
-
-            if not upstream_streaming or not emitted_any:
-                for part in _chunk_text(assistant_text, chunk_size):
-                    yield _sse_event("chunk", {"session_id": session_id, "sequence": seq, "delta_text": part})
-                    seq += 1
-                    if delay_ms > 0:
-                        await asyncio.sleep(delay_ms / 1000.0)
+            if not emitted_any:
+                # No LLM text to forward (e.g. buy intent, or a non-JSON reply):
+                # send the final text (after any ack already sent) as a single chunk.
+                publish("chunk", {"delta_text": response.assistant_text[acked_chars:]})
 
             done_payload: dict[str, Any] = {
                 "session_id": session_id,
-                "assistant_text": assistant_text,
-                "actions": [a.model_dump() for a in actions],
-                "execution_preview": preview,
+                "assistant_text": response.assistant_text,
+                "actions": [a.model_dump() for a in response.actions],
+                "execution_preview": response.execution_preview,
             }
-            if execution_plan is not None:
-                done_payload["execution_plan"] = execution_plan
-            strategy_type = actions[0].type if actions else None
-            done_payload["strategy_type"] = strategy_type
-            done_payload["strategy_label"] = _demo_strategy_label(strategy_type)
-            yield _sse_event("done", done_payload)
+            if response.execution_plan is not None:
+                done_payload["execution_plan"] = response.execution_plan
+            done_payload["strategy_type"] = response.strategy_type
+            done_payload["strategy_label"] = response.strategy_label
+            run.publish("done", done_payload)
+        except asyncio.TimeoutError:
+            run.publish(
+                "error",
+                {
+                    "session_id": session_id,
+                    "code": "upstream_timeout",
+                    "message": "Timed out while generating strategy. Check upstream LLM/network and try again.",
+                },
+            )
         except HTTPException as e:
             detail = e.detail
             if isinstance(detail, dict):
@@ -2510,19 +4575,219 @@ async def chat_stream(http_request: Request, request: ChatRequest):
             else:
                 code = "http_error"
                 message = str(detail)
-            yield _sse_event("error", {"session_id": session_id, "code": code, "message": message})
+            run.publish("error", {"session_id": session_id, "code": code, "message": message})
         except asyncio.CancelledError:
-            return
+            pass
         except Exception as e:
-            yield _sse_event("error", {"session_id": session_id, "code": "stream_error", "message": str(e)})
+            run.publish("error", {"session_id": session_id, "code": "stream_error", "message": str(e)})
         finally:
-            if not task.done():
-                task.cancel()
-                with contextlib.suppress(asyncio.CancelledError, Exception):
-                    await task
+            run.close()
+            resume_ttl_s = float(os.getenv("AGENT_BACKEND_STREAM_RESUME_TTL_SECONDS", "60"))
+            if resume_ttl_s > 0:
+                asyncio.get_running_loop().call_later(resume_ttl_s, _forget_stream_run, run_key, run)
+            else:
+                _forget_stream_run(run_key, run)
+
+    # The run is not tied to this connection: if the client drops, it keeps
+    # going (bounded by the total timeout) so a reconnect can pick it up.
+    run.task = asyncio.create_task(produce())
+    STREAM_RUNS[run_key] = run
+    return StreamingResponse(run.follow(keepalive_s), media_type="text/event-stream", headers=stream_headers)
+
+class _JobQueueFull(Exception):
+    pass
+
+
+class _ChatJob:
+    """One `/jobs/chat` request: status, final result and an SSE event log."""
+
+    def __init__(self, request: ChatRequest) -> None:
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"
+        self.created_unix_s = time.time()
+        self.finished_unix_s: float | None = None
+        self.result: dict[str, Any] | None = None
+        self.error: dict[str, str] | None = None
+        self.run = _StreamRun()
+
+    def publish(self, event: str, payload: dict[str, Any]) -> None:
+        self.run.publish(event, {"job_id": self.id, "session_id": self.request.session_id, **payload})
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "session_id": self.request.session_id,
+            "status": self.status,
+            "created_unix_s": self.created_unix_s,
+            "finished_unix_s": self.finished_unix_s,
+            "result": self.result,
+            "error": self.error,
+        }
+
 
+class _ChatJobQueue:
+    """Runs `/jobs/chat` requests on a fixed pool of asyncio workers.
+
+    The wait queue is bounded (`max_queue`), and one session may hold at most
+    `max_per_session` unfinished jobs, so a single client cannot crowd out the
+    rest. Finished jobs stay readable for `ttl_s` seconds. Workers are started
+    lazily on the first submit, inside the running event loop.
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 100, max_per_session: int = 4, ttl_s: float = 600.0) -> None:
+        self._workers = max(1, workers)
+        self._max_per_session = max(1, max_per_session)
+        self._ttl_s = ttl_s
+        self._queue: asyncio.Queue[_ChatJob] = asyncio.Queue(maxsize=max(1, max_queue))
+        self._tasks: list[asyncio.Task[None]] = []
+        self.jobs: collections.OrderedDict[str, _ChatJob] = collections.OrderedDict()
+
+    def submit(self, request: ChatRequest) -> _ChatJob:
+        self._prune()
+        pending = sum(
+            1 for j in self.jobs.values() if j.request.session_id == request.session_id and j.finished_unix_s is None
+        )
+        if pending >= self._max_per_session:
+            raise _JobQueueFull("too many unfinished jobs for this session")
+        job = _ChatJob(request)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise _JobQueueFull("job queue is full") from None
+        self.jobs[job.id] = job
+        job.publish("status", {"status": job.status})
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+        return job
+
+    def get(self, job_id: str) -> _ChatJob | None:
+        self._prune()
+        return self.jobs.get(job_id)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self._ttl_s
+        expired = [jid for jid, j in self.jobs.items() if j.finished_unix_s is not None and j.finished_unix_s < cutoff]
+        for jid in expired:
+            del self.jobs[jid]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: _ChatJob) -> None:
+        job.status = "running"
+        job.publish("status", {"status": job.status})
+
+        async def on_tool_start(tool_name: str) -> None:
+            job.publish("tool", {"tool": tool_name})
+
+        try:
+            response = await _chat_reply(job.request, on_tool_start=on_tool_start, background=True)
+            job.result = response.model_dump()
+            job.status = "succeeded"
+            job.publish("done", job.result)
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = {"code": "cancelled", "message": "Job was cancelled"}
+            job.publish("error", job.error)
+            raise
+        except HTTPException as e:
+            detail = e.detail if isinstance(e.detail, dict) else {}
+            job.status = "failed"
+            job.error = {
+                "code": str(detail.get("code") or "http_error"),
+                "message": str(detail.get("message") or e.detail or "Request failed"),
+            }
+            job.publish("error", job.error)
+        except Exception as e:
+            logger.exception("chat job %s failed", job.id)
+            job.status = "failed"
+            job.error = {"code": "job_error", "message": str(e)}
+            job.publish("error", job.error)
+        finally:
+            job.finished_unix_s = time.time()
+            job.run.close()
+
+    async def close(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        for t in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await t
+        self._tasks = []
+        # Jobs no worker picked up would otherwise stay "queued" forever.
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            self._queue.task_done()
+            job.status = "failed"
+            job.error = {"code": "cancelled", "message": "Job was cancelled"}
+            job.finished_unix_s = time.time()
+            job.publish("error", job.error)
+            job.run.close()
+
+    def stats(self) -> dict[str, Any]:
+        counts: dict[str, int] = {}
+        for j in self.jobs.values():
+            counts[j.status] = counts.get(j.status, 0) + 1
+        return {"queued": self._queue.qsize(), "workers": self._workers, "jobs": counts}
+
+
+JOB_QUEUE: _ChatJobQueue | None = None
+
+
+def _job_queue() -> _ChatJobQueue:
+    global JOB_QUEUE
+    if JOB_QUEUE is None:
+        JOB_QUEUE = _ChatJobQueue(
+            workers=int(os.getenv("AGENT_BACKEND_JOB_WORKERS", "4")),
+            max_queue=int(os.getenv("AGENT_BACKEND_JOB_MAX_QUEUE", "100")),
+            max_per_session=int(os.getenv("AGENT_BACKEND_JOB_MAX_PER_SESSION", "4")),
+            ttl_s=float(os.getenv("AGENT_BACKEND_JOB_TTL_SECONDS", "600")),
+        )
+    return JOB_QUEUE
+
+
+@app.post("/jobs/chat", status_code=202)
+async def create_chat_job(request: ChatRequest):
+    _validate_chat_request(request)
+
+    # Fix the session id now so the caller can use it before the job finishes.
+    request = request.model_copy(update={"session_id": request.session_id or uuid.uuid4().hex})
+    try:
+        job = _job_queue().submit(request)
+    except _JobQueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail={"code": "job_queue_full", "message": str(e)},
+            headers={"Retry-After": "5"},
+        )
+    return job.snapshot()
+
+
+def _get_job_or_404(job_id: str) -> _ChatJob:
+    job = _job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"code": "job_not_found", "message": "Unknown or expired job id"})
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_chat_job(job_id: str):
+    return _get_job_or_404(job_id).snapshot()
+
+
+@app.get("/jobs/{job_id}/events")
+async def chat_job_events(http_request: Request, job_id: str):
+    job = _get_job_or_404(job_id)
+    keepalive_s = float(os.getenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "2"))
+    last_event_id = _parse_last_event_id(http_request)
     return StreamingResponse(
-        gen(),
+        job.run.follow(keepalive_s, last_event_id + 1 if last_event_id is not None else 0),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -2531,6 +4796,7 @@ async def chat_stream(http_request: Request, request: ChatRequest):
         },
     )
 
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,6 +1,8 @@
+import asyncio
 import importlib.util
 import json
 import os
+import time
 from types import SimpleNamespace
 from pathlib import Path
 
@@ -66,6 +68,32 @@ def _fake_model_with_actions(mod):
     return FakeModel()
 
 
+def _fake_streaming_model(mod, pieces, first_delay_s=0.0, tail_delay_s=0.0):
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=True)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            async def _gen():
+                acc = ""
+                await asyncio.sleep(first_delay_s)
+                for p in pieces:
+                    acc += p
+                    yield SimpleNamespace(content=[{"type": "text", "text": acc}])
+                await asyncio.sleep(tail_delay_s)
+
+            return _gen()
+
+    return FakeModel()
+
+
+def _sse_frame(part):
+    """Parse one rendered SSE frame into (event, payload, id)."""
+    fields = dict(line.split(": ", 1) for line in part.strip("\n").split("\n"))
+    event_id = fields.get("id")
+    return fields["event"], json.loads(fields["data"]), int(event_id) if event_id is not None else None
+
+
 async def _client_for_app(app):
     transport = httpx.ASGITransport(app=app)
     return httpx.AsyncClient(transport=transport, base_url="http://test")
@@ -116,6 +144,22 @@ async def test_chat_actions_produce_execution_preview():
         assert body["execution_preview"]["actions"][0]["type"] == "start_dca"
 
 
+@pytest.mark.asyncio
+async def test_anonymous_chats_do_not_leak_session_locks():
+    mod = _load_module()
+
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=_fake_model(mod), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    async with await _client_for_app(mod.app) as client:
+        for _ in range(50):
+            r = await client.post("/chat", json={"user_input": "hello"})
+            assert r.status_code == 200
+
+    assert len(mod.SESSION_STORE._locks) == 0
+
+
 @pytest.mark.asyncio
 async def test_chat_buy_intent_returns_execution_plan():
     mod = _load_module()
@@ -139,8 +183,6 @@ async def test_chat_buy_intent_returns_execution_plan():
 async def test_chat_stream_buy_intent_includes_execution_plan(monkeypatch):
     mod = _load_module()
 
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_CHUNK_SIZE", "1000")
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_DELAY_MS", "0")
     monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
 
     mod.MODEL_BUNDLE = mod._ModelBundle(model=_fake_model(mod), formatter=_FakeFormatter())
@@ -186,8 +228,6 @@ async def test_chat_stream_buy_intent_includes_execution_plan(monkeypatch):
 async def test_chat_stream_emits_chunk_and_done_events(monkeypatch):
     mod = _load_module()
 
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_CHUNK_SIZE", "1000")
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_DELAY_MS", "0")
     monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
 
     mod.MODEL_BUNDLE = mod._ModelBundle(model=_fake_model(mod), formatter=_FakeFormatter())
@@ -236,8 +276,6 @@ async def test_chat_stream_eth_query_prefetches_eth_snapshot(monkeypatch):
 
     monkeypatch.setenv("AGENT_BACKEND_USE_SIMPLE_STRATEGY", "1")
     monkeypatch.setenv("AGENT_BACKEND_DEFAULT_SYMBOL", "BTCUSDT")
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_CHUNK_SIZE", "1000")
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_DELAY_MS", "0")
     monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
     monkeypatch.setenv("AGENT_BACKEND_BINANCE_BASE_URL", "https://api.binance.com")
 
@@ -295,8 +333,6 @@ async def test_chat_stream_indicator_query_prefetches_eth_snapshot(monkeypatch):
 
     monkeypatch.setenv("AGENT_BACKEND_USE_SIMPLE_STRATEGY", "1")
     monkeypatch.setenv("AGENT_BACKEND_DEFAULT_SYMBOL", "BTCUSDT")
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_CHUNK_SIZE", "1000")
-    monkeypatch.setenv("AGENT_BACKEND_STREAM_DELAY_MS", "0")
     monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
 
     mod.MODEL_BUNDLE = mod._ModelBundle(model=_fake_model(mod), formatter=_FakeFormatter())
@@ -355,3 +391,1168 @@ async def test_chat_input_too_large():
         assert r.status_code == 413
         j = r.json()
         assert j["code"] == "input_too_large"
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_pushes_first_delta_without_polling_delay(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_UPSTREAM_STREAMING", "1")
+
+    pieces = ['{"assistant_text": "', "hel", "lo", '", "intent": "chat", "params": {}, "actions": []}']
+    mod.MODEL_BUNDLE = mod._ModelBundle(
+        model=_fake_streaming_model(mod, pieces, first_delay_s=0.01, tail_delay_s=0.5),
+        formatter=_FakeFormatter(),
+    )
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    # httpx's ASGITransport buffers whole responses, so read the body iterator directly.
+    first_chunk_s = None
+    t0 = time.monotonic()
+    resp = await mod.chat_stream(None, mod.ChatRequest(user_input="hello", session_id="ttft"))
+    async for part in resp.body_iterator:
+        if part.startswith("event: chunk") and first_chunk_s is None:
+            first_chunk_s = time.monotonic() - t0
+        if part.startswith("event: done"):
+            break
+
+    # The model keeps the stream open for another 500ms; the first delta must not wait for it.
+    assert first_chunk_s is not None and first_chunk_s < 0.2
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_emits_plan_fields_before_done(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_UPSTREAM_STREAMING", "1")
+
+    pieces = [
+        '{"intent": "strat',
+        'egy_recommendation", "params": {}, "assistant_text": "Hi',
+        ' there", "rationale": "Range',
+        '-bound", "risk_notes": ["Fees", "Slip',
+        'page"], "actions": [{"type": "start_grid", "params": {"symbol": "BTC',
+        'USDT"}}',
+        "]}",
+    ]
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=_fake_streaming_model(mod, pieces), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    resp = await mod.chat_stream(None, mod.ChatRequest(user_input="hello", session_id="fields"))
+    events = []
+    async for part in resp.body_iterator:
+        if part.startswith("event: "):
+            name, payload, _ = _sse_frame(part)
+            events.append((name, payload))
+
+    names = [name for name, _ in events]
+    chunks = "".join(p["delta_text"] for name, p in events if name == "chunk")
+    fields: dict[str, str] = {}
+    for name, p in events:
+        if name == "field_delta":
+            fields[p["field"]] = fields.get(p["field"], "") + p["delta_text"]
+
+    assert chunks == "Hi there"
+    assert fields == {"rationale": "Range-bound", "risk_notes": "Fees\nSlippage"}
+    assert events[names.index("intent")][1]["intent"] == "strategy_recommendation"
+    action = events[names.index("action")][1]
+    assert action["index"] == 0
+    assert action["action"] == {"type": "start_grid", "params": {"symbol": "BTCUSDT"}}
+    assert action["strategy_label"] == "网格"
+    assert names.index("intent") < names.index("action") < names.index("done")
+    sequences = [p["sequence"] for _, p in events if "sequence" in p]
+    assert sequences == list(range(len(sequences)))
+
+
+def test_stream_text_deltas_match_joined_text_across_blocks():
+    mod = _load_module()
+    deltas = mod._StreamTextDeltas()
+
+    chunks = [
+        SimpleNamespace(content=[{"type": "thinking", "thinking": "hmm"}, {"type": "text", "text": "Hel"}]),
+        SimpleNamespace(content=[{"type": "text", "text": "Hello"}]),
+        SimpleNamespace(content=[{"type": "text", "text": "Hello"}, {"type": "text", "text": "wor"}]),
+        SimpleNamespace(content=[{"type": "text", "text": "Hello"}, {"type": "text", "text": "world"}]),
+    ]
+    out = [d for c in chunks for d in deltas.feed(c)]
+
+    assert out == ["Hel", "lo", "\nwor", "ld"]
+    assert "".join(out) == mod._text_from_chat_response(chunks[-1])
+    assert deltas.total_chars == len("Hello\nworld")
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_reuses_cached_strategy_reply_within_candle(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    calls = []
+
+    class CountingModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            calls.append(messages)
+            plan = {
+                "intent": "strategy_recommendation",
+                "params": {"symbol": "BTCUSDT"},
+                "assistant_text": "用网格",
+                "rationale": "震荡",
+                "risk_notes": [],
+                "actions": [{"type": "start_grid", "params": {"symbol": "BTCUSDT"}}],
+            }
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(plan, ensure_ascii=False)}])
+
+    candle_close_ms = int((time.time() + 600) * 1000)
+
+    async def fake_snapshot(**kwargs):
+        return {
+            "ok": True,
+            "symbol": "BTCUSDT",
+            "interval": "1h",
+            "candle_close_time_ms": candle_close_ms,
+            "price": {"current": 100.0, "change_24h_pct": 0.0},
+            "volume": {"ratio": 1.0},
+            "indicators": {"rsi_14": 55.0, "macd_histogram": 0.1, "bollinger_upper": 110.0, "bollinger_lower": 90.0},
+        }
+
+    monkeypatch.setattr(mod, "fetch_cex_market_snapshot", fake_snapshot)
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=CountingModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+    mod.STRATEGY_CACHE = mod._StrategyResponseCache()
+
+    async with await _client_for_app(mod.app) as client:
+        prompts = [
+            {"user_input": "BTC 用什么策略", "session_id": "a"},
+            {"user_input": "btc用什么策略？", "session_id": "b"},
+            {"user_input": "BTC 用什么策略", "session_id": "c", "use_cache": False},
+            # Session "a" now has history: its reply must not come from (or go to) fresh sessions.
+            {"user_input": "BTC 用什么策略", "session_id": "a"},
+        ]
+        bodies = []
+        for body in prompts:
+            r = await client.post("/chat/stream", json=body)
+            assert r.status_code == 200
+            assert "event: done" in r.text
+            bodies.append(r.text)
+
+        m = await client.get("/metrics")
+
+    assert len(calls) == 3
+    # The cached reply is still streamed to the client.
+    assert "用网格" in bodies[1] and "event: action" in bodies[1]
+    assert m.json()["strategy_cache"] == {"entries": 2, "hits": 1, "misses": 2, "hit_rate": 0.3333}
+
+
+@pytest.mark.asyncio
+async def test_market_snapshot_fetch_overlaps_session_load(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    timeline = []
+
+    class SlowLoadStore(mod._InMemorySessionStore):
+        async def load_memory(self, session_id):
+            timeline.append("load_start")
+            await asyncio.sleep(0.2)
+            timeline.append("load_end")
+            return await super().load_memory(session_id)
+
+    async def slow_snapshot(**kwargs):
+        timeline.append("snapshot_start")
+        await asyncio.sleep(0.2)
+        timeline.append("snapshot_end")
+        return {"ok": True, "symbol": "BTCUSDT", "interval": "1h", "price": {"current": 100.0}}
+
+    class PlanModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            timeline.append("llm")
+            plan = {"intent": "strategy_recommendation", "params": {}, "assistant_text": "ok", "actions": []}
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(plan)}])
+
+    monkeypatch.setattr(mod, "fetch_cex_market_snapshot", slow_snapshot)
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=PlanModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = SlowLoadStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+    mod.STRATEGY_CACHE = None
+
+    started = time.perf_counter()
+    resp = await mod.chat_stream(None, mod.ChatRequest(user_input="BTC 用什么策略", session_id="s"))
+    body = "".join([part async for part in resp.body_iterator])
+    elapsed = time.perf_counter() - started
+
+    assert "event: done" in body
+    assert timeline.index("snapshot_start") < timeline.index("load_end")
+    assert timeline.index("llm") > max(timeline.index("load_end"), timeline.index("snapshot_end"))
+    assert elapsed < 0.35
+
+
+@pytest.mark.asyncio
+async def test_chat_turn_runs_shared_stages_for_plain_chat(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    snapshots = []
+
+    async def fake_snapshot(**kwargs):
+        snapshots.append(kwargs["symbol"])
+        return {"ok": True, "symbol": "BTCUSDT", "interval": "1h", "price": {"current": 100.0}}
+
+    class PlanModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            plan = {"intent": "strategy_recommendation", "params": {}, "assistant_text": "ok", "actions": []}
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(plan)}])
+
+    monkeypatch.setattr(mod, "fetch_cex_market_snapshot", fake_snapshot)
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=PlanModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+    mod.STRATEGY_CACHE = None
+    mod.CHAT_STAGE_LATENCY = mod._LatencyTracker(min_samples=1)
+
+    seen = []
+    turn = mod._ChatTurn(
+        mod.ChatRequest(user_input="BTC 用什么策略", session_id="s"),
+        "s",
+        use_simple_strategy=True,
+        on_stage=lambda name, seconds: seen.append(name),
+    )
+    response = await mod._run_chat_turn(turn)
+
+    assert response.execution_preview is not None
+    assert snapshots == ["BTCUSDT"]
+    assert seen[0] == "parse"
+    assert set(seen) == {"parse", "fetch", "session", "plan", "preview", "persist"}
+    assert seen.index("plan") < seen.index("preview") < seen.index("persist")
+    assert set(turn.timings) == set(seen)
+    assert set(mod.CHAT_STAGE_LATENCY.stats()) == set(seen)
+
+    # /chat keeps the tool loop by default; the prefetch path is opt-in.
+    monkeypatch.setenv("AGENT_BACKEND_CHAT_USE_SIMPLE_STRATEGY", "1")
+    async with await _client_for_app(mod.app) as client:
+        r = await client.post("/chat", json={"user_input": "BTC 用什么策略", "session_id": "s"})
+        assert r.status_code == 200
+        assert snapshots == ["BTCUSDT", "BTCUSDT"]
+        metrics = (await client.get("/metrics")).json()
+        assert metrics["chat_stages"]["plan"]["samples"] == 2
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_acks_before_market_snapshot_and_splices_reply(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_EARLY_ACK", "1")
+
+    snapshot_ready = asyncio.Event()
+
+    async def slow_snapshot(**kwargs):
+        await asyncio.sleep(0.2)
+        snapshot_ready.set()
+        return {"ok": True, "symbol": "BTCUSDT", "interval": "1h", "price": {"current": 100.0}}
+
+    class PlanModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            plan = {"intent": "strategy_recommendation", "params": {}, "assistant_text": "用网格", "actions": []}
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(plan, ensure_ascii=False)}])
+
+    monkeypatch.setattr(mod, "fetch_cex_market_snapshot", slow_snapshot)
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=PlanModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+    mod.STRATEGY_CACHE = None
+
+    resp = await mod.chat_stream(None, mod.ChatRequest(user_input="BTC 用什么策略", session_id="s"))
+    events = []
+    async for part in resp.body_iterator:
+        if part.startswith("event: "):
+            name, payload, _ = _sse_frame(part)
+            events.append((name, payload, snapshot_ready.is_set()))
+
+    chunks = [p for name, p, _ in events if name == "chunk"]
+    assert chunks[0]["stage"] == "ack"
+    assert events[0][2] is False
+    done = [p for name, p, _ in events if name == "done"][0]
+    ack = chunks[0]["delta_text"]
+    assert "".join(c["delta_text"] for c in chunks) == ack + "用网格"
+    assert done["assistant_text"].startswith(ack)
+
+    memory = await mod.SESSION_STORE.load_memory("s")
+    history = await mod._maybe_await(memory.get_memory())
+    assert history[-1].content == done["assistant_text"][len(ack) :]
+
+
+@pytest.mark.asyncio
+async def test_strategy_prompt_keeps_a_stable_prefix_and_reports_cached_tokens():
+    mod = _load_module()
+    mod.LLM_USAGE = mod._LlmUsageStats()
+
+    seen = []
+
+    class RecordingModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            seen.append(messages)
+            usage = SimpleNamespace(
+                input_tokens=1000,
+                output_tokens=50,
+                metadata={"prompt_tokens": 1000, "prompt_tokens_details": {"cached_tokens": 800}},
+            )
+            plan = {"intent": "chat", "params": {}, "assistant_text": "ok", "actions": []}
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(plan)}], usage=usage)
+
+    bundle = mod._ModelBundle(model=RecordingModel(), formatter=_FakeFormatter(), provider="anthropic")
+    history = [
+        mod.Msg(name="user", role="user", content="hi"),
+        mod.Msg(name="assistant", role="assistant", content="hello"),
+    ]
+    for price in (100.0, 101.5):
+        snapshot = {"ok": True, "symbol": "BTCUSDT", "price": {"current": price}, "volume": {}, "indicators": {}}
+        await mod._strategy_plan_simple(bundle, history, "BTC 用什么策略", market_snapshot=snapshot)
+
+    first, second = seen
+    assert first[0] == second[0]
+    assert first[:-1] == second[:-1]
+    assert "100.0" in first[-1]["content"] and first[-1]["content"].endswith("BTC 用什么策略")
+    assert mod.LLM_USAGE.stats() == {
+        "calls": 2,
+        "input_tokens": 2000,
+        "output_tokens": 100,
+        "cached_input_tokens": 1600,
+        "cached_ratio": 0.8,
+    }
+
+
+def test_anthropic_cache_breakpoints_mark_system_and_history_end():
+    mod = _load_module()
+
+    formatted = [
+        {"role": "system", "content": [{"type": "text", "text": "sys"}]},
+        {"role": "user", "content": [{"type": "text", "text": "hi"}]},
+        {"role": "assistant", "content": [{"type": "text", "text": "hello"}]},
+        {"role": "user", "content": [{"type": "text", "text": "market + question"}]},
+    ]
+    mod._add_anthropic_cache_breakpoints(formatted)
+
+    marked = [i for i, m in enumerate(formatted) if "cache_control" in m["content"][-1]]
+    assert marked == [0, 2]
+
+
+def test_parse_strategy_plan_recovers_json_from_prose_and_normalizes():
+    mod = _load_module()
+
+    text = 'Sure! Here is the plan:\n{"intent": "strategy_recommendation", "assistant_text": "网格", "actions": [{"type": "start_grid"}]}\nGood luck.'
+    plan = mod._parse_strategy_plan(text)
+
+    assert plan["intent"] == "strategy_recommendation"
+    assert plan["actions"] == [{"type": "start_grid", "params": {}}]
+    assert plan["risk_notes"] == [] and plan["params"] == {}
+
+    # Off-schema replies are kept as-is rather than dropped.
+    odd = mod._parse_strategy_plan('{"intent": "chat", "risk_notes": "none", "extra": 1}')
+    assert odd == {"intent": "chat", "risk_notes": "none", "extra": 1}
+    assert mod._parse_strategy_plan("no json here") is None
+
+
+@pytest.mark.asyncio
+async def test_strategy_plan_requests_json_mode_where_supported(monkeypatch):
+    mod = _load_module()
+    monkeypatch.delenv("AGENT_BACKEND_LLM_JSON_MODE", raising=False)
+
+    seen_kwargs = []
+
+    class RecordingModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            seen_kwargs.append(kwargs)
+            plan = {"intent": "chat", "assistant_text": "ok"}
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(plan)}])
+
+    for provider in ("deepseek", "openai", "anthropic"):
+        bundle = mod._ModelBundle(model=RecordingModel(), formatter=_FakeFormatter(), provider=provider)
+        plan = await mod._strategy_plan_simple(bundle, [], "hello", intent_hint="chat")
+        assert plan["assistant_text"] == "ok"
+
+    deepseek, openai, anthropic = seen_kwargs
+    assert deepseek == {"response_format": {"type": "json_object"}}
+    assert openai["response_format"]["type"] == "json_schema"
+    assert "assistant_text" in openai["response_format"]["json_schema"]["schema"]["properties"]
+    assert anthropic == {}
+
+
+def _tool_calling_model(mod, tool_calls, final_plan):
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+            self.calls = []
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            self.calls.append(messages)
+            if len(self.calls) == 1:
+                return SimpleNamespace(content=[{"type": "tool_use", **tc} for tc in tool_calls])
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(final_plan)}])
+
+    return FakeModel()
+
+
+def _slow_toolkit(mod, delays, started):
+    toolkit = mod.Toolkit()
+
+    def make(name, delay):
+        async def tool(tag: str = "") -> mod.ToolResponse:
+            """Fake slow tool.
+
+            Args:
+                tag (str): Echoed back.
+            """
+            started.append(name)
+            await asyncio.sleep(delay)
+            return mod.ToolResponse(content=[mod.TextBlock(type="text", text=json.dumps({"tool": name, "tag": tag}))])
+
+        tool.__name__ = name
+        return tool
+
+    for name, delay in delays.items():
+        toolkit.register_tool_function(make(name, delay))
+    return toolkit
+
+
+@pytest.mark.asyncio
+async def test_tool_calls_of_one_turn_run_concurrently_in_order(monkeypatch):
+    mod = _load_module()
+    monkeypatch.delenv("AGENT_BACKEND_TOOL_MAX_PARALLEL", raising=False)
+
+    started = []
+    toolkit = _slow_toolkit(mod, {"slow_a": 0.3, "slow_b": 0.1, "slow_c": 0.2}, started)
+    calls = [
+        {"id": "1", "name": "slow_a", "input": {"tag": "a"}},
+        {"id": "2", "name": "slow_b", "input": {"tag": "b"}},
+        {"id": "3", "name": "slow_c", "input": {"tag": "c"}},
+    ]
+    model = _tool_calling_model(mod, calls, {"intent": "chat", "assistant_text": "done"})
+    bundle = mod._ModelBundle(model=model, formatter=_FakeFormatter())
+
+    t0 = time.monotonic()
+    plan = await mod._strategy_plan_with_tools(bundle, toolkit, [], "hi")
+    elapsed = time.monotonic() - t0
+
+    assert plan["assistant_text"] == "done"
+    # Wall time is that of the slowest tool, not the sum (0.6s).
+    assert 0.3 <= elapsed < 0.45
+    results = [
+        m["content"][0]
+        for m in model.calls[1]
+        if isinstance(m["content"], list) and m["content"][0].get("type") == "tool_result"
+    ]
+    assert [r["id"] for r in results] == ["1", "2", "3"]
+    assert [json.loads(r["output"])["tag"] for r in results] == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_tool_concurrency_cap_is_respected(monkeypatch):
+    mod = _load_module()
+    monkeypatch.setenv("AGENT_BACKEND_TOOL_MAX_PARALLEL", "1")
+
+    started = []
+    toolkit = _slow_toolkit(mod, {"slow_a": 0.1, "slow_b": 0.1}, started)
+    calls = [
+        {"id": "1", "name": "slow_a", "input": {}},
+        {"id": "2", "name": "slow_b", "input": {}},
+    ]
+    model = _tool_calling_model(mod, calls, {"intent": "chat", "assistant_text": "done"})
+    bundle = mod._ModelBundle(model=model, formatter=_FakeFormatter())
+
+    t0 = time.monotonic()
+    await mod._strategy_plan_with_tools(bundle, toolkit, [], "hi")
+
+    assert time.monotonic() - t0 >= 0.2
+    assert started == ["slow_a", "slow_b"]
+
+
+@pytest.mark.asyncio
+async def test_repeated_tool_calls_in_one_request_are_memoized():
+    mod = _load_module()
+
+    started = []
+    toolkit = _slow_toolkit(mod, {"klines": 0.05}, started)
+    turns = [
+        [{"id": "1", "name": "klines", "input": {"tag": "btc"}}, {"id": "2", "name": "klines", "input": {"tag": "btc"}}],
+        [{"id": "3", "name": "klines", "input": {"tag": "btc"}}, {"id": "4", "name": "klines", "input": {"tag": "eth"}}],
+    ]
+
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+            self.calls = []
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            self.calls.append(messages)
+            if len(self.calls) <= len(turns):
+                return SimpleNamespace(content=[{"type": "tool_use", **tc} for tc in turns[len(self.calls) - 1]])
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps({"intent": "chat", "assistant_text": "ok"})}])
+
+    model = FakeModel()
+    bundle = mod._ModelBundle(model=model, formatter=_FakeFormatter())
+    await mod._strategy_plan_with_tools(bundle, toolkit, [], "hi")
+
+    # One real execution per distinct input, across and within turns.
+    assert started == ["klines", "klines"]
+    outputs = {
+        m["content"][0]["id"]: m["content"][0]["output"]
+        for m in model.calls[-1]
+        if isinstance(m["content"], list) and m["content"][0].get("type") == "tool_result"
+    }
+    assert not outputs["1"].startswith("[cached]")
+    assert outputs["2"].startswith("[cached]") and outputs["3"].startswith("[cached]")
+    assert outputs["2"].endswith(outputs["1"])
+    assert json.loads(outputs["4"])["tag"] == "eth"
+
+
+def _scripted_model(mod, text, delay_s=0.0, error=None, log=None):
+    class ScriptedModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            try:
+                await asyncio.sleep(delay_s)
+            except asyncio.CancelledError:
+                if log is not None:
+                    log.append(f"{text}:cancelled")
+                raise
+            if error is not None:
+                raise error
+            return SimpleNamespace(content=[{"type": "text", "text": text}])
+
+    return ScriptedModel()
+
+
+@pytest.mark.asyncio
+async def test_call_model_fails_over_to_next_backend(monkeypatch):
+    mod = _load_module()
+    mod.LLM_LATENCY = mod._LatencyTracker()
+    monkeypatch.setenv("AGENT_BACKEND_LLM_HEDGE", "0")
+
+    bundle = mod._ModelBundle(
+        model=_scripted_model(mod, "a", error=RuntimeError("connection reset")),
+        formatter=_FakeFormatter(),
+        provider="deepseek",
+        fallbacks=[mod._ModelBundle(model=_scripted_model(mod, "b"), formatter=_FakeFormatter(), provider="openai")],
+    )
+    deltas = []
+
+    async def on_delta(d):
+        deltas.append(d)
+
+    res = await mod._call_model(bundle, [], None, on_text_delta=on_delta)
+
+    assert mod._text_from_chat_response(res) == "b"
+    assert deltas == ["b"]
+    stats = mod.LLM_LATENCY.stats()
+    assert stats["deepseek"]["errors"] == 1 and stats["openai"]["samples"] == 1
+
+
+@pytest.mark.asyncio
+async def test_call_model_hedges_slow_backend_and_cancels_loser(monkeypatch):
+    mod = _load_module()
+    mod.LLM_LATENCY = mod._LatencyTracker()
+    monkeypatch.setenv("AGENT_BACKEND_LLM_HEDGE_DELAY_MS", "50")
+
+    log = []
+    bundle = mod._ModelBundle(
+        model=_scripted_model(mod, "slow", delay_s=1.0, log=log),
+        formatter=_FakeFormatter(),
+        provider="deepseek",
+        fallbacks=[mod._ModelBundle(model=_scripted_model(mod, "fast", delay_s=0.05), formatter=_FakeFormatter(), provider="openai")],
+    )
+
+    started = time.perf_counter()
+    res = await mod._call_model(bundle, [], None)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0)
+
+    assert mod._text_from_chat_response(res) == "fast"
+    assert elapsed < 0.5
+    assert log == ["slow:cancelled"]
+
+    # Once enough samples exist the hedge delay follows the provider's p95.
+    for _ in range(20):
+        mod.LLM_LATENCY.record("deepseek", 0.4)
+    assert mod._hedge_delay_s(bundle) == pytest.approx(0.4)
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_opens_fails_fast_and_recovers_via_probe():
+    mod = _load_module()
+    breaker = mod._CircuitBreaker("binance:test", window=10, min_calls=4, failure_rate=0.5, open_s=0.05)
+    calls = []
+
+    async def failing():
+        calls.append("fail")
+        raise httpx.ConnectError("connection refused")
+
+    async def ok():
+        calls.append("ok")
+        return "ok"
+
+    for _ in range(4):
+        with pytest.raises(mod._UpstreamNetworkError):
+            await breaker.call(failing)
+    assert breaker.state == "open"
+
+    with pytest.raises(mod._UpstreamUnavailable):
+        await breaker.call(ok)
+    assert calls.count("ok") == 0 and breaker.rejected == 1
+
+    await asyncio.sleep(0.06)
+    assert await breaker.call(ok) == "ok"
+    assert breaker.state == "closed"
+
+    # Errors that are not upstream faults pass through untouched and are not counted.
+    with pytest.raises(ValueError):
+        await breaker.call(lambda: asyncio.sleep(0, result=int("x")))
+    assert breaker.stats()["failures"] == 0
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_timeout_follows_recent_latency():
+    mod = _load_module()
+    breaker = mod._CircuitBreaker("llm:test", min_calls=3, timeout_factor=3.0, min_timeout_s=0.05)
+
+    assert breaker.timeout_s(10.0) == 10.0
+    for _ in range(3):
+        await breaker.call(lambda: asyncio.sleep(0.02), 10.0)
+    assert 0.05 <= breaker.timeout_s(10.0) < 0.2
+
+    # A degraded call is cut off at the adaptive timeout, not the static one.
+    started = time.perf_counter()
+    with pytest.raises(mod._UpstreamTimeout):
+        await breaker.call(lambda: asyncio.sleep(5), 10.0)
+    assert time.perf_counter() - started < 0.5
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_timeouts_are_per_kind_and_grow_back():
+    mod = _load_module()
+    breaker = mod._CircuitBreaker("llm:test", min_calls=3, timeout_factor=2.0, min_timeout_s=0.01, failure_rate=1.0)
+
+    for _ in range(3):
+        await breaker.call(lambda: asyncio.sleep(0.01), 10.0, "text")
+    # Short calls of one kind do not shrink the bound of another.
+    assert breaker.timeout_s(10.0, "json") == 10.0
+    short = breaker.timeout_s(10.0, "text")
+    assert short < 0.1
+
+    # A call that hits the bound is recorded at its elapsed time, so the bound grows.
+    with pytest.raises(mod._UpstreamTimeout):
+        await breaker.call(lambda: asyncio.sleep(5), 10.0, "text")
+    assert breaker.timeout_s(10.0, "text") > short
+    assert set(breaker.stats()["timeout_s"]) == {"text"}
+
+
+@pytest.mark.asyncio
+async def test_call_model_timeout_bounds_sequential_failover(monkeypatch):
+    mod = _load_module()
+    monkeypatch.setenv("AGENT_BACKEND_LLM_HEDGE", "0")
+
+    fallback = mod._ModelBundle(model=_scripted_model(mod, "b", delay_s=0.15), formatter=_FakeFormatter(), provider="openai")
+    bundle = mod._ModelBundle(
+        model=_scripted_model(mod, "a", delay_s=0.15, error=ConnectionError("reset")),
+        formatter=_FakeFormatter(),
+        provider="deepseek",
+        fallbacks=[fallback],
+    )
+
+    started = time.perf_counter()
+    with pytest.raises(mod._UpstreamTimeout) as excinfo:
+        await mod._call_model(bundle, [], None, timeout_s=0.2)
+
+    # Each attempt alone fits in 0.2s; together they do not.
+    assert time.perf_counter() - started < 0.28
+    assert excinfo.value.code == "llm_timeout"
+
+
+@pytest.mark.asyncio
+async def test_chat_maps_upstream_errors_by_type(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_USE_SIMPLE_STRATEGY", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+    mod.MODEL_BUNDLE = mod._ModelBundle(
+        model=_scripted_model(mod, "", error=httpx.ReadTimeout("read timed out")),
+        formatter=_FakeFormatter(),
+        provider="deepseek",
+    )
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    async with await _client_for_app(mod.app) as client:
+        r = await client.post("/chat", json={"user_input": "hi", "session_id": "s"})
+        m = await client.get("/metrics")
+
+    assert r.status_code == 504
+    assert r.json()["code"] == "upstream_timeout"
+    assert m.json()["upstreams"]["llm:deepseek"]["failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_admission_limiter_bounds_queue_and_prefers_tool_loops():
+    mod = _load_module()
+    limiter = mod._AdmissionLimiter("llm:test", max_concurrent=1, max_queue=1)
+    order = []
+    release = asyncio.Event()
+
+    async def worker(tag, priority):
+        async with limiter.slot(priority):
+            order.append(tag)
+            await release.wait()
+
+    holder = asyncio.create_task(worker("holder", 1))
+    await asyncio.sleep(0)
+    normal = asyncio.create_task(worker("normal", 1))
+    await asyncio.sleep(0)
+
+    assert limiter.saturated()
+    with pytest.raises(mod._AdmissionRejected) as exc:
+        await limiter._acquire(1)
+    assert exc.value.retry_after_s >= 1
+
+    # A tool-loop follow-up may still queue, and goes ahead of the earlier normal waiter.
+    follow_up = asyncio.create_task(worker("tool_loop", 0))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(holder, normal, follow_up)
+
+    assert order == ["holder", "tool_loop", "normal"]
+    assert limiter.stats()["active"] == 0 and limiter.stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_returns_429_with_retry_after_when_saturated(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+    monkeypatch.setenv("AGENT_BACKEND_LLM_MAX_CONCURRENCY", "1")
+    monkeypatch.setenv("AGENT_BACKEND_LLM_MAX_QUEUE", "0")
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=_scripted_model(mod, "hi"), formatter=_FakeFormatter(), provider="deepseek")
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    limiter = mod._llm_limiter("deepseek")
+    async with limiter.slot():
+        async with await _client_for_app(mod.app) as client:
+            r = await client.post("/chat/stream", json={"user_input": "hi", "session_id": "s"})
+
+    assert r.status_code == 429
+    assert r.json()["code"] == "rate_limited"
+    assert int(r.headers["retry-after"]) >= 1
+
+
+@pytest.mark.asyncio
+async def test_duplicate_chat_stream_attaches_to_in_flight_run(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    pieces = ['{"assistant_text": "', "hel", "lo", '", "intent": "chat", "params": {}, "actions": []}']
+    inner = _fake_streaming_model(mod, pieces, tail_delay_s=0.1)
+    calls = []
+
+    class CountingModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=True)
+
+        async def __call__(self, *args, **kwargs):
+            calls.append(1)
+            return await inner(*args, **kwargs)
+
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=CountingModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    request = mod.ChatRequest(user_input="hello", session_id="retry")
+    first = await mod.chat_stream(None, request)
+    first_parts = []
+    async for part in first.body_iterator:
+        first_parts.append(part)
+        if part.startswith("event: chunk"):
+            break
+
+    # The retry arrives after the first chunk went out and still gets it.
+    second = await mod.chat_stream(None, request)
+    second_parts = [part async for part in second.body_iterator]
+    first_parts += [part async for part in first.body_iterator]
+
+    assert len(calls) == 1
+    assert second_parts == first_parts
+    assert any(p.startswith("event: done") for p in second_parts)
+    assert mod.STREAM_RUNS[("retry", "hello")].closed
+
+    history = await mod._maybe_await((await mod.SESSION_STORE.load_memory("retry")).get_memory())
+    assert len(history) == 2
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_resumes_from_last_event_id_after_disconnect(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    pieces = ['{"assistant_text": "', "a", "b", "c", '", "intent": "chat", "params": {}, "actions": []}']
+    calls = []
+    inner = _fake_streaming_model(mod, pieces, first_delay_s=0.02, tail_delay_s=0.05)
+
+    class CountingModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=True)
+
+        async def __call__(self, *args, **kwargs):
+            calls.append(1)
+            return await inner(*args, **kwargs)
+
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=CountingModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+    request = mod.ChatRequest(user_input="hello", session_id="resume")
+
+    first = await mod.chat_stream(None, request)
+    seen = []
+    async for part in first.body_iterator:
+        if part.startswith("event: "):
+            seen.append(_sse_frame(part))
+            break
+    # The connection drops; the computation carries on without it.
+    await first.body_iterator.aclose()
+    await asyncio.sleep(0.15)
+
+    reconnect = mod.Request({"type": "http", "headers": [(b"last-event-id", str(seen[-1][2]).encode())]})
+    second = await mod.chat_stream(reconnect, request)
+    rest = [_sse_frame(p) for p in [part async for part in second.body_iterator] if p.startswith("event: ")]
+
+    assert len(calls) == 1
+    ids = [seen[-1][2]] + [event_id for _, _, event_id in rest]
+    assert ids == list(range(ids[0], ids[0] + len(ids)))
+    assert "".join(p["delta_text"] for name, p, _ in [*seen, *rest] if name == "chunk") == "abc"
+    assert rest[-1][0] == "done"
+
+
+@pytest.mark.asyncio
+async def test_anonymous_chat_stream_resumes_under_generated_session_id(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    pieces = ['{"assistant_text": "', "a", "b", "c", '", "intent": "chat", "params": {}, "actions": []}']
+    calls = []
+    inner = _fake_streaming_model(mod, pieces, first_delay_s=0.02, tail_delay_s=0.05)
+
+    class CountingModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=True)
+
+        async def __call__(self, *args, **kwargs):
+            calls.append(1)
+            return await inner(*args, **kwargs)
+
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=CountingModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    first = await mod.chat_stream(None, mod.ChatRequest(user_input="hello"))
+    async for part in first.body_iterator:
+        if part.startswith("event: "):
+            seen = _sse_frame(part)
+            break
+    await first.body_iterator.aclose()
+
+    # The client reconnects with the session_id the events carried.
+    session_id = seen[1]["session_id"]
+    reconnect = mod.Request({"type": "http", "headers": [(b"last-event-id", str(seen[2]).encode())]})
+    second = await mod.chat_stream(reconnect, mod.ChatRequest(user_input="hello", session_id=session_id))
+    rest = [_sse_frame(p) for p in [part async for part in second.body_iterator] if p.startswith("event: ")]
+
+    assert len(calls) == 1
+    assert rest[0][2] == seen[2] + 1
+    assert rest[-1][0] == "done" and rest[-1][1]["session_id"] == session_id
+
+
+@pytest.mark.asyncio
+async def test_stream_run_replay_reports_evicted_events():
+    mod = _load_module()
+    run = mod._StreamRun(max_frames=2)
+    for i in range(4):
+        run.publish("chunk", {"delta_text": str(i)})
+    run.close()
+
+    frames = [_sse_frame(p) for p in [part async for part in run.follow(0, start_id=1)] if p.startswith("event: ")]
+
+    assert frames[0][:2] == ("replay_gap", {"from_id": 1, "to_id": 2})
+    assert [(p["delta_text"], event_id) for _, p, event_id in frames[1:]] == [("2", 2), ("3", 3)]
+
+
+@pytest.mark.asyncio
+async def test_chat_job_runs_in_background_and_streams_progress(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    started = []
+    mod.TOOLKIT = _slow_toolkit(mod, {"klines": 0.05}, started)
+    mod.MODEL_BUNDLE = mod._ModelBundle(
+        model=_tool_calling_model(
+            mod,
+            [{"id": "1", "name": "klines", "input": {"tag": "btc"}}],
+            {"intent": "chat", "assistant_text": "done thinking", "params": {}, "actions": []},
+        ),
+        formatter=_FakeFormatter(),
+    )
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.JOB_QUEUE = None
+
+    async with await _client_for_app(mod.app) as client:
+        r = await client.post("/jobs/chat", json={"user_input": "analyze btc"})
+        assert r.status_code == 202
+        job = r.json()
+        assert job["status"] == "queued" and job["session_id"]
+
+        for _ in range(100):
+            polled = (await client.get(f"/jobs/{job['job_id']}")).json()
+            if polled["status"] in {"succeeded", "failed"}:
+                break
+            await asyncio.sleep(0.01)
+        events = await client.get(f"/jobs/{job['job_id']}/events")
+        missing = await client.get("/jobs/nope")
+
+    assert polled["status"] == "succeeded"
+    assert polled["result"]["assistant_text"] == "done thinking"
+    assert polled["result"]["session_id"] == job["session_id"]
+    frames = [_sse_frame(p + "\n\n") for p in events.text.split("\n\n") if p.startswith("event: ")]
+    assert [(name, p.get("status") or p.get("tool")) for name, p, _ in frames] == [
+        ("status", "queued"),
+        ("status", "running"),
+        ("tool", "klines"),
+        ("done", None),
+    ]
+    assert missing.status_code == 404 and missing.json()["code"] == "job_not_found"
+    await mod.JOB_QUEUE.close()
+
+
+@pytest.mark.asyncio
+async def test_chat_job_queue_is_bounded_per_session():
+    mod = _load_module()
+    queue = mod._ChatJobQueue(workers=1, max_queue=10, max_per_session=1)
+    queue._tasks = [asyncio.create_task(asyncio.sleep(10))]  # keep jobs queued
+
+    queue.submit(mod.ChatRequest(user_input="a", session_id="s1"))
+    with pytest.raises(mod._JobQueueFull):
+        queue.submit(mod.ChatRequest(user_input="b", session_id="s1"))
+    queue.submit(mod.ChatRequest(user_input="c", session_id="s2"))
+
+    assert queue.stats()["queued"] == 2
+    await queue.close()
+    # Jobs still waiting at shutdown are failed, not left queued.
+    assert queue.stats()["jobs"] == {"failed": 2}
+    assert all(j.error["code"] == "cancelled" and j.run.closed for j in queue.jobs.values())
+
+
+@pytest.mark.asyncio
+async def test_chat_job_waits_for_llm_capacity_instead_of_429(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+    monkeypatch.setenv("AGENT_BACKEND_LLM_MAX_CONCURRENCY", "1")
+    monkeypatch.setenv("AGENT_BACKEND_LLM_MAX_QUEUE", "0")
+    monkeypatch.setenv("AGENT_BACKEND_LLM_QUEUE_TIMEOUT_SECONDS", "0.05")
+
+    mod.TOOLKIT = mod.Toolkit()
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=_fake_model(mod), formatter=_FakeFormatter(), provider="deepseek")
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    queue = mod._ChatJobQueue(workers=1)
+
+    limiter = mod._llm_limiter("deepseek")
+    async with limiter.slot():
+        job = queue.submit(mod.ChatRequest(user_input="hello", session_id="s"))
+        # Past the interactive queue timeout the job is still waiting, not rejected.
+        await asyncio.sleep(0.15)
+        assert job.status == "running"
+        assert limiter.queued() == 1 and limiter.saturated()
+
+    for _ in range(100):
+        if job.finished_unix_s is not None:
+            break
+        await asyncio.sleep(0.01)
+    await queue.close()
+
+    assert job.status == "succeeded", job.error
+    assert limiter.rejected == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_emits_stage_llm_and_first_byte_spans(monkeypatch):
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    in_memory = pytest.importorskip("opentelemetry.sdk.trace.export.in_memory_span_exporter")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+
+    mod = _load_module()
+
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_KEEPALIVE_SECONDS", "0")
+    monkeypatch.setenv("AGENT_BACKEND_MAX_INPUT_CHARS", "2000")
+
+    exporter = in_memory.InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(mod, "_tracer", lambda: provider.get_tracer("test"))
+
+    async def fake_snapshot(**kwargs):
+        return {"ok": True, "symbol": "BTCUSDT", "interval": "1h", "price": {"current": 100.0}}
+
+    class PlanModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            plan = {"intent": "chat", "params": {}, "assistant_text": "ok", "actions": []}
+            usage = SimpleNamespace(input_tokens=120, output_tokens=7)
+            return SimpleNamespace(content=[{"type": "text", "text": json.dumps(plan)}], usage=usage)
+
+    monkeypatch.setattr(mod, "fetch_cex_market_snapshot", fake_snapshot)
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=PlanModel(), formatter=_FakeFormatter(), provider="openai")
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+    mod.STRATEGY_CACHE = None
+
+    resp = await mod.chat_stream(None, mod.ChatRequest(user_input="BTC 用什么策略", session_id="s"))
+    body = "".join([part async for part in resp.body_iterator])
+    assert "event: done" in body
+
+    spans = {s.name: s for s in exporter.get_finished_spans()}
+    for name in (
+        "chat.stream",
+        "chat.sse_first_byte",
+        "chat.turn",
+        "chat.fetch",
+        "chat.session",
+        "session.lock_wait",
+        "memory.load",
+        "chat.plan",
+        "llm.call",
+        "chat.preview",
+        "chat.persist",
+        "memory.save",
+    ):
+        assert name in spans, name
+    assert len({s.context.trace_id for s in spans.values()}) == 1
+    assert spans["llm.call"].parent.span_id == spans["chat.plan"].context.span_id
+    assert spans["chat.fetch"].parent.span_id == spans["chat.turn"].context.span_id
+    assert spans["llm.call"].attributes["gen_ai.system"] == "openai"
+    assert spans["llm.call"].attributes["gen_ai.usage.input_tokens"] == 120
+    assert spans["llm.call"].attributes["gen_ai.usage.output_tokens"] == 7
+    assert spans["chat.fetch"].attributes["market.ok"] is True
+    assert spans["chat.sse_first_byte"].end_time <= spans["chat.turn"].end_time
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_llm_calls_get_a_breaker_ceiling(monkeypatch):
+    mod = _load_module()
+
+    monkeypatch.delenv("AGENT_BACKEND_LLM_STREAM_TIMEOUT_SECONDS", raising=False)
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_TOTAL_TIMEOUT_SECONDS", "40")
+    mod.MODEL_BUNDLE = mod._ModelBundle(
+        model=_fake_streaming_model(mod, ['{"assistant_text": "ok", "intent": "chat", "params": {}, "actions": []}']),
+        formatter=_FakeFormatter(),
+    )
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    timeouts = []
+    call_model = mod._call_model
+
+    async def recording_call_model(*args, **kwargs):
+        timeouts.append(kwargs.get("timeout_s"))
+        return await call_model(*args, **kwargs)
+
+    monkeypatch.setattr(mod, "_call_model", recording_call_model)
+
+    for use_simple in ("1", "0"):
+        monkeypatch.setenv("AGENT_BACKEND_USE_SIMPLE_STRATEGY", use_simple)
+        resp = await mod.chat_stream(None, mod.ChatRequest(user_input="hello", session_id=f"ceiling-{use_simple}"))
+        async for _ in resp.body_iterator:
+            pass
+
+    # An unset stream LLM timeout falls back to the stream budget instead of 0 (no adaptive timeout).
+    assert timeouts == [40.0, 40.0]
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_forwards_each_upstream_delta_as_it_arrives(monkeypatch):
+    mod = _load_module()
+
+    # The old sleep-based replay knob must have no effect.
+    monkeypatch.setenv("AGENT_BACKEND_STREAM_DELAY_MS", "200")
+    deltas = ["Buy", " the", " dip", " slowly", "."]
+    yielded_at = []
+
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=True)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            async def _gen():
+                acc = '{"assistant_text": "'
+                for d in deltas:
+                    await asyncio.sleep(0.05)
+                    acc += d
+                    yielded_at.append(time.perf_counter())
+                    yield SimpleNamespace(content=[{"type": "text", "text": acc}])
+                acc += '", "intent": "chat", "params": {}, "actions": []}'
+                yield SimpleNamespace(content=[{"type": "text", "text": acc}])
+
+            return _gen()
+
+    mod.MODEL_BUNDLE = mod._ModelBundle(model=FakeModel(), formatter=_FakeFormatter())
+    mod.SESSION_STORE = mod._InMemorySessionStore(ttl_seconds=60)
+    mod.TOOLKIT = mod.Toolkit()
+
+    resp = await mod.chat_stream(None, mod.ChatRequest(user_input="hello", session_id="deltas"))
+    chunks = []
+    async for part in resp.body_iterator:
+        if part.startswith("event: "):
+            name, payload, _ = _sse_frame(part)
+            if name == "chunk":
+                chunks.append((payload["delta_text"], time.perf_counter()))
+            elif name == "done":
+                assert payload["assistant_text"] == "".join(deltas)
+
+    # One chunk per upstream delta, in order, each sent as soon as it arrives.
+    assert [text for text, _ in chunks] == deltas
+    lags = [sent - yielded for (_, sent), yielded in zip(chunks, yielded_at)]
+    assert max(lags) < 0.03
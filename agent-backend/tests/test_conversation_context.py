@@ -0,0 +1,139 @@
+import asyncio
+import importlib.util
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+
+def _load_module():
+    os.environ["AGENT_BACKEND_DISABLE_STARTUP"] = "1"
+
+    path = Path(__file__).resolve().parents[1] / "main.py"
+    spec = importlib.util.spec_from_file_location("agent_backend_main", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class _FakeFormatter:
+    async def format(self, msgs, **kwargs):
+        return [{"role": m.role, "content": m.content} for m in msgs]
+
+
+def _turns(mod, n, text="x"):
+    msgs = []
+    for i in range(n):
+        msgs.append(mod.Msg(name="user", role="user", content=f"q{i} {text}"))
+        msgs.append(mod.Msg(name="assistant", role="assistant", content=f"a{i} {text}"))
+    return msgs
+
+
+def test_estimate_tokens_counts_cjk_per_char():
+    mod = _load_module()
+
+    assert mod._estimate_tokens("") == 0
+    assert mod._estimate_tokens("比特币策略") == 5
+    assert mod._estimate_tokens("abcdefgh") == 2
+
+
+def test_build_keeps_last_turns_verbatim():
+    mod = _load_module()
+
+    ctx = mod._ConversationContext(max_turns=2, token_budget=0)
+    msgs = _turns(mod, 5)
+
+    # Without a summary older turns are dropped, not sent verbatim.
+    assert [m.content for m in ctx.build(msgs, None)] == ["q3 x", "a3 x", "q4 x", "a4 x"]
+
+    out = ctx.build(msgs, ("older stuff", 6))
+    assert out[0].content.endswith("older stuff")
+    assert [m.content for m in out[1:]] == ["q3 x", "a3 x", "q4 x", "a4 x"]
+
+
+def test_build_bounds_history_with_summaries_disabled():
+    mod = _load_module()
+
+    ctx = mod._ConversationContext(max_turns=6, token_budget=0, summarize=False)
+    msgs = _turns(mod, 20)
+
+    out = ctx.build(msgs, None)
+
+    assert len(out) == 12
+    assert out[0].content == "q14 x"
+
+
+def test_build_enforces_token_budget_on_turn_boundaries():
+    mod = _load_module()
+
+    ctx = mod._ConversationContext(max_turns=10, token_budget=60)
+    msgs = _turns(mod, 6, text="y" * 80)
+
+    out = ctx.build(msgs, None)
+
+    assert out and out[0].role == "user"
+    assert out[-1].content.startswith("a5")
+    assert sum(mod._msg_tokens(m) for m in out) <= 60
+
+
+def test_maybe_summarize_runs_in_background():
+    mod = _load_module()
+
+    calls = []
+
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            calls.append(messages)
+            await asyncio.sleep(0.05)
+            return SimpleNamespace(content=[{"type": "text", "text": "user likes BTC grid"}])
+
+    bundle = mod._ModelBundle(model=FakeModel(), formatter=_FakeFormatter())
+    ctx = mod._ConversationContext(max_turns=2, token_budget=0)
+    msgs = _turns(mod, 4)
+    seen = {}
+
+    async def run():
+        ctx.maybe_summarize("s", msgs, None, bundle, on_summary=lambda text, upto: seen.update(text=text, upto=upto))
+        assert seen == {}
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+
+    assert seen == {"text": "user likes BTC grid", "upto": 4}
+    assert "q0 x" in calls[0][1]["content"]
+    assert "q2 x" not in calls[0][1]["content"]
+
+
+def test_maybe_summarize_folds_long_backlog_in_bounded_passes():
+    mod = _load_module()
+
+    prompts = []
+
+    class FakeModel(mod.ChatModelBase):
+        def __init__(self):
+            super().__init__(model_name="fake", stream=False)
+
+        async def __call__(self, messages, tools=None, tool_choice=None, structured_model=None, **kwargs):
+            prompts.append(messages[1]["content"])
+            return SimpleNamespace(content=[{"type": "text", "text": f"summary {len(prompts)}"}])
+
+    bundle = mod._ModelBundle(model=FakeModel(), formatter=_FakeFormatter())
+    msgs = _turns(mod, 12, text="y" * 40)
+    turn_tokens = mod._msg_tokens(msgs[0]) + mod._msg_tokens(msgs[1])
+    ctx = mod._ConversationContext(max_turns=2, token_budget=0, summary_max_tokens=3 * turn_tokens)
+    seen = []
+
+    async def run():
+        # No stored summary (e.g. after a restart): ten old turns to fold.
+        ctx.maybe_summarize("s", msgs, None, bundle, on_summary=lambda text, upto: seen.append((text, upto)))
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+
+    assert seen == [("summary 1", 6), ("summary 2", 12), ("summary 3", 18), ("summary 4", 20)]
+    assert all(mod._estimate_tokens(p.split("New messages:\n", 1)[1]) <= 3 * turn_tokens + 10 for p in prompts)
+    assert "q0 " in prompts[0] and "q3 " not in prompts[0]
+    assert prompts[1].startswith("Previous summary:\nsummary 1")
+    assert "q9 " in prompts[3] and "q10 " not in prompts[3]
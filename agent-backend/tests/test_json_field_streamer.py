@@ -0,0 +1,87 @@
+import importlib.util
+import json
+import os
+from pathlib import Path
+
+
+def _load_module():
+    os.environ["AGENT_BACKEND_DISABLE_STARTUP"] = "1"
+
+    path = Path(__file__).resolve().parents[1] / "main.py"
+    spec = importlib.util.spec_from_file_location("agent_backend_main", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+_FIELDS = ("assistant_text", "rationale", "risk_notes")
+
+_PLAN = {
+    "intent": "grid",
+    "params": {"levels": [1, {"note": 'braces } ] " inside'}], "nested": {"assistant_text": "not top-level"}},
+    "size": -1.5e3,
+    "confirm": True,
+    "assistant_text": 'Grid on BTC: "tight" range \\ 新 😀\n\tend/',
+    "rationale": "Range-bound ✓",
+    "risk_notes": ["Breakout risk ]", "Fees 😀"],
+    "extra": None,
+}
+
+
+def _collect(streamer, raw, size):
+    acc = {}
+    for i in range(0, len(raw), size):
+        for field, text in streamer.feed(raw[i : i + size]).items():
+            acc[field] = acc.get(field, "") + text
+    return acc
+
+
+def test_streams_selected_top_level_fields_at_any_split():
+    mod = _load_module()
+
+    for ensure_ascii in (True, False):
+        raw = "Here you go:\n```json\n" + json.dumps(_PLAN, ensure_ascii=ensure_ascii) + "\n```"
+        for size in (1, 2, 3, 5, 7, 64, len(raw)):
+            streamer = mod._JsonStringFieldStreamer(_FIELDS)
+            acc = _collect(streamer, raw, size)
+
+            assert acc["assistant_text"] == _PLAN["assistant_text"], (ensure_ascii, size)
+            assert acc["rationale"] == _PLAN["rationale"]
+            assert acc["risk_notes"] == "\n".join(_PLAN["risk_notes"])
+            assert streamer.done
+
+
+def test_text_is_emitted_before_string_closes():
+    mod = _load_module()
+    streamer = mod._JsonStringFieldStreamer(("assistant_text",))
+
+    assert streamer.feed('{"intent":"chat","assistant_text":"Hel') == {"assistant_text": "Hel"}
+    assert streamer.feed('lo \\ud83d') == {"assistant_text": "lo "}
+    assert streamer.feed('\\ude00 wor') == {"assistant_text": "😀 wor"}
+    assert streamer.feed('ld"}') == {"assistant_text": "ld"}
+    assert streamer.feed('{"assistant_text":"ignored"}') == {}
+
+
+def test_lone_surrogates_and_bad_escapes_become_replacement_chars():
+    mod = _load_module()
+    streamer = mod._JsonStringFieldStreamer(("assistant_text",))
+
+    out = streamer.feed('{"assistant_text":"a\\ud83db\\ude00c\\uzzzzd"}')
+
+    assert out == {"assistant_text": "a�b�c�zzzzd"}
+    assert streamer.done
+
+
+def test_value_fields_are_queued_as_soon_as_they_complete():
+    mod = _load_module()
+    streamer = mod._JsonStringFieldStreamer(("assistant_text",), ("intent", "actions"))
+
+    streamer.feed('{"intent": "start_gr')
+    assert streamer.pop_values() == []
+    streamer.feed('id", "actions": [{"type": "start_grid", "params": {"note": "}\\')
+    assert streamer.pop_values() == [("intent", "start_grid")]
+    streamer.feed('""}}, {"type": "none"')
+    assert streamer.pop_values() == [("actions", {"type": "start_grid", "params": {"note": '}"'}})]
+    streamer.feed("}]}")
+    assert streamer.pop_values() == [("actions", {"type": "none"})]
+    assert streamer.done
@@ -3,6 +3,8 @@ import os
 import time
 from pathlib import Path
 
+import pytest
+
 
 def _load_module():
     os.environ["AGENT_BACKEND_DISABLE_STARTUP"] = "1"
@@ -26,9 +28,316 @@ def test_session_ttl_cleanup_expires_entry():
 
     async def run():
         await store.save_memory(sid, memory)
-        store._entries[sid] = mod._SessionEntry(memory_state=memory.state_dict(), last_access_unix_s=time.time() - 10)
+        store._entries[sid] = mod._SessionEntry(memory=memory, last_access_unix_s=time.time() - 10)
         await store.cleanup_expired()
 
     asyncio.run(run())
 
     assert sid not in store._entries
+
+
+async def _memory_with(mod, *texts):
+    memory = mod.InMemoryMemory()
+    for t in texts:
+        await mod._maybe_await(memory.add(mod.Msg(name="user", role="user", content=t)))
+    return memory
+
+
+def _texts(mod, memory):
+    import asyncio
+
+    msgs = asyncio.run(mod._get_memory_msgs(memory))
+    return [m.content for m in msgs]
+
+
+def test_sqlite_backend_survives_store_restart(tmp_path):
+    mod = _load_module()
+    import asyncio
+
+    db = str(tmp_path / "sessions.sqlite3")
+
+    async def write():
+        store = mod._InMemorySessionStore(ttl_seconds=60, backend=mod._SqliteSessionBackend(db, ttl_seconds=60))
+        await store.save_memory("s", await _memory_with(mod, "hello", "world"))
+        await store.close()
+
+    async def read():
+        store = mod._InMemorySessionStore(ttl_seconds=60, backend=mod._SqliteSessionBackend(db, ttl_seconds=60))
+        memory = await store.load_memory("s")
+        await store.close()
+        return memory
+
+    asyncio.run(write())
+    assert _texts(mod, asyncio.run(read())) == ["hello", "world"]
+
+
+def test_save_memory_is_write_behind_and_batched():
+    mod = _load_module()
+    import asyncio
+
+    class SlowBackend(mod._SessionBackend):
+        def __init__(self):
+            self.batches = []
+
+        async def load(self, session_id):
+            return None
+
+        async def append_many(self, deltas):
+            await asyncio.sleep(0.2)
+            self.batches.append(dict(deltas))
+
+        async def delete(self, session_id):
+            return None
+
+    backend = SlowBackend()
+
+    async def run():
+        store = mod._InMemorySessionStore(ttl_seconds=60, backend=backend, flush_interval_s=0.05)
+        t0 = time.monotonic()
+        for i in range(20):
+            await store.save_memory(f"s{i}", mod.InMemoryMemory())
+        elapsed = time.monotonic() - t0
+        assert backend.batches == []
+        await store.flush()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 0.1
+    assert len(backend.batches) == 1
+    assert len(backend.batches[0]) == 20
+
+
+class _FakeRedisServer:
+    """Tiny RESP2 server covering the commands used by `_RedisSessionBackend`."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.fail = set()
+        self._server = None
+
+    async def start(self):
+        import asyncio
+
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        assert line.startswith(b"*")
+        args = []
+        for _ in range(int(line[1:-2])):
+            size_line = await reader.readline()
+            payload = await reader.readexactly(int(size_line[1:-2]) + 2)
+            args.append(payload[:-2])
+        return args
+
+    async def _handle(self, reader, writer):
+        while True:
+            args = await self._read_command(reader)
+            if args is None:
+                break
+            name = args[0].decode().upper()
+            self.commands.append(name)
+            writer.write(self._dispatch(name, args[1:]))
+            await writer.drain()
+        writer.close()
+
+    def _dispatch(self, name, args):
+        if name in self.fail:
+            self.fail.discard(name)
+            return b"-ERR injected failure\r\n"
+        if name == "HSET":
+            h = self.data.setdefault(args[0], {})
+            for i in range(1, len(args), 2):
+                h[args[i]] = args[i + 1]
+            return b":%d\r\n" % ((len(args) - 1) // 2)
+        if name == "HGETALL":
+            h = self.data.get(args[0], {})
+            out = [b"*%d\r\n" % (2 * len(h))]
+            for k, v in h.items():
+                out.append(b"$%d\r\n%s\r\n$%d\r\n%s\r\n" % (len(k), k, len(v), v))
+            return b"".join(out)
+        if name == "EXPIRE":
+            return b":1\r\n"
+        if name == "DEL":
+            return b":%d\r\n" % (1 if self.data.pop(args[0], None) is not None else 0)
+        return b"-ERR unknown command\r\n"
+
+
+def test_redis_backend_round_trip_against_fake_server():
+    mod = _load_module()
+    import asyncio
+
+    fake = _FakeRedisServer()
+
+    async def run():
+        port = await fake.start()
+        try:
+            url = f"redis://127.0.0.1:{port}/0"
+            store = mod._InMemorySessionStore(ttl_seconds=60, backend=mod._RedisSessionBackend(url, ttl_seconds=60))
+            await store.save_memory("a", await _memory_with(mod, "one"))
+            await store.save_memory("b", await _memory_with(mod, "two"))
+            await store.close()
+
+            fresh = mod._InMemorySessionStore(ttl_seconds=60, backend=mod._RedisSessionBackend(url, ttl_seconds=60))
+            memory = await fresh.load_memory("a")
+            missing = await fresh.load_memory("zzz")
+            await fresh.close()
+            return memory, missing
+        finally:
+            await fake.stop()
+
+    memory, missing = asyncio.run(run())
+    assert _texts(mod, memory) == ["one"]
+    assert _texts(mod, missing) == []
+    assert fake.commands.count("HSET") == 2
+
+
+def test_redis_backend_recovers_after_error_reply_mid_pipeline():
+    mod = _load_module()
+    import asyncio
+
+    fake = _FakeRedisServer()
+
+    async def run():
+        port = await fake.start()
+        try:
+            backend = mod._RedisSessionBackend(f"redis://127.0.0.1:{port}/0", ttl_seconds=60)
+            delta = {"start": 0, "messages": [{"role": "user", "content": "one"}], "replace": False, "last_access_unix_s": 0}
+            fake.fail.add("HSET")
+            with pytest.raises(RuntimeError, match="redis_error"):
+                # HSET fails, EXPIRE's reply is still pending behind it.
+                await backend.append_many({"a": delta})
+            await backend.append_many({"a": delta})
+            loaded = await backend.load("a")
+            await backend.close()
+            return loaded
+        finally:
+            await fake.stop()
+
+    assert asyncio.run(run()) == [{"role": "user", "content": "one"}]
+
+
+def test_max_sessions_evicts_least_recently_used():
+    mod = _load_module()
+    import asyncio
+
+    store = mod._InMemorySessionStore(ttl_seconds=60, max_sessions=2)
+
+    async def run():
+        await store.save_memory("a", mod.InMemoryMemory())
+        await store.save_memory("b", mod.InMemoryMemory())
+        await store.load_memory("a")
+        await store.save_memory("c", mod.InMemoryMemory())
+
+    asyncio.run(run())
+
+    assert list(store._entries) == ["a", "c"]
+
+
+def test_cleanup_expired_stops_at_first_live_entry():
+    mod = _load_module()
+    import asyncio
+
+    store = mod._InMemorySessionStore(ttl_seconds=5)
+    now = time.time()
+    for i in range(3):
+        store._entries[f"old{i}"] = mod._SessionEntry(memory=mod.InMemoryMemory(), last_access_unix_s=now - 10)
+    for i in range(3):
+        store._entries[f"live{i}"] = mod._SessionEntry(memory=mod.InMemoryMemory(), last_access_unix_s=now)
+
+    asyncio.run(store.cleanup_expired())
+
+    assert list(store._entries) == ["live0", "live1", "live2"]
+
+
+def test_save_memory_persists_only_new_messages():
+    mod = _load_module()
+    import asyncio
+
+    class RecordingBackend(mod._SessionBackend):
+        def __init__(self):
+            self.deltas = []
+
+        async def load(self, session_id):
+            return None
+
+        async def append_many(self, deltas):
+            self.deltas.extend(deltas.values())
+
+        async def delete(self, session_id):
+            return None
+
+    backend = RecordingBackend()
+    store = mod._InMemorySessionStore(ttl_seconds=60, backend=backend)
+
+    async def run():
+        for turn in range(3):
+            memory = await store.load_memory("s")
+            await mod._maybe_await(memory.add(mod.Msg(name="user", role="user", content=f"q{turn}")))
+            await mod._maybe_await(memory.add(mod.Msg(name="assistant", role="assistant", content=f"a{turn}")))
+            await store.save_memory("s", memory)
+            await store.flush()
+        return await store.load_memory("s")
+
+    memory = asyncio.run(run())
+
+    assert [d["start"] for d in backend.deltas] == [0, 2, 4]
+    assert [len(d["messages"]) for d in backend.deltas] == [2, 2, 2]
+    assert backend.deltas[2]["messages"][0]["content"] == "q2"
+    assert memory is store._entries["s"].memory
+    assert len(_texts(mod, memory)) == 6
+
+
+def test_sqlite_backend_appends_across_restarts(tmp_path):
+    mod = _load_module()
+    import asyncio
+
+    db = str(tmp_path / "sessions.sqlite3")
+
+    async def turn(text):
+        store = mod._InMemorySessionStore(ttl_seconds=60, backend=mod._SqliteSessionBackend(db, ttl_seconds=60))
+        memory = await store.load_memory("s")
+        await mod._maybe_await(memory.add(mod.Msg(name="user", role="user", content=text)))
+        await store.save_memory("s", memory)
+        await store.close()
+
+    asyncio.run(turn("first"))
+    asyncio.run(turn("second"))
+
+    async def read():
+        store = mod._InMemorySessionStore(ttl_seconds=60, backend=mod._SqliteSessionBackend(db, ttl_seconds=60))
+        memory = await store.load_memory("s")
+        await store.close()
+        return memory
+
+    assert _texts(mod, asyncio.run(read())) == ["first", "second"]
+
+
+def test_session_lock_serializes_and_is_released():
+    mod = _load_module()
+    import asyncio
+
+    store = mod._InMemorySessionStore(ttl_seconds=60)
+    order = []
+
+    async def worker(name):
+        async with store.session_lock("s"):
+            order.append(f"{name}-in")
+            await asyncio.sleep(0.01)
+            order.append(f"{name}-out")
+
+    async def run():
+        await asyncio.gather(worker("a"), worker("b"))
+
+    asyncio.run(run())
+
+    assert order == ["a-in", "a-out", "b-in", "b-out"]
+    assert len(store._locks) == 0